@@ -48,5 +48,19 @@ if fn_name == 'get_interpolant':
         print('Success')
     else:
         print('Fail')
+    # compare the default (searchsorted) and original (mask) methods
+    # using random points, some out of range, some nan, and some on xvec
+    xvec = np.cumsum(np.random.rand(500)) - 10
+    x = np.concatenate((np.random.uniform(-20, 500, 10000), xvec,
+                        np.array([np.nan, xvec[0], xvec[-1]])))
+    for exn in [False, True]:
+        a = fn(x, xvec, extrap_nan=exn)
+        A = fn(x, xvec, extrap_nan=exn, method='mask')
+        same = ((a[0]==A[0]).all() and (a[1]==A[1]).all()
+            and np.array_equal(a[2], A[2], equal_nan=True))
+        if same:
+            print('Success: methods agree, extrap_nan=' + str(exn))
+        else:
+            print('Fail: methods differ, extrap_nan=' + str(exn))
     
 
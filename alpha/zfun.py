@@ -62,7 +62,7 @@ def interp_scattered_on_plaid(x, y, xvec, yvec, u, exnan=True):
 
     return ui
 
-def get_interpolant(x, xvec, extrap_nan=False):
+def get_interpolant(x, xvec, extrap_nan=False, method='searchsorted'):
     """
     Returns info to allow fast interpolation.
 
@@ -79,6 +79,11 @@ def get_interpolant(x, xvec, extrap_nan=False):
     the interpolant for the first or last point.
     E.g. [0, 1, 0.] for x < xvec.min()
     
+    method='searchsorted' (the default) finds the indices with a binary
+    search, which takes O(nx*log(nxvec)) time and no extra memory.
+    method='mask' is the original version, which makes an (nx, nxvec)
+    matrix, and is kept for testing.  They give identical results.
+    
     Output: three 1-D numpy arrays of the same size as x
     i0 = index below [int]
     i1 = index above [int]
@@ -117,20 +122,22 @@ def get_interpolant(x, xvec, extrap_nan=False):
     nx = len(x)
     nxvec = len(xvec)
 
-    X = x.reshape(nx, 1) # column vector
-    xvec = xvec.reshape(1, nxvec)
-    XVEC = xvec.repeat(nx, axis=0) # matrix
-
-    # preallocate results arrays
-    i0 = np.zeros(nx, dtype=int)
-    i1 = np.zeros(nx, dtype=int)
-    fr = np.zeros(nx, dtype=float)
-
-    # calculate index columns
-    mask = X >= XVEC
-    # the above line broadcasts correctly even if nx = nxvec
-    # because we forced X to be a column vector
-    i0 = mask.sum(axis=1) - 1
+    if method == 'searchsorted':
+        # i0 = number of points in xvec <= x, minus one
+        i0 = np.searchsorted(xvec, x, side='right') - 1
+        # searchsorted puts nan at the end, but we treat it as below the range
+        # (as in the 'mask' method)
+        i0[np.isnan(x)] = -1
+    elif method == 'mask':
+        X = x.reshape(nx, 1) # column vector
+        XVEC = xvec.reshape(1, nxvec).repeat(nx, axis=0) # matrix
+        # calculate index columns
+        mask = X >= XVEC
+        # the above line broadcasts correctly even if nx = nxvec
+        # because we forced X to be a column vector
+        i0 = mask.sum(axis=1) - 1
+    else:
+        raise ValueError("get_interpolant(): method must be 'searchsorted' or 'mask'")
 
     # these masks are used to handle values of x beyond the range of xvec
     lomask = i0 < 0
@@ -140,8 +147,8 @@ def get_interpolant(x, xvec, extrap_nan=False):
     i1 = i0 + 1
 
     # compute the fraction
-    xvec0 = xvec[0,i0]
-    xvec1 = xvec[0,i1]
+    xvec0 = xvec[i0]
+    xvec1 = xvec[i1]
     fr = (x - xvec0)/(xvec1 - xvec0)
 
     # fractions for out of range x
@@ -152,7 +159,7 @@ def get_interpolant(x, xvec, extrap_nan=False):
         fr[lomask] = np.nan
         fr[himask] = np.nan
         # override for the case where x = the last point of xvec
-        fr[X[:,0]==XVEC[0,-1]] = 1.0
+        fr[x==xvec[-1]] = 1.0
 
     return i0, i1, fr
 
@@ -166,7 +173,61 @@ def find_nearest_ind(array, value):
     idx = (np.abs(array-value)).argmin()
     return idx
 
-def filt_AB8d(data):
+def filt_axis(data, filt, axis=0, shift=None, nf_direct=500):
+    """
+    Convolves data with the vector filt along the given axis.
+    Input:
+        data = ND numpy array
+        filt = vector of weights
+        axis = the axis to filter along (e.g. time)
+        shift = index in the full convolution of the first output point.  The
+            default (len(filt)-1)//2 centers filt like np.convolve(mode='same').
+        nf_direct = filters longer than this are done with FFT's in blocks
+            (scipy.signal.oaconvolve), and shorter ones directly.
+    Output:
+        an array of the same size as data.  Any output point whose window
+        includes a nan in data is nan, just as with np.convolve().
+
+    For the direct method all the columns are done by a single np.convolve(),
+    as in the old filt_godin_mat(), but with len(filt) zeros between columns
+    so that they do not mix.
+    """
+    data = np.asarray(data, dtype=float)
+    nf = len(filt)
+    if shift == None:
+        shift = (nf-1)//2
+    # pack as rows with the filter axis last
+    dm = np.moveaxis(data, axis, -1)
+    sh = dm.shape
+    nt = sh[-1]
+    d2 = dm.reshape((-1, nt))
+    if nf <= nf_direct:
+        dp = np.zeros((d2.shape[0], nt + nf))
+        dp[:, :nt] = d2
+        full = np.convolve(dp.ravel(), filt, mode='full')[:dp.size].reshape(dp.shape)
+    else:
+        from scipy.signal import oaconvolve
+        bad = ~np.isfinite(d2)
+        full = oaconvolve(np.where(bad, 0, d2), np.reshape(filt, (1, nf)),
+            mode='full', axes=1)
+        if bad.any():
+            nbad = oaconvolve(bad.astype(float), np.ones((1, nf)), mode='full', axes=1)
+            full[nbad > 0.5] = np.nan
+    smooth = full[:, shift:shift+nt].reshape(sh)
+    return np.moveaxis(smooth, -1, axis)
+    
+def nan_ends(smooth, n0, n1, axis=0):
+    # set the first n0 and last n1 values of smooth along axis to nan, in place
+    ii = [slice(None)] * smooth.ndim
+    if n0 > 0:
+        ii[axis] = slice(None, n0)
+        smooth[tuple(ii)] = np.nan
+    if n1 > 0:
+        ii[axis] = slice(-n1, None)
+        smooth[tuple(ii)] = np.nan
+    return smooth
+
+def filt_AB8d(data, axis=0):
     """
     % 8/28/2013  Parker MacCready
     % ** use ONLY with hourly data! **
@@ -178,22 +239,21 @@ def filt_AB8d(data):
     % with the weighting decaying from 1 to 1/e at t - 8 days.  There are 192
     % hours in 8 days.
     Input:
-        assumed to be a 1D numpy array
+        a numpy array, filtered along axis (default 0)
     Output:
-        a vector of the same size you started with,
-        padded with NaN's at the ends.
+        an array of the same size you started with,
+        padded with NaN's at the start.
     """
     fl = 8*24;
     filt = np.exp(np.linspace(-1,0,fl))
     filt = filt/filt.sum();
-    smooth = np.nan*data
-    for ii in range(fl+1, len(data)):
-        smooth[ii] = (filt*data[ii-fl+1: ii + 1]).sum()
-    return smooth
+    # the filter only looks back in time
+    smooth = filt_axis(data, filt[::-1], axis=axis, shift=0)
+    return nan_ends(smooth, fl+1, 0, axis=axis)
 
-def filt_hanning(data, n=40):
+def filt_hanning(data, n=40, axis=0):
     """
-    Input: 1D numpy array data
+    Input: numpy array data, filtered along axis (default 0)
     Output: Array of the same size, filtered with Hanning window of length n,
         padded with nan's
     If n=1 it just returns matrix you gave it
@@ -203,58 +263,42 @@ def filt_hanning(data, n=40):
     else:
         filt = hanning_shape(n=n)
         npad = np.floor(len(filt)/2).astype(int)
-        smooth = np.convolve(data, filt, mode = 'same')
-        smooth[:npad] = np.nan
-        smooth[-npad:] = np.nan
+        smooth = filt_axis(data, filt, axis=axis)
+        smooth = nan_ends(smooth, npad, npad, axis=axis)
     return smooth
     
-def filt_hanning_mat(data, n=40):
+def filt_hanning_mat(data, n=40, axis=0):
     """
-    Input: ND numpy array, with time on axis 0.
+    Input: ND numpy array, with time on axis 0 (or axis).
     Output: Array of the same size, filtered with Hanning window of length n,
         padded with nan's
     """
     filt = hanning_shape(n=n)
     filt = filt / filt.sum()
     n = np.ceil(len(filt)/2).astype(int)
-    sh = data.shape
-    df = data.flatten('F')
-    dfs = np.convolve(df, filt, mode = 'same')
-    smooth = dfs.reshape(sh, order='F')
-    smooth[:n,:] = np.nan
-    smooth[-n:,:] = np.nan
-    return smooth
+    smooth = filt_axis(data, filt, axis=axis)
+    return nan_ends(smooth, n, n, axis=axis)
 
-def filt_godin(data):
+def filt_godin(data, axis=0):
     """
-    Input: 1D numpy array of HOURLY values
+    Input: numpy array of HOURLY values, filtered along axis (default 0)
     Output: Array of the same size, filtered with 24-24-25 Godin filter,
         padded with nan's
     """
     filt = godin_shape()
     filt = filt / filt.sum()
     n = np.ceil(len(filt)/2).astype(int)
-    smooth = np.convolve(data, filt, mode = 'same')
-    smooth[:n] = np.nan
-    smooth[-n:] = np.nan
-    return smooth
+    smooth = filt_axis(data, filt, axis=axis)
+    return nan_ends(smooth, n, n, axis=axis)
 
-def filt_godin_mat(data):
+def filt_godin_mat(data, axis=0):
     """
-    Input: ND numpy array of HOURLY, with time on axis 0.
+    Input: ND numpy array of HOURLY, with time on axis 0 (or axis).
     Output: Array of the same size, filtered with 24-24-25 Godin filter,
         padded with nan's
+    Now the same as filt_godin().
     """
-    filt = godin_shape()
-    filt = filt / filt.sum()
-    n = np.ceil(len(filt)/2).astype(int)
-    sh = data.shape
-    df = data.flatten('F')
-    dfs = np.convolve(df, filt, mode = 'same')
-    smooth = dfs.reshape(sh, order='F')
-    smooth[:n,:] = np.nan
-    smooth[-n:,:] = np.nan
-    return smooth
+    return filt_godin(data, axis=axis)
     
 def godin_shape():
     """
@@ -7,7 +7,10 @@ Module of functions specific to ROMS.
 import netCDF4 as nc
 import numpy as np
 
-def get_basic_info(fn, only_G=False, only_S=False, only_T=False):
+# Process-level cache used by get_grid_info(), keyed by get_grid_key().
+grid_cache = dict()
+
+def get_basic_info(fn, only_G=False, only_S=False, only_T=False, cache=False):
     """
     Gets grid, vertical coordinate, and time info from a ROMS NetCDF
     history file with full name 'fn'
@@ -16,6 +19,11 @@ def get_basic_info(fn, only_G=False, only_S=False, only_T=False):
     Example calls:
     G, S, T = zfun.get_basic_info(fn)
     T = zfun.get_basic_info(fn, only_T=True)
+    Use cache=True to get G and S from get_grid_info().  Once the grid is in
+    the cache this only reads h, the masks, and the vertical coordinate info,
+    so it is faster when called many times for the same grid (e.g. making
+    movies).
+    Then G and S are shared with other callers so do not modify them.
     """
     ds = nc.Dataset(fn,'r')
     def make_G(ds):
@@ -66,7 +74,19 @@ def get_basic_info(fn, only_G=False, only_S=False, only_T=False):
         T['tm'] = tt + delta
         return T
     # return results
-    if only_G:
+    if cache and not only_T:
+        key = get_grid_key(ds)
+        if key in grid_cache.keys():
+            G, S, Z = grid_cache[key]
+        else:
+            G, S, Z = get_grid_info(fn)
+        if only_G:
+            return G
+        elif only_S:
+            return S
+        else:
+            return G, S, make_T(ds)
+    elif only_G:
         return make_G(ds)
     elif only_S:
         return make_S(ds)
@@ -75,7 +95,88 @@ def get_basic_info(fn, only_G=False, only_S=False, only_T=False):
     else:
         return make_G(ds), make_S(ds), make_T(ds)
 
-def get_z(h, zeta, S, only_rho=False, only_w=False):
+def get_grid_hash(G, S=None):
+    """
+    Returns a short string that identifies a grid, made from the
+    coordinates, masks, and bathymetry in G (and the vertical
+    coordinate info in S if it is passed).  This can be saved with
+    products made from the grid and checked later to make sure they are
+    not stale.
+    Example call:
+    ghash = zrfun.get_grid_hash(G, S)
+    """
+    import hashlib
+    hh = hashlib.sha1()
+    for vv in ['lon_rho', 'lat_rho', 'mask_rho', 'mask_u', 'mask_v', 'h']:
+        hh.update(np.ascontiguousarray(np.ma.getdata(G[vv]), dtype=float).tobytes())
+    if S is not None:
+        for vv in ['Cs_r', 'Cs_w', 's_rho', 's_w', 'hc', 'Vtransform']:
+            hh.update(np.ascontiguousarray(np.ma.getdata(S[vv]), dtype=float).tobytes())
+    return hh.hexdigest()[:16]
+
+def get_grid_key(ds):
+    """
+    Returns the key of the grid of the open history file ds, used by
+    get_grid_info().  It is made from the vertical coordinate info, a CRC32
+    checksum of h and the masks, and the corner positions, so it only reads
+    a few 2-D fields, rather than all of G as in get_grid_hash().
+    """
+    import hashlib, zlib
+    hh = hashlib.sha1()
+    for vv in ['s_rho', 's_w', 'hc', 'Cs_r', 'Cs_w', 'Vtransform']:
+        hh.update(np.ascontiguousarray(np.ma.getdata(ds[vv][:]), dtype=float).tobytes())
+    for vv in ['h', 'mask_rho', 'mask_u', 'mask_v']:
+        aa = np.ascontiguousarray(np.ma.getdata(ds[vv][:]))
+        hh.update(str((aa.shape, zlib.crc32(aa))).encode())
+    for vv in ['lon_rho', 'lat_rho']:
+        hh.update(np.ascontiguousarray(np.ma.getdata(ds[vv][[0, -1], [0, -1]]),
+            dtype=float).tobytes())
+    return hh.hexdigest()[:16]
+
+def get_grid_info(fn, npz_dir=None):
+    """
+    Gets G and S, as from get_basic_info(), and also a dict Z of static
+    fields that many tools need:
+    z_rho, z_w = 3-D z positions of rho and w points for zeta = 0
+    h_u, h_v = bathymetric depth at u and v points
+    DA = area of each rho cell (m2)
+    These are saved in a process-level cache keyed by get_grid_key(), so
+    later calls for the same grid only read the fields in the key, and
+    G and S are only read from fn the first time.
+    If npz_dir is given Z is also saved there as grid_[key].npz, and later
+    processes load that instead of computing it.
+    NOTE: the returned dicts are shared by all callers, so do not modify them.
+    Example call:
+    G, S, Z = zrfun.get_grid_info(fn)
+    """
+    ds = nc.Dataset(fn)
+    key = get_grid_key(ds)
+    ds.close()
+    if key in grid_cache.keys():
+        return grid_cache[key]
+    G = get_basic_info(fn, only_G=True)
+    S = get_basic_info(fn, only_S=True)
+    import os
+    npz_fn = None
+    if npz_dir is not None:
+        npz_fn = os.path.join(npz_dir, 'grid_' + key + '.npz')
+    if (npz_fn is not None) and os.path.isfile(npz_fn):
+        A = np.load(npz_fn)
+        Z = {vv: A[vv] for vv in A.files}
+        A.close()
+    else:
+        h = G['h']
+        Z = dict()
+        Z['z_rho'], Z['z_w'] = get_z(h, 0*h, S)
+        Z['h_u'] = (h[:,:-1] + h[:,1:])/2
+        Z['h_v'] = (h[:-1,:] + h[1:,:])/2
+        Z['DA'] = G['DX'] * G['DY']
+        if npz_fn is not None:
+            np.savez(npz_fn, **{vv: np.ma.filled(Z[vv], np.nan) for vv in Z.keys()})
+    grid_cache[key] = (G, S, Z)
+    return grid_cache[key]
+
+def get_z(h, zeta, S, only_rho=False, only_w=False, dtype=float, out=None):
     """
     Used to calculate the z position of fields in a ROMS history file
 
@@ -84,6 +185,17 @@ def get_z(h, zeta, S, only_rho=False, only_w=False):
 
     Output: 3-D arrays of z_rho and z_w
 
+    *kwargs*
+    dtype = the type of the output, e.g. np.float32 to save memory for
+    plotting and extractions (the default is float64).
+    out = an existing array of size (N, M, L) to put z_rho or z_w into, or a
+    tuple (z_rho_out, z_w_out) if you are getting both.  Using this avoids
+    making new output arrays when this is called every hour.
+
+    The calculation uses broadcasting so that the only 3-D arrays made are the
+    outputs, and when getting both z_rho and z_w the 2-D intermediate
+    arrays are only computed once.
+
     NOTE: one foible is that if you input arrays of h and zeta that are
     vectors of length VL, the output array (e.g. z_rho) will have size (N, VL)
     (i.e. it will never return an array with size (N, VL, 1), even if (VL, 1) was
@@ -107,62 +219,71 @@ def get_z(h, zeta, S, only_rho=False, only_w=False):
     if h.shape != zeta.shape:
         print('WARNING from get_z(): h and zeta must be the same shape')
     M, L = h.shape
-    def make_z_rho(h, zeta, S, N, M, L):
-        # rho
-        # create some useful arrays
-        csr = S['Cs_r']
-        csrr = csr.reshape(N, 1, 1).copy()
-        Cs_r = np.tile(csrr, [1, M, L])
-        H_r = np.tile(h.reshape(1, M, L).copy(), [N, 1, 1])
-        Zeta_r = np.tile(zeta.reshape(1, M, L).copy(), [N, 1, 1])
-        if S['hc'] == 0: # if hc = 0 the transform is simpler (and faster)
-            z_rho = H_r*Cs_r + Zeta_r + Zeta_r*Cs_r
-        elif S['hc'] != 0: # need to calculate a few more useful arrays
-            sr = S['s_rho'] # PM edit 2019.01.24
-            srr = sr.reshape(N, 1, 1).copy()
-            S_rho = np.tile(srr, [1, M, L])
-            Hc_r = np.tile(S['hc'], [N, M, L])
-            if S['Vtransform'] == 1:
-                zr0 = (S_rho - Cs_r) * Hc_r + Cs_r*H_r
-                z_rho = zr0 + Zeta_r * (1 + zr0/H_r)
-            elif S['Vtransform'] == 2:
-                zr0 = (S_rho*Hc_r + Cs_r*H_r) / (Hc_r + H_r)
-                z_rho = Zeta_r + (Zeta_r + H_r)*zr0
-        z_rho = z_rho.squeeze()
-        return z_rho
-    def make_z_w(h, zeta, S, N, M, L):
-        # w
-        # create some useful arrays
-        csw = S['Cs_w']
-        csww = csw.reshape(N+1, 1, 1).copy()
-        Cs_w = np.tile(csww, [1, M, L])
-        H_w = np.tile(h.reshape(1, M, L).copy(), [N+1, 1, 1])
-        Zeta_w = np.tile(zeta.reshape(1, M, L).copy(), [N+1, 1, 1])
-        if S['hc'] == 0: # if hc = 0 the transform is simpler (and faster)
-            z_w = H_w*Cs_w + Zeta_w + Zeta_w*Cs_w
-        elif S['hc'] != 0: # need to calculate a few more useful arrays
-            #sw = S['s_w']
-            sw = S['s_w'] # PM edit 2019.01.24
-            sww = sw.reshape(N+1, 1, 1).copy()
-            S_w = np.tile(sww, [1, M, L])    #
-            Hc_w = np.tile(S['hc'], [N+1, M, L])
-            if S['Vtransform'] == 1:
-                zw0 = (S_w - Cs_w) * Hc_w + Cs_w*H_w
-                z_w = zw0 + Zeta_w * (1 + zw0/H_w)
-            elif S['Vtransform'] == 2:
-                zw0 = (S_w*Hc_w  + Cs_w*H_w) / (Hc_w + H_w)
-                z_w = Zeta_w + (Zeta_w + H_w)*zw0
-        z_w = z_w.squeeze()
-        return z_w
+    # keep track of masks, so that masked input gives masked output
+    mask = np.ma.getmaskarray(h) | np.ma.getmaskarray(zeta)
+    # 2-D intermediate arrays shared by z_rho and z_w
+    hh = np.ma.getdata(h).astype(float)
+    zz = np.ma.getdata(zeta).astype(float)
+    hc = float(S['hc'])
+    Vtransform = int(S['Vtransform'])
+    if hc == 0: # if hc = 0 the transform is simpler (and faster)
+        # z = Cs*(h + zeta) + zeta
+        fac = (hh + zz).astype(dtype)
+    elif Vtransform == 1:
+        # z = zr0*(1 + zeta/h) + zeta, where zr0 = (s - Cs)*hc + Cs*h
+        fac = (1 + zz/hh).astype(dtype)
+    elif Vtransform == 2:
+        # z = zeta + (zeta + h)*(s*hc + Cs*h)/(hc + h)
+        fac = ((zz + hh)/(hc + hh)).astype(dtype)
+    hd = hh.astype(dtype)
+    zd = zz.astype(dtype)
+    def make_z(s, Cs, zout):
+        # s and Cs are the vertical coordinate vectors for rho or w
+        NZ = len(Cs)
+        Cs3 = np.ma.getdata(Cs).astype(dtype).reshape(NZ, 1, 1)
+        s3 = np.ma.getdata(s).astype(dtype).reshape(NZ, 1, 1)
+        if zout is None:
+            zout = np.empty((NZ, M, L), dtype=dtype)
+        elif zout.shape != (NZ, M, L):
+            print('WARNING from get_z(): out must have shape ' + str((NZ, M, L)))
+        if hc == 0:
+            np.multiply(Cs3, fac, out=zout)
+        elif Vtransform == 1:
+            np.multiply(Cs3, hd, out=zout)
+            zout += (s3 - Cs3)*hc
+            zout *= fac
+        elif Vtransform == 2:
+            np.multiply(Cs3, hd, out=zout)
+            zout += s3*hc
+            zout *= fac
+        zout += zd
+        # the output is a masked array if any of the inputs used are
+        # (which is always the case for S from get_basic_info)
+        input_list = [h, zeta, Cs]
+        if hc != 0:
+            input_list += [s, S['hc']]
+        if any([np.ma.isMaskedArray(item) for item in input_list]):
+            zout = np.ma.masked_array(zout,
+                mask=np.broadcast_to(mask, zout.shape).copy())
+        return zout.squeeze()
+    # sort out any output arrays
+    if out is None:
+        out_rho = None; out_w = None
+    elif only_rho:
+        out_rho = out; out_w = None
+    elif only_w:
+        out_rho = None; out_w = out
+    else:
+        out_rho, out_w = out
     # return results
     if only_rho:
-        return make_z_rho(h, zeta, S, N, M, L)
+        return make_z(S['s_rho'], S['Cs_r'], out_rho)
     elif only_w:
-        return make_z_w(h, zeta, S, N, M, L)
+        return make_z(S['s_w'], S['Cs_w'], out_w)
     else :
-        return make_z_rho(h, zeta, S, N, M, L), make_z_w(h, zeta, S, N, M, L)
+        return make_z(S['s_rho'], S['Cs_r'], out_rho), make_z(S['s_w'], S['Cs_w'], out_w)
 
-def roms_low_pass(flist, outfile, filt0, exclude=[]):
+def roms_low_pass(flist, outfile, filt0, exclude=[], nthreads=4, template=None):
     """
     Creates a low-passed version of ROMS history files, that are identical
     in structure to history files except that they have an ocean_time dimension
@@ -173,41 +294,128 @@ def roms_low_pass(flist, outfile, filt0, exclude=[]):
     * filt is a vector of weights for the low-pass.  It must be a numpy
       array whose sum is one, and whose length is equal to len(flist)
     * exclude is a list of variable names not to filter.
+    * nthreads is the number of variables to filter at once
+    * template is the path of a history file to use for the structure of
+      outfile (default flist[0]).  This allows flist to be a list of files
+      made by roms_partial_sums(), added together with filt0 = ones.
     OUTPUT:
     * creates a single file (outfile)
+    
+    The filter is streamed: each variable is read one history file at a time
+    and added into a float64 accumulator, so the memory needed is about one
+    snapshot plus the accumulator for each thread.  Variables are done in
+    parallel threads.  The netCDF library is not thread safe, so the reads and
+    writes take turns (using a lock) while the arithmetic overlaps.  As before,
+    a point is masked in the output only if it is masked at all times.
     """
     import shutil
-    import netCDF4 as nc4
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
     nf = len(flist)
     if len(filt0) != nf:
         print('ERROR roms_low_pass: inconsistent lengths!')
     # create the output file
-    shutil.copyfile(flist[0],outfile)
-    # create the Datasets
-    ds = nc4.MFDataset(flist, exclude=exclude)
-    dsout = nc4.Dataset(outfile,'a')
+    if template is None:
+        template = flist[0]
+    shutil.copyfile(template,outfile)
+    dsout = nc.Dataset(outfile,'a')
     # zero out variables we want to exclude
     for vn in exclude:
         try:
             dsout[vn][:] = 0.
         except IndexError:
             pass
-    # loop over all variables that have time axes
-    for vn in ds.variables:
-        if vn not in exclude:
-            if 'ocean_time' in ds.variables[vn].dimensions:
-                print(vn + ' ' + str(ds.variables[vn].shape)) # debugging
-                ndim = len(ds.variables[vn].shape)
-                filt_shape = (nf,)
-                for ii in range(ndim-1):
-                    filt_shape = filt_shape + (1,)
-                v = ds.variables[vn][:]
-                filt = filt0.reshape(filt_shape)
-                vf = (filt*v).sum(axis=0)
-                dsout.variables[vn][:] = vf.reshape(dsout.variables[vn].shape)
-    ds.close()
+    # open all the history files once
+    ds_list = [nc.Dataset(fn) for fn in flist]
+    # list of all variables that have time axes
+    vn_list = [vn for vn in dsout.variables if ((vn not in exclude)
+        and ('ocean_time' in dsout.variables[vn].dimensions)
+        and (vn in ds_list[0].variables))]
+    lock = threading.Lock()
+    
+    def filter_var(vn):
+        vf = weighted_sums(ds_list, vn, [filt0], lock)[0]
+        with lock:
+            dsout.variables[vn][:] = vf.reshape(dsout.variables[vn].shape)
+    
+    with ThreadPoolExecutor(max_workers=nthreads) as ex:
+        # list() so that any errors in the threads are raised here
+        list(ex.map(filter_var, vn_list))
+    for ds in ds_list:
+        ds.close()
     dsout.close()
     
+def roms_partial_sums(flist, out_list, filt_list, exclude=[], nthreads=4):
+    """
+    Like roms_low_pass(), but for part of a filter.  For each vector of
+    weights in filt_list (each the same length as flist) this saves the
+    weighted sum of all the time-dependent variables in flist to the
+    corresponding path in out_list.  The history files are read only once.
+    
+    The sums are saved as float64 without any scaling, so that adding the
+    partial sums of all the parts of a filter (using roms_low_pass() with
+    template = a history file) gives the same result as filtering all the
+    history files at once, to round-off.  Points are masked in a partial sum
+    where they are masked in all of its history files.
+    """
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    ds_list = [nc.Dataset(fn) for fn in flist]
+    ds0 = ds_list[0]
+    vn_list = [vn for vn in ds0.variables if ((vn not in exclude)
+        and ('ocean_time' in ds0.variables[vn].dimensions))]
+    # create the output files, with the dimensions of the history files and
+    # float64 versions of their time-dependent variables
+    dsout_list = []
+    for out_fn in out_list:
+        dsout = nc.Dataset(out_fn, 'w')
+        for dn in ds0.dimensions:
+            if ds0.dimensions[dn].isunlimited():
+                dsout.createDimension(dn, None)
+            else:
+                dsout.createDimension(dn, len(ds0.dimensions[dn]))
+        for vn in vn_list:
+            dsout.createVariable(vn, np.float64, ds0.variables[vn].dimensions,
+                fill_value=1e37)
+        dsout.source_files = ' '.join(flist)
+        dsout_list.append(dsout)
+    lock = threading.Lock()
+    
+    def filter_var(vn):
+        vf_list = weighted_sums(ds_list, vn, filt_list, lock)
+        with lock:
+            for ii in range(len(out_list)):
+                dsout_list[ii].variables[vn][:] = vf_list[ii]
+    
+    with ThreadPoolExecutor(max_workers=nthreads) as ex:
+        # list() so that any errors in the threads are raised here
+        list(ex.map(filter_var, vn_list))
+    for ds in ds_list + dsout_list:
+        ds.close()
+    
+def weighted_sums(ds_list, vn, filt_list, lock):
+    """
+    Returns a list of masked float64 arrays with the sums of variable vn from
+    the open Datasets in ds_list, weighted by each vector in filt_list.  Used
+    by roms_low_pass() and roms_partial_sums().  The files are read one at a
+    time, using the threading.Lock lock.
+    """
+    nf = len(ds_list)
+    vf_list = None
+    for ii in range(nf):
+        with lock:
+            v = ds_list[ii].variables[vn][:]
+        if vf_list is None:
+            print(vn + ' ' + str((nf,) + v.shape[1:])) # debugging
+            vf_list = [np.zeros(v.shape, dtype=np.float64) for filt in filt_list]
+            good = np.zeros(v.shape, dtype=bool)
+        vv = np.ma.filled(v, 0)
+        for vf, filt in zip(vf_list, filt_list):
+            if filt[ii] != 0:
+                vf += filt[ii] * vv
+        good |= ~np.ma.getmaskarray(v)
+    return [np.ma.masked_where(~good, vf) for vf in vf_list]
+    
 def get_S(S_info_dict):
     """
     Code to calculate S-coordinate vectors from the parameters
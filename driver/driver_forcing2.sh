@@ -102,6 +102,7 @@ y=$y0; m=$m0; d=$d0
 D0=$[10#$y*10000 + 10#$m*100 + 10#$d]
 D=$D0
 D1=$[10#$y1*10000 + 10#$m1*100 + 10#$d1]
+DD1=${D1:0:4}.${D1:4:2}.${D1:6:2} # last day, used by low_pass
 
 gtag=$gridname"_"$tag
 
@@ -161,7 +162,7 @@ do
     fi
     
     
-    python ./make_forcing_main.py -g $gridname -t $tag -f $frc -r $run_type -d $DD -x $ex_name > $LOogf_fi"screen_out.txt" &
+    python ./make_forcing_main.py -g $gridname -t $tag -f $frc -r $run_type -d $DD -1 $DD1 -x $ex_name > $LOogf_fi"screen_out.txt" &
     # Check that the job has finished successfully.
     PID1=$!
     wait $PID1
@@ -43,6 +43,8 @@ def intro():
     # only used by make_dot_in.py
     parser.add_argument('-np', '--np_num', nargs='?', type=int, default=196)
     parser.add_argument('-bu', '--blow_ups', nargs='?', type=int, default=0)
+    # only used by low_pass: the last day of a multi-day run
+    parser.add_argument('-1', '--date_string1', nargs='?', type=str, default=None)
     args = parser.parse_args()
 
     # get the dict Ldir
@@ -61,6 +63,11 @@ def intro():
     # only used by make_dot_in.py
     Ldir['np_num'] = args.np_num
     Ldir['blow_ups'] = args.blow_ups
+    # only used by low_pass
+    if args.date_string1 is None:
+        Ldir['date_string1'] = args.date_string
+    else:
+        Ldir['date_string1'] = args.date_string1
 
     # Make the directory tree for this forcing, if needed. This is redundant
     # with what the driver does (except that it clobbers nothing), and is
@@ -4,6 +4,18 @@ This is the main program for making the LOW PASS forcing file.
 Performance: about 5 minutes per day on fjord to do
     a low pass of cascadia1_base_lobio1
 
+The Godin filter spans three days of history files, so it is done as the sum
+of three partial sums (made by zrfun.roms_partial_sums), one for each day.
+When the history files of a day are read, the partial sums that the low pass
+of the following days of the same run will need are saved in that day's
+folder as lp_partial_[0,1].nc, and they are deleted once they are used.
+The last day of the run is given by -1 (passed by driver_forcing2.sh, and
+the same as -d by default), so that no partial sums are left behind at the
+end of a backfill.  Hence a backfill over many days reads each day of history
+files once instead of three times.  The forecast saves only the partial sum
+of today that tomorrow's forecast will use.  A cached partial sum is only
+used if it is newer than its history files, and otherwise it is made again.
+
 For testing on my mac run in ipython as
 
 run make_forcing_main.py -d 2017.05.18
@@ -22,6 +34,7 @@ Ldir, Lfun = ffun.intro()
 # ****************** CASE-SPECIFIC CODE *****************
 import zfun
 import zrfun
+import numpy as np
 
 from datetime import datetime, timedelta
 start_time = datetime.now()
@@ -87,7 +100,69 @@ else:
 
 # RUN THE FUNCTION
 exclude = ['PH', 'ARAG']
-zrfun.roms_low_pass(flist, out_fn, filt0, exclude=exclude)
+if nf == 71:
+    # Use partial sums for each day.  The weights for role k apply to the
+    # day that is k days after the first day of the filter.
+    def get_filt(k):
+        # weights of role k for the history files 2-25 of a day
+        filt = np.zeros(24)
+        nk = len(filt0[24*k:24*(k+1)])
+        filt[:nk] = filt0[24*k:24*(k+1)]
+        return filt
+    # the last day whose low pass is made by this run (or, for the forecast,
+    # by tomorrow's forecast)
+    if Ldir['run_type'] == 'forecast':
+        dt_last = dt_now + timedelta(1)
+    else:
+        dt_last = datetime.strptime(Ldir['date_string1'], '%Y.%m.%d')
+    def get_partial(indir, k, dt_day):
+        # Returns the path to the partial sum of role k for the day folder indir
+        # (of day dt_day), making it if needed.  When it is made we also make
+        # the partial sums of roles kk < k that will be used by the low pass of
+        # a later day of the run, which is the day dt_day + 1 - kk.
+        p_fn = indir + 'lp_partial_' + str(k) + '.nc'
+        his_list = [indir + 'ocean_his_' + ('0000' + str(ii))[-4:] + '.nc'
+            for ii in range(2,26)]
+        if os.path.isfile(p_fn) and (os.path.getmtime(p_fn) >
+            max([os.path.getmtime(fn) for fn in his_list])):
+            print(' - using ' + p_fn)
+        else:
+            k_list = [kk for kk in range(k)
+                if dt_day + timedelta(1 - kk) <= dt_last] + [k]
+            zrfun.roms_partial_sums(his_list,
+                [indir + 'lp_partial_' + str(kk) + '.nc' for kk in k_list],
+                [get_filt(kk) for kk in k_list], exclude=exclude)
+        return p_fn
+    # directories of the three days (history files 2-25)
+    dir_list = [os.path.dirname(flist[0]) + '/', os.path.dirname(flist[24]) + '/',
+        os.path.dirname(flist[48]) + '/']
+    p_list = [get_partial(dir_list[0], 0, dt_now - timedelta(1)),
+        get_partial(dir_list[1], 1, dt_now)]
+    if Ldir['run_type'] == 'forecast':
+        # the last day is hours 26-48 of today's forecast, which are not used
+        # by any other low pass
+        p_fn = dir_list[1] + 'lp_partial_f2.nc'
+        zrfun.roms_partial_sums(flist[48:], [p_fn], [filt0[48:]], exclude=exclude)
+        p_list.append(p_fn)
+    else:
+        p_list.append(get_partial(dir_list[2], 2, dt_now + timedelta(1)))
+    zrfun.roms_low_pass(p_list, out_fn, np.ones(3), exclude=exclude,
+        template=flist[0])
+    # clean up the partial sums we have used, and any others in these day
+    # folders (e.g. from an interrupted run) that no later day of the run
+    # will use
+    for p_fn in p_list:
+        os.remove(p_fn)
+    day_list = [(dir_list[0], dt_now - timedelta(1)), (dir_list[1], dt_now)]
+    if Ldir['run_type'] == 'backfill':
+        day_list.append((dir_list[2], dt_now + timedelta(1)))
+    for indir, dt_day in day_list:
+        for kk in range(3):
+            p_fn = indir + 'lp_partial_' + str(kk) + '.nc'
+            if os.path.isfile(p_fn) and not (dt_now < dt_day + timedelta(1 - kk) <= dt_last):
+                os.remove(p_fn)
+else:
+    zrfun.roms_low_pass(flist, out_fn, filt0, exclude=exclude)
 
 #%% prepare for finale
 import collections
@@ -91,7 +91,8 @@ in_ds.close()
 # ======================================================================
 
 # ======== Create an output file for SCOOT =============================
-# performance: took about 3 minutes for a three-day forecast with 12 hour steps
+# performance: took about 3 minutes for a three-day forecast with 12 hour steps,
+# before making all the z-levels of a field in one call to pfun.get_laym()
 testing = False
 
 fn_list_raw = os.listdir(in_dir)
@@ -133,6 +134,10 @@ ds0 = nc.Dataset(fn_list[0])
 zfull = pfun.get_zfull(ds0, fn0, 'rho')
 ds0m = ds0['mask_rho'][:]
 ds0.close()
+# -- the interpolation weights depend only on zfull (which uses zeta = 0),
+# so we make them once for all depths and reuse them for every field
+zlev_a = -np.array(depth_list, dtype=float)
+W = pfun.get_layer_weights(zfull, zlev_a)
 # get size for output
 NT, NY, NX = out_ds[vn_list3t[0]+'_surface'][:].shape
 #
@@ -152,10 +157,10 @@ count = 0
 for fn in fn_list:
     ds = nc.Dataset(fn)
     for vn in vn_list3t:
-        for depth in depth_list:
+        laym = pfun.get_laym(ds, zfull, ds0m, vn, zlev_a, W=W)
+        for dd, depth in enumerate(depth_list):
             vnd = vn + '_' + str(depth)
-            laym = pfun.get_laym(ds, zfull, ds0m, vn, -depth)
-            v_dict[vnd][count, :, :] = laym
+            v_dict[vnd][count, :, :] = laym[dd, :, :]
     ds.close()
     count += 1
 print(' --  layer creation took %0.1f sec' % (time()-tt0))
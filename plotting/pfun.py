@@ -160,7 +160,7 @@ def add_velocity_vectors(ax, ds, fn, v_scl=3, v_leglen=0.5, nngrid=80, zlev='top
     xc = center[0]
     yc = center[1]
     # GET DATA
-    G = zrfun.get_basic_info(fn, only_G=True)
+    G = zrfun.get_basic_info(fn, only_G=True, cache=True)
     if zlev == 'top':
         u = ds['u'][0, -1, :, :].squeeze()
         v = ds['v'][0, -1, :, :].squeeze()
@@ -206,7 +206,7 @@ def add_velocity_vectors(ax, ds, fn, v_scl=3, v_leglen=0.5, nngrid=80, zlev='top
 def add_velocity_streams(ax, ds, fn, nngrid=80, zlev=0):
     # slower than adding quivers, but informative in a different way
     # GET DATA
-    G = zrfun.get_basic_info(fn, only_G=True)
+    G = zrfun.get_basic_info(fn, only_G=True, cache=True)
     if zlev == 0:
         u = ds['u'][0, -1, :, :].squeeze()
         v = ds['v'][0, -1, :, :].squeeze()
@@ -308,9 +308,10 @@ def get_aa_ex(ds):
 
 def get_zfull(ds, fn, which_grid):
     # get zfull field on "which_grid" ('rho', 'u', or 'v')
-    G, S, T = zrfun.get_basic_info(fn)
+    # the cached z_rho is already for zeta = 0
+    G, S, Z = zrfun.get_grid_info(fn)
     zeta = 0 * ds.variables['zeta'][:].squeeze()
-    zr_mid = zrfun.get_z(G['h'], zeta, S, only_rho=True)
+    zr_mid = Z['z_rho']
     zr_bot = -G['h'].reshape(1, G['M'], G['L']).copy()
     zr_top = zeta.reshape(1, G['M'], G['L']).copy()
     zfull0 = make_full((zr_bot, zr_mid, zr_top))
@@ -322,73 +323,95 @@ def get_zfull(ds, fn, which_grid):
         zfull = zfull0[:, 0:-1, :] + np.diff(zfull0, axis=1)/2
     return zfull
 
-def get_laym(ds, zfull, mask, vn, zlev):
-    # make the layer
+def get_laym(ds, zfull, mask, vn, zlev, W=None):
+    # make the layer (or a stack of layers if zlev is a list of z values),
+    # reusing the interpolation weights W from get_layer_weights() if provided
     fld_mid = ds[vn][:].squeeze()
     fld = make_full((fld_mid,))
     zlev_a = zlev * np.ones(1)
-    lay = get_layer(fld, zfull, zlev_a)
-    lay[mask == False] = np.nan
+    if W is None:
+        W = get_layer_weights(zfull, zlev_a)
+    lay = get_layers(fld, W)
+    lay[:, mask == False] = np.nan
     laym = np.ma.masked_where(np.isnan(lay), lay)
+    if np.ndim(zlev) == 0:
+        laym = laym[0]
     return laym
 
+def get_layer_weights(zfull, which_z):
+    """
+    Finds the indices and weights to interpolate a 3D ROMS data field to
+    one or more z values.  They depend only on zfull, so they can be reused
+    for all the variables at a given time.
+    Input:
+        zfull (3D ndarray) of z values (like from make_full),
+            increasing with the first index
+        which_z (1D ndarray) of the z values for the layers
+    Output:
+        W (dict) with:
+        ind0 (3D int ndarray, packed [which_z, eta, xi]) of the index of
+            the level below each z value
+        fr (3D ndarray, packed [which_z, eta, xi]) of the fractional
+            distance from level ind0 to level ind0 + 1, with np.nan where
+            the z value is outside the water column
+    """
+    zfull = np.ma.getdata(zfull)
+    N, M, L = zfull.shape
+    which_z = np.array(which_z, dtype=float).reshape(-1, 1, 1)
+    # the number of levels below each z value
+    nbelow = np.zeros((len(which_z), M, L), dtype=int)
+    for n in range(N):
+        nbelow += zfull[n] < which_z
+    ind0 = nbelow - 1
+    bad = (ind0 == -1) | (ind0 == N-1)
+    ind0[ind0 == -1] = 0 # fix bottom case
+    ind0[ind0 == N-1] = N-2 # fix top case
+    z0 = np.take_along_axis(zfull, ind0, axis=0)
+    z1 = np.take_along_axis(zfull, ind0 + 1, axis=0)
+    dz = z1 - z0
+    dz[dz == 0] = np.nan
+    fr = (which_z - z0) / dz
+    fr[bad] = np.nan
+    W = {'ind0': ind0, 'fr': fr}
+    return W
+
+def get_layers(fld, W):
+    """
+    Creates a stack of horizontal slices through a 3D ROMS data field,
+    using the output of get_layer_weights().
+    Input:
+        fld (3D ndarray) of the data field to slice, on the same grid as
+            the zfull used to make W
+        W (dict) from get_layer_weights()
+    Output:
+        lay (3D ndarray, packed [which_z, eta, xi]) fld on the z values,
+            with np.nan where it is not defined
+    """
+    fld = np.ma.getdata(fld)
+    fr = W['fr']
+    fld0 = np.take_along_axis(fld, W['ind0'], axis=0)
+    fld1 = np.take_along_axis(fld, W['ind0'] + 1, axis=0)
+    lay = fld0*(1 - fr) + fld1*fr
+    return lay
+
 def get_layer(fld, zfull, which_z):
     """
     Creates a horizontal slice through a 3D ROMS data field.  It is very fast
-    because of the use of "choose"
+    because all the z values are done at once using "take_along_axis".
     Input:
         fld (3D ndarray) of the data field to slice
         z (3D ndarray) of z values (like from make_full)
-        which_z (ndarray of length 1) of the z value for the layer
+        which_z (ndarray) of the z value(s) for the layer
     Output:
         lay (2D ndarray) fld on z == which_z,
-            with np.nan where it is not defined
+            with np.nan where it is not defined, or a 3D ndarray
+            (packed [which_z, eta, xi]) if which_z has more than one value
     """
-    N, M, L = fld.shape # updates N for full fields
-    Nmax = 30
-    ii = np.arange(0,N,Nmax)
-    ii = np.concatenate((ii,np.array([N,])))
-    fld0 = np.nan * np.zeros((M, L), dtype=int)
-    fld1 = np.nan * np.zeros((M, L), dtype=int)
-    z0 = np.nan * np.zeros((M, L), dtype=int)
-    z1 = np.nan * np.zeros((M, L), dtype=int)
-    # NOTE: need fewer than 32 layers to use "choose"
-    # so we split the operation into steps in this loop
-    j = 0
-    while j < len(ii)-1:
-        i_lo = ii[j]
-        i_hi = min(ii[j+1] + 1, ii[-1]) # overlap by 1
-        NN = i_hi - i_lo # the number of levels in this chunk
-        this_zr = zfull[i_lo:i_hi].copy()
-        this_fld = fld[i_lo:i_hi].copy()
-        zm = this_zr < which_z
-        ind0 = np.zeros((M, L), dtype=int)
-        ind1 = np.zeros((M, L), dtype=int)
-        ind0 = (zm == True).sum(0) - 1 # index of points below which_z
-        ind1 = ind0 + 1 # index of points above which_z
-        # dealing with out-of-bounds issues
-        # note 0 <= ind0 <= NN-1
-        # and  1 <= ind1 <= NN
-        # make ind1 = ind0 for out of bounds cases
-        ind0[ind0 == -1] = 0 # fix bottom case
-        ind1[ind1 == NN] = NN-1 # fix top case
-        # and now cells that should be masked have equal indices
-        this_mask = ind0 != ind1
-        this_fld0 = ind0.choose(this_fld)
-        this_fld1 = ind1.choose(this_fld)
-        this_z0 = ind0.choose(this_zr)
-        this_z1 = ind1.choose(this_zr)
-        fld0[this_mask] = this_fld0[this_mask]
-        fld1[this_mask] = this_fld1[this_mask]
-        z0[this_mask] = this_z0[this_mask]
-        z1[this_mask] = this_z1[this_mask]
-        j += 1
-    # do the interpolation
-    dz = z1 - z0
-    dzf = which_z - z0
-    dz[dz == 0] = np.nan
-    fr = dzf / dz
-    lay = fld0*(1 - fr) + fld1*fr
+    which_z = np.array(which_z, dtype=float).flatten()
+    W = get_layer_weights(zfull, which_z)
+    lay = get_layers(fld, W)
+    if len(which_z) == 1:
+        lay = lay[0]
     return lay
 
 def make_full(flt):
@@ -461,7 +484,7 @@ def get_section(ds, vn, x, y, in_dict):
     filterwarnings('ignore') # skip a warning message
 
     # GET DATA
-    G, S, T = zrfun.get_basic_info(in_dict['fn'])
+    G, S, T = zrfun.get_basic_info(in_dict['fn'], cache=True)
     h = G['h']
     zeta = ds['zeta'][:].squeeze()
     zr = zrfun.get_z(h, zeta, S, only_rho=True)
@@ -194,7 +194,7 @@ def P_ths(in_dict):
     SS, TH = np.meshgrid(np.linspace(s0, s1, 50), np.linspace(th0, th1, 50))
     SIG = sw.dens0(SS, TH) - 1000
     
-    S = zrfun.get_basic_info(in_dict['fn'], only_S=True)
+    S = zrfun.get_basic_info(in_dict['fn'], only_S=True, cache=True)
     h = ds['h'][:]
     z = zrfun.get_z(h, 0*h, S, only_rho=True)
     
@@ -775,7 +775,7 @@ def P_debug(in_dict):
             eta = ds['zeta'][0,:,:].squeeze()
             emax, ejmax, eimax, emin, ejmin, eimin = pfun.maxmin(eta)
             #
-            G = zrfun.get_basic_info(in_dict['fn'], only_G=True)
+            G = zrfun.get_basic_info(in_dict['fn'], only_G=True, cache=True)
             def add_info(G, ax, name, grd, vval, vj, vi, ypos, clr):
                 ax.text(.98, ypos,'%s = %5.1f' % (name, vval), fontweight='bold',
                     horizontalalignment='right', transform=ax.transAxes, color=clr)
@@ -844,7 +844,7 @@ def P_dive_vort(in_dict):
     # calculate divergence and vorticity
     u = ds['u'][0, -1, :, :]
     v = ds['v'][0, -1, :, :]
-    G = zrfun.get_basic_info(in_dict['fn'], only_G=True)
+    G = zrfun.get_basic_info(in_dict['fn'], only_G=True, cache=True)
     dive = ((np.diff(u, axis=1)/G['DX'][:, 1:-1])[1:-1, :]
             + (np.diff(v, axis = 0)/G['DY'][1:-1, :])[:, 1:-1])   
     x = G['lon_psi'] # matrix
@@ -900,7 +900,7 @@ def P_vort(in_dict):
     # calculate divergence and vorticity
     u = ds['u'][0, -1, :, :]
     v = ds['v'][0, -1, :, :]
-    G = zrfun.get_basic_info(in_dict['fn'], only_G=True)
+    G = zrfun.get_basic_info(in_dict['fn'], only_G=True, cache=True)
     # dive = ((np.diff(u, axis=1)/G['DX'][:, 1:-1])[1:-1, :]
     #         + (np.diff(v, axis = 0)/G['DY'][1:-1, :])[:, 1:-1])
     x = G['lon_psi'] # matrix
@@ -1389,7 +1389,7 @@ def P_sect(in_dict):
         pinfo.vlims_dict['sect_'+vn] = ()
     #
     # GET DATA
-    G, S, T = zrfun.get_basic_info(in_dict['fn'])
+    G, S, T = zrfun.get_basic_info(in_dict['fn'], cache=True)
     # CREATE THE SECTION
     # create track by hand
     if False:
@@ -1491,7 +1491,7 @@ def P_sect2(in_dict):
 
     # PLOT CODE
     #
-    G, S, T = zrfun.get_basic_info(in_dict['fn'])
+    G, S, T = zrfun.get_basic_info(in_dict['fn'], cache=True)
     # CREATE THE SECTION
     tracks_path = Ldir['data'] + 'tracks_new/'
     #tracks = ['Line_jdf_v0.p', 'Line_ps_main_v0.p']
@@ -1599,7 +1599,7 @@ def P_sect_sji0(in_dict):
 
     # PLOT CODE
     #
-    G, S, T = zrfun.get_basic_info(in_dict['fn'])
+    G, S, T = zrfun.get_basic_info(in_dict['fn'], cache=True)
     # CREATE THE SECTION
     zdeep = -200
     tracks_path = Ldir['data'] + 'tracks_new/'
@@ -1734,7 +1734,7 @@ def P_superplot(in_dict):
     fdf['yearday'] = fdf.index.dayofyear - 0.5 # .5 to 364.5
 
     # get section
-    G, S, T = zrfun.get_basic_info(in_dict['fn'])
+    G, S, T = zrfun.get_basic_info(in_dict['fn'], cache=True)
     # read in a section (or list of sections)
     tracks_path = Ldir['data'] + 'tracks_new/'
     tracks = ['Line_ps_main_v0.p']
@@ -1958,7 +1958,7 @@ def P_superplot2(in_dict):
     fdf['yearday'] = fdf.index.dayofyear - 0.5 # .5 to 364.5
 
     # get section
-    G, S, T = zrfun.get_basic_info(in_dict['fn'])
+    G, S, T = zrfun.get_basic_info(in_dict['fn'], cache=True)
     # read in a section (or list of sections)
     tracks_path = Ldir['data'] + 'tracks_new/'
     tracks = ['Line_ps_main_v0.p']
@@ -2235,7 +2235,7 @@ def P_sect_willapa(in_dict):
         
     #
     # GET DATA
-    G, S, T = zrfun.get_basic_info(in_dict['fn'])
+    G, S, T = zrfun.get_basic_info(in_dict['fn'], cache=True)
     # CREATE THE SECTION
     tracks_path = Ldir['data'] + 'tracks_new/'
     track = 'Line_willapa1.p'
@@ -2353,7 +2353,7 @@ def P_sect_columbia(in_dict):
         
     #
     # GET DATA
-    G, S, T = zrfun.get_basic_info(in_dict['fn'])
+    G, S, T = zrfun.get_basic_info(in_dict['fn'], cache=True)
     # CREATE THE SECTION
     tracks_path = Ldir['data'] + 'tracks_new/'
     track = 'CR_thalweg.p'
@@ -2567,7 +2567,7 @@ def P_tracks_MERHAB(in_dict):
     # and use the CURRENT file for the map field overlay
     ds = nc.Dataset(in_dict['fn'])
 
-    G, S, T = zrfun.get_basic_info(in_dict['fn'])
+    G, S, T = zrfun.get_basic_info(in_dict['fn'], cache=True)
     T0 = zrfun.get_basic_info(fn_list[0], only_T=True)
 
     if len(fn_list) == 2:
@@ -2750,7 +2750,7 @@ def P_merhab2(in_dict):
     # and use the CURRENT file for the map field overlay
     ds = nc.Dataset(in_dict['fn'])
 
-    G, S, T = zrfun.get_basic_info(in_dict['fn'])
+    G, S, T = zrfun.get_basic_info(in_dict['fn'], cache=True)
     T0 = zrfun.get_basic_info(fn_list[0], only_T=True)
     
     # Create initial positions for tracking
@@ -2943,7 +2943,7 @@ def P_tracks_full(in_dict):
     # and use the CURRENT file for the map field overlay
     ds = nc.Dataset(in_dict['fn'])
 
-    G, S, T = zrfun.get_basic_info(in_dict['fn'])
+    G, S, T = zrfun.get_basic_info(in_dict['fn'], cache=True)
     T0 = zrfun.get_basic_info(fn_list[0], only_T=True)
 
     if len(fn_list) == 2:
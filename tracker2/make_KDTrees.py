@@ -1,8 +1,14 @@
 """
-Creates and saves KDTrees for a given model run.
+Creates and saves the points used to make the KDTrees for a given model run.
 
-NOTE: for some reason I have to make the 2D trees individually (meaning
-not in a loop like I do for the 3D trees).  No idea why.
+Each tree is saved as a .npy file of its points (lon, lat, and for the 3D trees
+fractional depth), which trackfun.py memory-maps and makes into a cKDTree the
+first time that tree is used.  This is faster to load than the old pickled trees,
+only costs memory for the trees a run actually needs, and lets several tracker
+processes share one copy of the files from the page cache.
+
+We also write tree_info.csv with the format version and a hash of the grid
+(from zrfun.get_grid_hash) so that trackfun.py can detect stale trees.
 
 Usage:
 
@@ -19,9 +25,7 @@ sys.path.append(os.path.abspath('../../LiveOcean/alpha'))
 import Lfun
 import zrfun
 
-from scipy.spatial import cKDTree
 from time import time
-import pickle
 import numpy as np
 import argparse
 
@@ -48,78 +52,64 @@ Lfun.make_dir(outdir, clean=True)
 G, S, T = zrfun.get_basic_info(fn)
 h = G['h']
 
+# version of the saved format (checked by trackfun.py)
+tree_version = 2
+
+def save_points(name, xy):
+    # save the points for one tree as a plain float64 array
+    np.save(outdir + name + '.npy', np.ascontiguousarray(xy, dtype=float))
+    print('Saved %s: %d points' % (name, xy.shape[0]))
+    sys.stdout.flush()
+
 # 2D trees
 X = G['lon_rho']; Y = G['lat_rho']
 Maskr = G['mask_rho'] # True over water
-xy = np.array((X[Maskr],Y[Maskr])).T
-xyT_rho = cKDTree(xy)
-xy = np.array((X.flatten(),Y.flatten())).T
-xyT_rho_un = cKDTree(xy) # unmasked version
+save_points('xyT_rho', np.array((X[Maskr],Y[Maskr])).T)
+save_points('xyT_rho_un', np.array((X.flatten(),Y.flatten())).T) # unmasked version
 X = G['lon_u']; Y = G['lat_u']
 Masku = G['mask_u'] # True over water
-xy = np.array((X[Masku],Y[Masku])).T
-xyT_u = cKDTree(xy)
+save_points('xyT_u', np.array((X[Masku],Y[Masku])).T)
 X = G['lon_v']; Y = G['lat_v']
 Maskv = G['mask_v'] # True over water
-xy = np.array((X[Maskv],Y[Maskv])).T
-xyT_v = cKDTree(xy)
-
-pickle.dump(xyT_rho, open(outdir + 'xyT_rho.p', 'wb'))
-pickle.dump(xyT_rho_un, open(outdir + 'xyT_rho_un.p', 'wb'))
-pickle.dump(xyT_u, open(outdir + 'xyT_u.p', 'wb'))
-pickle.dump(xyT_v, open(outdir + 'xyT_v.p', 'wb'))
-
-if True:
-    # 3D trees
-    for tag in ['w', 'rho', 'u', 'v']:
-        # prepare fields to make the tree
-        tt0 = time()
-
-        if tag == 'u':
-            hh = (h[:,:-1] + h[:,1:])/2
-        elif tag == 'v':
-            hh = (h[:-1,:] + h[1:,:])/2
-        elif tag in ['rho', 'w']:
-            hh = h.copy()
-
-        if tag in ['rho', 'u', 'v']:
-            z = zrfun.get_z(hh, 0*hh, S, only_rho=True)
-            x = G['lon_' + tag]
-            y = G['lat_' + tag]
-            mask = G['mask_' + tag]
-        elif tag == 'w':
-            z = zrfun.get_z(hh, 0*hh, S, only_w=True)
-            x = G['lon_rho']
-            y = G['lat_rho']
-            mask = G['mask_rho']
-        
-        N,M,L = z.shape
-        X = np.tile(x.reshape(1,M,L),[N,1,1])
-        Y = np.tile(y.reshape(1,M,L),[N,1,1])
-        H = np.tile(hh.reshape(1,M,L),[N,1,1])
-        Z = z/H # fractional depth (-1 to 0)
-    
-        Mask = np.tile(mask.reshape(1,M,L),[N,1,1])
+save_points('xyT_v', np.array((X[Maskv],Y[Maskv])).T)
+
+# 3D trees
+for tag in ['w', 'rho', 'u', 'v']:
+    # prepare fields to make the tree
+    tt0 = time()
+
+    if tag == 'u':
+        hh = (h[:,:-1] + h[:,1:])/2
+    elif tag == 'v':
+        hh = (h[:-1,:] + h[1:,:])/2
+    elif tag in ['rho', 'w']:
+        hh = h.copy()
+
+    if tag in ['rho', 'u', 'v']:
+        z = zrfun.get_z(hh, 0*hh, S, only_rho=True)
+        x = G['lon_' + tag]
+        y = G['lat_' + tag]
+        mask = G['mask_' + tag]
+    elif tag == 'w':
+        z = zrfun.get_z(hh, 0*hh, S, only_w=True)
+        x = G['lon_rho']
+        y = G['lat_rho']
+        mask = G['mask_rho']
     
-        xyz = np.array((X[Mask],Y[Mask],Z[Mask])).T
-        
-        print('Prepare fields to make tree %0.2f sec' % (time()-tt0))
-        # create the nearest neighbor Tree objects
-        tt0 = time()
-    
-        if tag == 'rho':
-            xyzT_rho = cKDTree(xyz)
-            pickle.dump(xyzT_rho, open(outdir + 'xyzT_rho.p', 'wb'))
-        elif tag == 'u':
-            xyzT_u = cKDTree(xyz)
-            pickle.dump(xyzT_u, open(outdir + 'xyzT_u.p', 'wb'))
-        elif tag == 'v':
-            xyzT_v = cKDTree(xyz)
-            pickle.dump(xyzT_v, open(outdir + 'xyzT_v.p', 'wb'))
-        elif tag == 'w':
-            xyzT_w = cKDTree(xyz)
-            pickle.dump(xyzT_w, open(outdir + 'xyzT_w.p', 'wb'))
-
-        print('Create 3D tree for %s: %0.2f sec' % (tag, time()-tt0))
-        sys.stdout.flush()
+    N,M,L = z.shape
+    X = np.tile(x.reshape(1,M,L),[N,1,1])
+    Y = np.tile(y.reshape(1,M,L),[N,1,1])
+    H = np.tile(hh.reshape(1,M,L),[N,1,1])
+    Z = z/H # fractional depth (-1 to 0)
+
+    Mask = np.tile(mask.reshape(1,M,L),[N,1,1])
+
+    xyz = np.array((X[Mask],Y[Mask],Z[Mask])).T
     
+    print('Prepare fields to make tree %0.2f sec' % (time()-tt0))
+    save_points('xyzT_' + tag, xyz)
+
+# and the info used to check that the trees match the grid
+tree_info = {'gridname':args.gridname, 'tree_version':tree_version,
+    'grid_hash':zrfun.get_grid_hash(G, S), 'fn':fn}
+Lfun.dict_to_csv(tree_info, outdir + 'tree_info.csv')
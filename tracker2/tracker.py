@@ -94,6 +94,10 @@ parser.add_argument('-ds', '--ds_first_day', default='2019.07.04', type=str)
 parser.add_argument('-nsd', '--number_of_start_days', default=1, type=int)
 parser.add_argument('-dbs', '--days_between_starts', default=1, type=int)
 parser.add_argument('-dtt', '--days_to_track', default=1, type=int)
+# Set merge_releases to True to track all the releases that are active on a
+# given day together, as one set of particles, so that each day of history files
+# is only read once.  The output is still written to a separate file for each release.
+parser.add_argument('-mr', '--merge_releases', default=False, type=boolean_string)
 
 # number of divisions to make between saves for the integration
 # e.g. if ndiv = 12 and we have hourly saves, we use a 300 sec step
@@ -103,6 +107,12 @@ parser.add_argument('-ndiv', default=12, type=int)
 parser.add_argument('-sph', default=1, type=int)
 # sph = saves per hour, a new argument to allow more frequent writing of output.
 
+# interpolation method for getting fields at particle positions:
+# tree = nearest neighbor using the KDTrees (the original method)
+# nearest = nearest water point found from the grid indices (plaid grids only)
+# linear = bilinear (surface) or trilinear (3d) interpolation (plaid grids only)
+parser.add_argument('-interp', default='tree', type=str, choices=['tree', 'nearest', 'linear'])
+
 # set which roms output directory to look in (refers to Ldir['roms'] or Ldir['roms2'])
 parser.add_argument('-rd', '--roms_dir', default='roms', type=str)
 # valid arguments to pass are: roms, roms2
@@ -152,6 +162,8 @@ if TR['laminar']:
     out_name += '_laminar'
 if TR['windage'] > 0:
     out_name += '_wind' + str(int(100*TR['windage']))
+if TR['interp'] != 'tree':
+    out_name += '_' + TR['interp']
 
 # make the list of start days (datetimes) for separate releases
 idt_list = []
@@ -200,24 +212,72 @@ plon00, plat00, pcs00 = exp.get_ic(TR['ic_name'], fn00)
 # calculate total number of times per release for NetCDF output
 NT_full = (TR['sph']*24*TR['days_to_track']) + 1
 
-# step through the releases, one for each start day
+# do the tracking, writing one output file for each release
 write_grid = True
-for idt0 in idt_list:
-    tt0 = time.time() # monitor integration time
+if not TR['merge_releases']:
+    # step through the releases, one for each start day
+    for idt0 in idt_list:
+        tt0 = time.time() # monitor integration time
     
-    # name the release file by start day
-    idt0_str = datetime.strftime(idt0,'%Y.%m.%d')
-    outname = ('release_' + idt0_str + '.nc')
-    print('-- ' + outname)
-    sys.stdout.flush()
-    out_fn = outdir + outname
+        # name the release file by start day
+        idt0_str = datetime.strftime(idt0,'%Y.%m.%d')
+        outname = ('release_' + idt0_str + '.nc')
+        print('-- ' + outname)
+        sys.stdout.flush()
+        out_fn = outdir + outname
     
-    # we do the calculation in one-day segments, but write complete
-    # output for a release to a single NetCDF file.
-    for nd in range(TR['days_to_track']):
+        # we do the calculation in one-day segments, but write complete
+        # output for a release to a single NetCDF file.
+        for nd in range(TR['days_to_track']):
+        
+            # get or replace the history file list for this day
+            idt = idt0 + timedelta(days=nd)
+            idt_str = datetime.strftime(idt,'%Y.%m.%d')
+            print(' - working on ' + idt_str)
+            sys.stdout.flush()
+            fn_list = tfun.get_fn_list(idt, Ldir)
         
-        # get or replace the history file list for this day
-        idt = idt0 + timedelta(days=nd)
+            # write the grid file (once per experiment) for plotting
+            if write_grid == True:
+                g_infile = fn_list[0]
+                g_outfile = outdir + 'grid.nc'
+                tfnc.write_grid(g_infile, g_outfile)
+                write_grid = False
+           
+            # DO THE TRACKING
+            if nd == 0: # first day
+                # set IC
+                plon0 = plon00.copy()
+                plat0 = plat00.copy()
+                pcs0 = pcs00.copy()
+                # do the tracking
+                P = tfun.get_tracks(fn_list, plon0, plat0, pcs0, TR, trim_loc=True)
+                it0 = 0
+                it1 = TR['sph']*24 + 1
+                # save the results to NetCDF
+                tfnc.start_outfile(out_fn, P, NT_full, it0, it1)
+            else: # subsequent days
+                # set IC
+                plon0 = P['lon'][-1,:]
+                plat0 = P['lat'][-1,:]
+                pcs0 = P['cs'][-1,:]
+                # do the tracking
+                P = tfun.get_tracks(fn_list, plon0, plat0, pcs0, TR)
+                it0 = TR['sph']*24*nd
+                it1 = it0 +  TR['sph']*24 + 1
+                tfnc.append_to_outfile(out_fn, P, it0, it1)
+            
+        print(' - Took %0.1f sec for %s day(s)' %
+                (time.time() - tt0, str(TR['days_to_track'])))
+        print(50*'=')
+
+else:
+    # step through all the days, tracking the active releases together
+    tt00 = time.time()
+    dt_last = idt_list[-1] + timedelta(days=TR['days_to_track']-1)
+    idt = idt_list[0]
+    rel_list = [] # one dict of info for each active release
+    while idt <= dt_last:
         idt_str = datetime.strftime(idt,'%Y.%m.%d')
         print(' - working on ' + idt_str)
         sys.stdout.flush()
@@ -229,30 +289,61 @@ for idt0 in idt_list:
             g_outfile = outdir + 'grid.nc'
             tfnc.write_grid(g_infile, g_outfile)
             write_grid = False
-           
-        # DO THE TRACKING
-        if nd == 0: # first day
-            # set IC
-            plon0 = plon00.copy()
-            plat0 = plat00.copy()
-            pcs0 = pcs00.copy()
-            # do the tracking
-            P = tfun.get_tracks(fn_list, plon0, plat0, pcs0, TR, trim_loc=True)
-            it0 = 0
-            it1 = TR['sph']*24 + 1
-            # save the results to NetCDF
-            tfnc.start_outfile(out_fn, P, NT_full, it0, it1)
-        else: # subsequent days
-            # set IC
-            plon0 = P['lon'][-1,:]
-            plat0 = P['lat'][-1,:]
-            pcs0 = P['cs'][-1,:]
-            # do the tracking
+        
+        # add any release that starts today, with points on land removed
+        if idt in idt_list:
+            outname = ('release_' + idt_str + '.nc')
+            print('-- ' + outname)
+            pcond = tfun.get_trim_mask(plon00, plat00)
+            rel = dict()
+            rel['out_fn'] = outdir + outname
+            rel['nd'] = 0 # number of days already tracked
+            rel['tt0'] = time.time()
+            rel['plon'] = plon00[pcond]
+            rel['plat'] = plat00[pcond]
+            rel['pcs'] = pcs00[pcond]
+            rel_list.append(rel)
+        
+        if len(rel_list) > 0:
+            # DO THE TRACKING for all active releases at once
+            plon0 = np.concatenate([rel['plon'] for rel in rel_list])
+            plat0 = np.concatenate([rel['plat'] for rel in rel_list])
+            pcs0 = np.concatenate([rel['pcs'] for rel in rel_list])
             P = tfun.get_tracks(fn_list, plon0, plat0, pcs0, TR)
-            it0 = TR['sph']*24*nd
-            it1 = it0 +  TR['sph']*24 + 1
-            tfnc.append_to_outfile(out_fn, P, it0, it1)
             
-    print(' - Took %0.1f sec for %s day(s)' %
-            (time.time() - tt0, str(TR['days_to_track'])))
+            # split the results up and save them to each release file
+            ip0 = 0
+            for rel in rel_list:
+                ip1 = ip0 + len(rel['plon'])
+                PP = dict()
+                for vn in P.keys():
+                    if vn == 'ot':
+                        PP[vn] = P[vn]
+                    else:
+                        PP[vn] = P[vn][:, ip0:ip1]
+                nd = rel['nd']
+                if nd == 0: # first day
+                    it0 = 0
+                    it1 = TR['sph']*24 + 1
+                    tfnc.start_outfile(rel['out_fn'], PP, NT_full, it0, it1)
+                else: # subsequent days
+                    it0 = TR['sph']*24*nd
+                    it1 = it0 +  TR['sph']*24 + 1
+                    tfnc.append_to_outfile(rel['out_fn'], PP, it0, it1)
+                rel['plon'] = PP['lon'][-1,:]
+                rel['plat'] = PP['lat'][-1,:]
+                rel['pcs'] = PP['cs'][-1,:]
+                rel['nd'] += 1
+                ip0 = ip1
+                
+            # drop the releases that are finished
+            for rel in rel_list:
+                if rel['nd'] == TR['days_to_track']:
+                    print(' - Took %0.1f sec for %s' %
+                        (time.time() - rel['tt0'], rel['out_fn'].split('/')[-1]))
+            rel_list = [rel for rel in rel_list if rel['nd'] < TR['days_to_track']]
+            
+        idt = idt + timedelta(days=1)
+        
+    print(' - Took %0.1f sec for all releases' % (time.time() - tt00))
     print(50*'=')
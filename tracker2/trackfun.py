@@ -13,13 +13,18 @@ import zrfun
 import numpy as np
 import netCDF4 as nc4
 from scipy.spatial import cKDTree
-import pickle
+import sys
 from time import time
+import threading
+import queue
 
 # Shared Constants
 #
 # criterion for deciding if particles are on land
 maskr_crit = 0.5 # (maskr = 1 in water, 0 on land) [0.5 seems good]
+#
+# number of history files to read ahead while integrating
+nprefetch = 2
 
 # NEW CODE for nearest neighbor interpolation
 Ldir = Lfun.Lstart()
@@ -32,21 +37,20 @@ Maskr3 = np.tile(G['mask_rho'].reshape(1,G['M'],G['L']),[S['N'],1,1])
 Masku3 = np.tile(G['mask_u'].reshape(1,G['M'],G['L']-1),[S['N'],1,1])
 Maskv3 = np.tile(G['mask_v'].reshape(1,G['M']-1,G['L']),[S['N'],1,1])
 Maskw3 = np.tile(G['mask_rho'].reshape(1,G['M'],G['L']),[S['N']+1,1,1])
-# load pre-made trees
+# Pre-made trees.  These are made by get_tree() the first time each one is used,
+# from the points saved by make_KDTrees.py, so a run only pays for the trees it needs.
 tree_dir = Ldir['LOo'] + 'tracker_trees/' + EI['gridname'] + '/'
-xyT_rho = pickle.load(open(tree_dir + 'xyT_rho.p', 'rb'))
-xyT_u = pickle.load(open(tree_dir + 'xyT_u.p', 'rb'))
-xyT_v = pickle.load(open(tree_dir + 'xyT_v.p', 'rb'))
-xyT_rho_un = pickle.load(open(tree_dir + 'xyT_rho_un.p', 'rb'))
-
-xyzT_rho = pickle.load(open(tree_dir + 'xyzT_rho.p', 'rb'))
-xyzT_u = pickle.load(open(tree_dir + 'xyzT_u.p', 'rb'))
-xyzT_v = pickle.load(open(tree_dir + 'xyzT_v.p', 'rb'))
-xyzT_w = pickle.load(open(tree_dir + 'xyzT_w.p', 'rb'))
+tree_version = 2 # must match make_KDTrees.py
+trees = dict()
 
 lonrf = G['lon_rho'][Maskr]
 latrf = G['lat_rho'][Maskr]
 
+# Grid info for index-based interpolation (TR['interp'] = 'nearest' or 'linear').
+# This is filled by make_interp_info() the first time it is needed so that
+# runs using the KDTrees do not pay for it.
+R = dict()
+
 def get_tracks(fn_list, plon0, plat0, pcs0, TR, trim_loc=False):
     """
     This is the main function doing the particle tracking.
@@ -56,6 +60,7 @@ def get_tracks(fn_list, plon0, plat0, pcs0, TR, trim_loc=False):
     turb = TR['turb']
     ndiv = TR['ndiv']
     windage = TR['windage']
+    interp = TR.get('interp', 'tree')
     
     # get basic info
     G = zrfun.get_basic_info(fn_list[0], only_G=True)
@@ -94,6 +99,17 @@ def get_tracks(fn_list, plon0, plat0, pcs0, TR, trim_loc=False):
     # plist_main is what ends up written to output
     plist_main = ['lon', 'lat', 'cs', 'ot', 'z'] + vn_list_other
     
+    # Start reading the fields from the history files in a background
+    # thread, so that reading (and masking) the next file overlaps with the
+    # integration using the current pair.  The queue holds at most
+    # nprefetch files that are ready to use.
+    tt0 = time()
+    qF = queue.Queue(maxsize=nprefetch)
+    reader = threading.Thread(target=field_reader,
+        args=(fn_list, surface, turb, windage, qF), daemon=True)
+    reader.start()
+    F1 = get_from_queue(qF)
+    
     # Step through times.
     #
     counter_his = 0
@@ -101,137 +117,30 @@ def get_tracks(fn_list, plon0, plat0, pcs0, TR, trim_loc=False):
                 
         it0 = TR['sph']*counter_his
         
-        # get Datasets
-        fn0 = fn_list[counter_his]
-        fn1 = fn_list[counter_his+1]
-        ds0 = nc4.Dataset(fn0, mode='r')
-        ds1 = nc4.Dataset(fn1, mode='r')
-        
-        # prepare the fields for nearest neighbor interpolation
-        tt0 = time()
+        # get the fields for the next history file
+        F0 = F1
+        F1 = get_from_queue(qF)
         if counter_his == 0:
             h = G['h']
             hf = h[Maskr].data
-            if surface == True:
-                u0 = ds0['u'][0,-1,:,:]
-                u1 = ds1['u'][0,-1,:,:]
-                uf0 = u0[Masku].data
-                uf1 = u1[Masku].data
-                v0 = ds0['v'][0,-1,:,:]
-                v1 = ds1['v'][0,-1,:,:]
-                vf0 = v0[Maskv].data
-                vf1 = v1[Maskv].data
-                wf0 = 0; wf1 = 0
-                s0 = ds0['salt'][0,-1,:,:]
-                s1 = ds1['salt'][0,-1,:,:]
-                sf0 = s0[Maskr].data
-                sf1 = s1[Maskr].data
-                t0 = ds0['temp'][0,-1,:,:]
-                t1 = ds1['temp'][0,-1,:,:]
-                tf0 = t0[Maskr].data
-                tf1 = t1[Maskr].data
-                if windage > 0:
-                    Uwind0 = ds0['Uwind'][0,:,:]
-                    Uwind1 = ds1['Uwind'][0,:,:]
-                    Uwindf0 = Uwind0[Maskr].data
-                    Uwindf1 = Uwind1[Maskr].data
-                    Vwind0 = ds0['Vwind'][0,:,:]
-                    Vwind1 = ds1['Vwind'][0,:,:]
-                    Vwindf0 = Vwind0[Maskr].data
-                    Vwindf1 = Vwind1[Maskr].data
-            else:
-                u0 = ds0['u'][0,:,:,:]
-                u1 = ds1['u'][0,:,:,:]
-                uf0 = u0[Masku3].data
-                uf1 = u1[Masku3].data
-                v0 = ds0['v'][0,:,:,:]
-                v1 = ds1['v'][0,:,:,:]
-                vf0 = v0[Maskv3].data
-                vf1 = v1[Maskv3].data
-                w0 = ds0['w'][0,:,:,:]
-                w1 = ds1['w'][0,:,:,:]
-                wf0 = w0[Maskw3].data
-                wf1 = w1[Maskw3].data
-                s0 = ds0['salt'][0,:,:,:]
-                s1 = ds1['salt'][0,:,:,:]
-                sf0 = s0[Maskr3].data
-                sf1 = s1[Maskr3].data
-                t0 = ds0['temp'][0,:,:,:]
-                t1 = ds1['temp'][0,:,:,:]
-                tf0 = t0[Maskr3].data
-                tf1 = t1[Maskr3].data
-                if turb == True:
-                    AKs0 = ds0['AKs'][0,:,:,:]
-                    AKs1 = ds1['AKs'][0,:,:,:]
-                    AKsf0 = AKs0[Maskw3].data
-                    AKsf1 = AKs1[Maskw3].data
-            z0 = ds0['zeta'][0,:,:]
-            z1 = ds1['zeta'][0,:,:]
-            zf0 = z0[Maskr].data
-            zf1 = z1[Maskr].data
             print('Prepare fields for tree %0.4f sec' % (time()-tt0))
-        else:
-            # subsequent time steps
-            if surface == True:
-                u1 = ds1['u'][0,-1,:,:]
-                uf0 = uf1.copy()
-                uf1 = u1[Masku].data
-                v1 = ds1['v'][0,-1,:,:]
-                vf0 = vf1.copy()
-                vf1 = v1[Maskv].data
-                wf0 = 0; wf1 = 0
-                s1 = ds1['salt'][0,-1,:,:]
-                sf0 = sf1.copy()
-                sf1 = s1[Maskr].data
-                t1 = ds1['temp'][0,-1,:,:]
-                tf0 = tf1.copy()
-                tf1 = t1[Maskr].data
-                if windage > 0:
-                    Uwind1 = ds1['Uwind'][0,:,:]
-                    Uwindf0 = Uwindf1
-                    Uwindf1 = Uwind1[Maskr].data
-                    Vwind1 = ds1['Vwind'][0,:,:]
-                    Vwindf0 = Vwindf1
-                    Vwindf1 = Vwind1[Maskr].data
-            else:
-                u1 = ds1['u'][0,:,:,:]
-                uf0 = uf1.copy()
-                uf1 = u1[Masku3].data
-                v1 = ds1['v'][0,:,:,:]
-                vf0 = vf1.copy()
-                vf1 = v1[Maskv3].data
-                w1 = ds1['w'][0,:,:,:]
-                wf0 = wf1.copy()
-                wf1 = w1[Maskw3].data
-                s1 = ds1['salt'][0,:,:,:]
-                sf0 = sf1.copy()
-                sf1 = s1[Maskr3].data
-                t1 = ds1['temp'][0,:,:,:]
-                tf0 = tf1.copy()
-                tf1 = t1[Maskr3].data
-                if turb == True:
-                    AKs1 = ds1['AKs'][0,:,:,:]
-                    AKsf0 = AKsf1
-                    AKsf1 = AKs1[Maskw3].data
-            z1 = ds1['zeta'][0,:,:]
-            zf0 = zf1.copy()
-            zf1 = z1[Maskr].data
-            #print('Prepare subsequent fields for tree %0.4f sec' % (time()-tt0))
-        ds0.close()
-        ds1.close()
+        uf0 = F0['u']; uf1 = F1['u']
+        vf0 = F0['v']; vf1 = F1['v']
+        wf0 = F0['w']; wf1 = F1['w']
+        sf0 = F0['salt']; sf1 = F1['salt']
+        tf0 = F0['temp']; tf1 = F1['temp']
+        zf0 = F0['zeta']; zf1 = F1['zeta']
+        if turb == True:
+            AKsf0 = F0['AKs']; AKsf1 = F1['AKs']
+        if (surface == True) and (windage > 0):
+            Uwindf0 = F0['Uwind']; Uwindf1 = F1['Uwind']
+            Vwindf0 = F0['Vwind']; Vwindf1 = F1['Vwind']
             
 
         if counter_his == 0:
             if trim_loc == True:
                 # remove points on land
-                xy = np.array((plon0,plat0)).T
-                #print(' ++ making pmask')
-                #print(maskr.shape)
-                pmask = maskr[xyT_rho_un.query(xy, n_jobs=-1)[1]]
-                #print(pmask)
-                # keep only points with pmask >= maskr_crit
-                pcond = pmask >= maskr_crit
-                #print(pcond.sum())
+                pcond = get_trim_mask(plon0, plat0, maskr)
                 plon = plon0[pcond]
                 plat = plat0[pcond]
                 pcs = pcs0[pcond]
@@ -252,10 +161,11 @@ def get_tracks(fn_list, plon0, plat0, pcs0, TR, trim_loc=False):
             if surface == True:
                 pcs[:] = S['Cs_r'][-1]
             P['cs'][it0,:] = pcs
-            P['salt'][it0,:] = get_VR_new(sf0, sf1, plon, plat, pcs, 0, surface)
-            P['temp'][it0,:] = get_VR_new(tf0, tf1, plon, plat, pcs, 0, surface)
-            V = get_vel_new(uf0,uf1,vf0,vf1,wf0,wf1, plon, plat, pcs, 0, surface)
-            ZH = get_zh_new(zf0,zf1,hf, plon, plat, 0)
+            W = get_weights(plon, plat, pcs, interp)
+            P['salt'][it0,:] = get_VR_new(sf0, sf1, plon, plat, pcs, 0, surface, W=W)
+            P['temp'][it0,:] = get_VR_new(tf0, tf1, plon, plat, pcs, 0, surface, W=W)
+            V = get_vel_new(uf0,uf1,vf0,vf1,wf0,wf1, plon, plat, pcs, 0, surface, W=W)
+            ZH = get_zh_new(zf0,zf1,hf, plon, plat, 0, W=W)
             P['u'][it0,:] = V[:,0]
             P['v'][it0,:] = V[:,1]
             P['w'][it0,:] = V[:,2]
@@ -270,23 +180,29 @@ def get_tracks(fn_list, plon0, plat0, pcs0, TR, trim_loc=False):
             fr1 = (nd + 1)/ndiv
             frmid = (fr0 + fr1)/2
             # RK4 integration
-            V0 = get_vel_new(uf0,uf1,vf0,vf1,wf0,wf1, plon, plat, pcs, fr0, surface)
-            ZH0 = get_zh_new(zf0,zf1,hf, plon, plat, fr0)
+            # (each W holds the neighbor indices and weights for one set of
+            # positions, shared by all the fields we get at those positions)
+            W0 = get_weights(plon, plat, pcs, interp)
+            V0 = get_vel_new(uf0,uf1,vf0,vf1,wf0,wf1, plon, plat, pcs, fr0, surface, W=W0)
+            ZH0 = get_zh_new(zf0,zf1,hf, plon, plat, fr0, W=W0)
             plon1, plat1, pcs1 = update_position(dxg, dyg, maskr, V0, ZH0, S, delt/2,
                                                  plon, plat, pcs, surface)
-            V1 = get_vel_new(uf0,uf1,vf0,vf1,wf0,wf1, plon1, plat1, pcs1, frmid, surface)
-            ZH1 = get_zh_new(zf0,zf1,hf, plon1, plat1, frmid)
+            W1 = get_weights(plon1, plat1, pcs1, interp)
+            V1 = get_vel_new(uf0,uf1,vf0,vf1,wf0,wf1, plon1, plat1, pcs1, frmid, surface, W=W1)
+            ZH1 = get_zh_new(zf0,zf1,hf, plon1, plat1, frmid, W=W1)
             plon2, plat2, pcs2 = update_position(dxg, dyg, maskr, V1, ZH1, S, delt/2,
                                                  plon, plat, pcs, surface)
-            V2 = get_vel_new(uf0,uf1,vf0,vf1,wf0,wf1, plon2, plat2, pcs2, frmid, surface)
-            ZH2 = get_zh_new(zf0,zf1,hf, plon2, plat2, frmid)
+            W2 = get_weights(plon2, plat2, pcs2, interp)
+            V2 = get_vel_new(uf0,uf1,vf0,vf1,wf0,wf1, plon2, plat2, pcs2, frmid, surface, W=W2)
+            ZH2 = get_zh_new(zf0,zf1,hf, plon2, plat2, frmid, W=W2)
             plon3, plat3, pcs3 = update_position(dxg, dyg, maskr, V2, ZH2, S, delt,
                                                  plon, plat, pcs, surface)
-            V3 = get_vel_new(uf0,uf1,vf0,vf1,wf0,wf1, plon3, plat3, pcs3, fr1, surface)
-            ZH3 = get_zh_new(zf0,zf1,hf, plon3, plat3, fr1)
+            W3 = get_weights(plon3, plat3, pcs3, interp)
+            V3 = get_vel_new(uf0,uf1,vf0,vf1,wf0,wf1, plon3, plat3, pcs3, fr1, surface, W=W3)
+            ZH3 = get_zh_new(zf0,zf1,hf, plon3, plat3, fr1, W=W3)
             # add windage, calculated from the middle time
             if (surface == True) and (windage > 0):
-                Vwind3 = get_wind_new(Uwindf0, Uwindf1, Vwindf0, Vwindf1, plon, plat, frmid, windage)
+                Vwind3 = get_wind_new(Uwindf0, Uwindf1, Vwindf0, Vwindf1, plon, plat, frmid, windage, W=W0)
             else:
                 Vwind3 = np.zeros((NP,3))
             plon, plat, pcs = update_position(dxg, dyg, maskr, (V0 + 2*V1 + 2*V2 + V3)/6 + Vwind3,
@@ -295,15 +211,17 @@ def get_tracks(fn_list, plon0, plat0, pcs0, TR, trim_loc=False):
             # add turbulence to vertical position change (advection already added above)
             if turb == True:
                 # pull values of VdAKs and add up to 3-dimensions
-                VdAKs = get_dAKs_new(AKsf0, AKsf1, zf0,zf1,hf, plon, plat, pcs, S, frmid)
+                W = get_weights(plon, plat, pcs, interp)
+                VdAKs = get_dAKs_new(AKsf0, AKsf1, zf0,zf1,hf, plon, plat, pcs, S, frmid, W=W)
                 VdAKs3 = np.zeros((NP,3))
                 VdAKs3[:,2] = VdAKs
                 # update position advecting vertically with 1/2 of AKs gradient
-                ZH = get_zh_new(zf0,zf1,hf, plon, plat, frmid)
+                ZH = get_zh_new(zf0,zf1,hf, plon, plat, frmid, W=W)
                 plon_junk, plat_junk, pcs_half = update_position(dxg, dyg, maskr, VdAKs3/2, ZH, S, delt/2,
                                                      plon, plat, pcs, surface)
                 # get AKs at this height, and thence the turbulent perturbation velocity
-                Vturb = get_turb_new(VdAKs, AKsf0, AKsf1, delt, plon, plat, pcs_half, frmid)
+                W_half = get_weights(plon, plat, pcs_half, interp, Wh=W)
+                Vturb = get_turb_new(VdAKs, AKsf0, AKsf1, delt, plon, plat, pcs_half, frmid, W=W_half)
                 Vturb3 = np.zeros((NP,3))
                 Vturb3[:,2] = Vturb
                 # update vertical position for real
@@ -320,8 +238,9 @@ def get_tracks(fn_list, plon0, plat0, pcs0, TR, trim_loc=False):
                 if surface == True:
                     pcs[:] = S['Cs_r'][-1]
                 P['cs'][it1,:] = pcs
-                P['salt'][it1,:] = get_VR_new(sf0, sf1, plon, plat, pcs, fr1, surface)
-                P['temp'][it1,:] = get_VR_new(tf0, tf1, plon, plat, pcs, fr1, surface)
+                W = get_weights(plon, plat, pcs, interp)
+                P['salt'][it1,:] = get_VR_new(sf0, sf1, plon, plat, pcs, fr1, surface, W=W)
+                P['temp'][it1,:] = get_VR_new(tf0, tf1, plon, plat, pcs, fr1, surface, W=W)
                 P['u'][it1,:] = V3[:,0]
                 P['v'][it1,:] = V3[:,1]
                 P['w'][it1,:] = V3[:,2]
@@ -334,6 +253,103 @@ def get_tracks(fn_list, plon0, plat0, pcs0, TR, trim_loc=False):
 
     return P
     
+def get_tree(name):
+    """
+    Returns the cKDTree called name (e.g. 'xyT_rho' or 'xyzT_w').
+    The first call checks that the saved trees are the right version and
+    were made for this grid, and each tree is made only once, from a
+    memory-mapped array of its points.
+    """
+    if name not in trees.keys():
+        if len(trees) == 0:
+            try:
+                tree_info = Lfun.csv_to_dict(tree_dir + 'tree_info.csv')
+            except FileNotFoundError:
+                tree_info = {'tree_version':'missing', 'grid_hash':'missing'}
+            if tree_info['tree_version'] != str(tree_version):
+                print('ERROR: trees in ' + tree_dir + ' are not version ' + str(tree_version))
+                print('Please rerun make_KDTrees.py for ' + EI['gridname'])
+                sys.exit()
+            if tree_info['grid_hash'] != zrfun.get_grid_hash(G, S):
+                print('ERROR: trees in ' + tree_dir + ' do not match the grid of')
+                print(EI['fn00'])
+                print('Please rerun make_KDTrees.py for ' + EI['gridname'])
+                sys.exit()
+        tt0 = time()
+        xy = np.load(tree_dir + name + '.npy', mmap_mode='r')
+        # the sliding midpoint rule is much faster to build, and the
+        # tree then uses the memory-mapped points without copying them
+        trees[name] = cKDTree(xy, balanced_tree=False, compact_nodes=False)
+        print('Make tree %s %0.4f sec' % (name, time()-tt0))
+    return trees[name]
+
+def get_fields(fn, surface, turb, windage):
+    """
+    Read the fields we need for tracking from one history file, and return
+    them in a dict of flattened arrays of the water points only, which is
+    the form used by the interpolation functions.
+    """
+    ds = nc4.Dataset(fn, mode='r')
+    F = dict()
+    if surface == True:
+        F['u'] = ds['u'][0,-1,:,:][Masku].data
+        F['v'] = ds['v'][0,-1,:,:][Maskv].data
+        F['w'] = 0
+        F['salt'] = ds['salt'][0,-1,:,:][Maskr].data
+        F['temp'] = ds['temp'][0,-1,:,:][Maskr].data
+        if windage > 0:
+            F['Uwind'] = ds['Uwind'][0,:,:][Maskr].data
+            F['Vwind'] = ds['Vwind'][0,:,:][Maskr].data
+    else:
+        F['u'] = ds['u'][0,:,:,:][Masku3].data
+        F['v'] = ds['v'][0,:,:,:][Maskv3].data
+        F['w'] = ds['w'][0,:,:,:][Maskw3].data
+        F['salt'] = ds['salt'][0,:,:,:][Maskr3].data
+        F['temp'] = ds['temp'][0,:,:,:][Maskr3].data
+        if turb == True:
+            F['AKs'] = ds['AKs'][0,:,:,:][Maskw3].data
+    F['zeta'] = ds['zeta'][0,:,:][Maskr].data
+    ds.close()
+    return F
+
+def field_reader(fn_list, surface, turb, windage, qF):
+    """
+    Runs in a background thread, putting the fields for each file
+    in fn_list into the queue qF in order.  The put() blocks when the
+    queue is full, which limits how far ahead we read.  If something
+    goes wrong the exception is put in the queue to be raised
+    by get_from_queue() in the main thread.
+    """
+    for fn in fn_list:
+        try:
+            F = get_fields(fn, surface, turb, windage)
+        except Exception as e:
+            qF.put(e)
+            return
+        qF.put(F)
+
+def get_from_queue(qF):
+    # get the next fields from the reader thread
+    F = qF.get()
+    if isinstance(F, Exception):
+        raise F
+    return F
+
+def get_trim_mask(plon, plat, maskr=None):
+    """
+    Returns a Boolean vector that is True for particles in the water,
+    i.e. those we keep when trimming initial positions.
+    maskr is the flattened rho mask (1 in water, 0 on land), and if it
+    is not passed we use the one for the experiment grid.
+    """
+    if maskr is None:
+        maskr = np.array(Maskr, dtype=float).flatten()
+    xy = np.array((plon,plat)).T
+    pmask = maskr[get_tree('xyT_rho_un').query(xy, n_jobs=-1)[1]]
+    # keep only points with pmask >= maskr_crit
+    pcond = pmask >= maskr_crit
+    return pcond
+    
 def update_position(dxg, dyg, maskr, V, ZH, S, dt_sec, plon, plat, pcs, surface):
     
     # find the new position
@@ -357,7 +373,7 @@ def update_position(dxg, dyg, maskr, V, ZH, S, dt_sec, plon, plat, pcs, surface)
     # Experiments with "trap0" to explore trapping in the Skokomish
     # showed that ## = 0.5 is a reasonable choice.
     xy = np.array((Plon,Plat)).T
-    pmask = maskr[xyT_rho_un.query(xy, n_jobs=-1)[1]]
+    pmask = maskr[get_tree('xyT_rho_un').query(xy, n_jobs=-1)[1]]
     pcond = pmask < maskr_crit # a Boolean mask
     if len(pcond) > 0:
         # these randint calls give random vectors of -1,0,1 (note the 2!)
@@ -367,12 +383,15 @@ def update_position(dxg, dyg, maskr, V, ZH, S, dt_sec, plon, plat, pcs, surface)
         Plat[pcond] = plat[pcond] + 0.5*riy[pcond]*dyg
         
     # move any particles on land to the middle of the nearest good rho point.
-    xy = np.array((Plon,Plat)).T
-    pmask = maskr[xyT_rho_un.query(xy, n_jobs=-1)[1]]
-    pcond = pmask < maskr_crit # a Boolean mask
-    if len(pcond) > 0:
-        Plon_new = lonrf[xyT_rho.query(xy, n_jobs=-1)[1]]
-        Plat_new = latrf[xyT_rho.query(xy, n_jobs=-1)[1]]
+    # (if none were moved above the positions and pmask are unchanged)
+    if pcond.any():
+        xy = np.array((Plon,Plat)).T
+        pmask = maskr[get_tree('xyT_rho_un').query(xy, n_jobs=-1)[1]]
+        pcond = pmask < maskr_crit # a Boolean mask
+    if pcond.any():
+        ind = get_tree('xyT_rho').query(xy, n_jobs=-1)[1]
+        Plon_new = lonrf[ind]
+        Plat_new = latrf[ind]
         Plon[pcond] = Plon_new[pcond]
         Plat[pcond] = Plat_new[pcond]
         
@@ -410,31 +429,31 @@ def update_position(dxg, dyg, maskr, V, ZH, S, dt_sec, plon, plat, pcs, surface)
 
     return Plon, Plat, Pcs
 
-def get_vel_new(uf0,uf1,vf0,vf1,wf0,wf1, plon, plat, pcs, frac, surface):
+def get_vel_new(uf0,uf1,vf0,vf1,wf0,wf1, plon, plat, pcs, frac, surface, W=None):
     # Get the velocity at all points, at an arbitrary time between two saves
     # "frac" is the fraction of the way between the times of ds0 and ds1, 0 <= frac <= 1.
     # NOTE: with ndiv=1 this gets called 4 times per hour, or 96 times per day.
+    # W is from get_weights(), and if it is not passed we use the KDTrees.
+    if W is None:
+        W = get_weights(plon, plat, pcs, 'tree')
     NP = len(plon)
     V = np.zeros((NP,3))
     if surface == True:
-        xy = np.array((plon,plat)).T
-        # use n_jobs=-1 to use all available cores
-        ui0 = uf0[xyT_u.query(xy, n_jobs=-1)[1]]
-        vi0 = vf0[xyT_v.query(xy, n_jobs=-1)[1]]
-        ui1 = uf1[xyT_u.query(xy, n_jobs=-1)[1]]
-        vi1 = vf1[xyT_v.query(xy, n_jobs=-1)[1]]
+        ui0 = interp_field(W, 'u2', uf0)
+        vi0 = interp_field(W, 'v2', vf0)
+        ui1 = interp_field(W, 'u2', uf1)
+        vi1 = interp_field(W, 'v2', vf1)
         ui = (1 - frac)*ui0 + frac*ui1
         vi = (1 - frac)*vi0 + frac*vi1
         V[:,0] = ui
         V[:,1] = vi
     else:
-        xys = np.array((plon,plat,pcs)).T
-        ui0 = uf0[xyzT_u.query(xys, n_jobs=-1)[1]]
-        vi0 = vf0[xyzT_v.query(xys, n_jobs=-1)[1]]
-        wi0 = wf0[xyzT_w.query(xys, n_jobs=-1)[1]]
-        ui1 = uf1[xyzT_u.query(xys, n_jobs=-1)[1]]
-        vi1 = vf1[xyzT_v.query(xys, n_jobs=-1)[1]]
-        wi1 = wf1[xyzT_w.query(xys, n_jobs=-1)[1]]
+        ui0 = interp_field(W, 'u3', uf0)
+        vi0 = interp_field(W, 'v3', vf0)
+        wi0 = interp_field(W, 'w3', wf0)
+        ui1 = interp_field(W, 'u3', uf1)
+        vi1 = interp_field(W, 'v3', vf1)
+        wi1 = interp_field(W, 'w3', wf1)
         ui = (1 - frac)*ui0 + frac*ui1
         vi = (1 - frac)*vi0 + frac*vi1
         wi = (1 - frac)*wi0 + frac*wi1
@@ -443,83 +462,94 @@ def get_vel_new(uf0,uf1,vf0,vf1,wf0,wf1, plon, plat, pcs, frac, surface):
         V[:,2] = wi
     return V
     
-def get_zh_new(zf0,zf1,hf, plon, plat, frac):
+def get_zh_new(zf0,zf1,hf, plon, plat, frac, W=None):
     # Get zeta and h at all points, at an arbitrary time between two saves
+    if W is None:
+        W = get_weights(plon, plat, None, 'tree')
     NP = len(plon)
-    xy = np.array((plon,plat)).T
-    zi0 = zf0[xyT_rho.query(xy, n_jobs=-1)[1]]
-    zi1 = zf1[xyT_rho.query(xy, n_jobs=-1)[1]]
-    hi = hf[xyT_rho.query(xy, n_jobs=-1)[1]]
+    zi0 = interp_field(W, 'rho2', zf0, renorm=True)
+    zi1 = interp_field(W, 'rho2', zf1, renorm=True)
+    hi = interp_field(W, 'rho2', hf, renorm=True)
     zi = (1 - frac)*zi0 + frac*zi1
     ZH = np.zeros((NP,2))
     ZH[:,0] = zi
     ZH[:,1] = hi
     return ZH
     
-def get_VR_new(tf0,tf1, plon, plat, pcs, frac, surface):
+def get_VR_new(tf0,tf1, plon, plat, pcs, frac, surface, W=None):
     # Get a variable on the z_rho grid at all points.
+    if W is None:
+        W = get_weights(plon, plat, pcs, 'tree')
     if surface == True:
-        xy = np.array((plon,plat)).T
-        ti0 = tf0[xyT_rho.query(xy, n_jobs=-1)[1]]
-        ti1 = tf1[xyT_rho.query(xy, n_jobs=-1)[1]]
+        gg = 'rho2'
     else:
-        xys = np.array((plon,plat,pcs)).T
-        ti0 = tf0[xyzT_rho.query(xys, n_jobs=-1)[1]]
-        ti1 = tf1[xyzT_rho.query(xys, n_jobs=-1)[1]]
+        gg = 'rho3'
+    ti0 = interp_field(W, gg, tf0, renorm=True)
+    ti1 = interp_field(W, gg, tf1, renorm=True)
     ti = (1 - frac)*ti0 + frac*ti1
     return ti
     
-def get_wind_new(Uwindf0, Uwindf1, Vwindf0, Vwindf1, plon, plat, frac, windage):
+def get_wind_new(Uwindf0, Uwindf1, Vwindf0, Vwindf1, plon, plat, frac, windage, W=None):
     # creates the windage correction to the surface velocity (u,v only)
+    if W is None:
+        W = get_weights(plon, plat, None, 'tree')
     NP = len(plon)
     Vwind3 = np.zeros((NP,3))
-    xy = np.array((plon,plat)).T
-    Uwind00 = Uwindf0[xyT_rho.query(xy, n_jobs=-1)[1]]
-    Uwind11 = Uwindf1[xyT_rho.query(xy, n_jobs=-1)[1]]
+    Uwind00 = interp_field(W, 'rho2', Uwindf0, renorm=True)
+    Uwind11 = interp_field(W, 'rho2', Uwindf1, renorm=True)
     Uwind = (1 - frac)*Uwind00 + frac*Uwind11
-    Vwind00 = Vwindf0[xyT_rho.query(xy, n_jobs=-1)[1]]
-    Vwind11 = Vwindf1[xyT_rho.query(xy, n_jobs=-1)[1]]
+    Vwind00 = interp_field(W, 'rho2', Vwindf0, renorm=True)
+    Vwind11 = interp_field(W, 'rho2', Vwindf1, renorm=True)
     Vwind = (1 - frac)*Vwind00 + frac*Vwind11
     Vwind3[:,0] = windage*Uwind
     Vwind3[:,1] = windage*Vwind
     return Vwind3
     
-def get_AKs_new(AKsf, plon, plat, pcs):
+def get_AKs_new(AKsf, plon, plat, pcs, W=None):
     # Get AKs at all points, at one time.
-    xys = np.array((plon,plat,pcs)).T
-    AKsi = AKsf[xyzT_w.query(xys, n_jobs=-1)[1]]
+    if W is None:
+        W = get_weights(plon, plat, pcs, 'tree')
+    AKsi = interp_field(W, 'w3', AKsf)
     return AKsi
     
-def get_dAKs_new(AKsf0, AKsf1, zf0,zf1,hf, plon, plat, pcs, S, frac):
+def get_dAKs_new(AKsf0, AKsf1, zf0,zf1,hf, plon, plat, pcs, S, frac, W=None):
     # create diffusivity gradient for turbulence calculation
+    # (the W's for the shifted vertical positions share the horizontal
+    # part of the W for the particle positions)
+    if W is None:
+        W = get_weights(plon, plat, pcs, 'tree')
     
     # first time
-    ZH0 = get_zh_new(zf0,zf1,hf, plon, plat, 0)
+    ZH0 = get_zh_new(zf0,zf1,hf, plon, plat, 0, W=W)
     dpcs0 = 1/(ZH0.sum(axis=1)) # change in pcs for a total of a 2m difference
     #     upper variables
     pcs0u = pcs + dpcs0
     pcs0u[pcs0u > S['Cs_w'][-1]] = S['Cs_w'][-1]
-    AKs0u = get_AKs_new(AKsf0, plon, plat, pcs0u)
+    W0u = get_weights(plon, plat, pcs0u, W['interp'], Wh=W)
+    AKs0u = get_AKs_new(AKsf0, plon, plat, pcs0u, W=W0u)
     z0u = pcs0u * ZH0.sum(axis=1)
     #     lower variables
     pcs0b = pcs - dpcs0
     pcs0b[pcs0b < S['Cs_w'][0]] = S['Cs_w'][0]
-    AKs0b = get_AKs_new(AKsf0, plon, plat, pcs0b)
+    W0b = get_weights(plon, plat, pcs0b, W['interp'], Wh=W)
+    AKs0b = get_AKs_new(AKsf0, plon, plat, pcs0b, W=W0b)
     z0b = pcs0b * ZH0.sum(axis=1)
     V0 = (AKs0u-AKs0b)/(z0u-z0b)
     
     # second time
-    ZH1 = get_zh_new(zf0,zf1,hf, plon, plat, 1)
+    ZH1 = get_zh_new(zf0,zf1,hf, plon, plat, 1, W=W)
     dpcs1 = 1/(ZH1.sum(axis=1)) # change in pcs for a total of a 2m difference
     #     upper variables
     pcs1u = pcs + dpcs1
     pcs1u[pcs1u > S['Cs_w'][-1]] = S['Cs_w'][-1]
-    AKs1u = get_AKs_new(AKsf1, plon, plat, pcs1u)
+    W1u = get_weights(plon, plat, pcs1u, W['interp'], Wh=W)
+    AKs1u = get_AKs_new(AKsf1, plon, plat, pcs1u, W=W1u)
     z1u = pcs1u * ZH1.sum(axis=1)
     #     lower variables
     pcs1b = pcs - dpcs1
     pcs1b[pcs1b < S['Cs_w'][0]] = S['Cs_w'][0]
-    AKs1b = get_AKs_new(AKsf1, plon, plat, pcs1b)
+    W1b = get_weights(plon, plat, pcs1b, W['interp'], Wh=W)
+    AKs1b = get_AKs_new(AKsf1, plon, plat, pcs1b, W=W1b)
     z1b = pcs1b * ZH1.sum(axis=1)
     V1 = (AKs1u-AKs1b)/(z1u-z1b)
     
@@ -528,10 +558,12 @@ def get_dAKs_new(AKsf0, AKsf1, zf0,zf1,hf, plon, plat, pcs, S, frac):
     
     return V
 
-def get_turb_new(dAKs, AKsf0, AKsf1, delta_t, plon, plat, pcs, frac):
+def get_turb_new(dAKs, AKsf0, AKsf1, delta_t, plon, plat, pcs, frac, W=None):
     # get the vertical turbulence correction components
-    V0 = get_AKs_new(AKsf0, plon, plat, pcs)
-    V1 = get_AKs_new(AKsf1, plon, plat, pcs)
+    if W is None:
+        W = get_weights(plon, plat, pcs, 'tree')
+    V0 = get_AKs_new(AKsf0, plon, plat, pcs, W=W)
+    V1 = get_AKs_new(AKsf1, plon, plat, pcs, W=W)
     
     # create weighted average diffusivity
     Vave = (1 - frac)*V0 + frac*V1
@@ -544,6 +576,180 @@ def get_turb_new(dAKs, AKsf0, AKsf1, delta_t, plon, plat, pcs, frac):
     
     return V
 
+def make_interp_info():
+    """
+    Fills the module dict R with what get_weights() needs to do index-based
+    interpolation on our plaid grids.  For each horizontal grid (rho, u, v) we
+    keep the coordinate vectors and a map from (j,i) to the index of that
+    water point in the flattened fields (-1 on land).  For each 3-D grid we
+    also keep the fractional depth (z/h at zeta=0) of every level in every
+    water column, which is the same vertical coordinate used by the KDTrees.
+    """
+    tt0 = time()
+    h = np.array(G['h'])
+    for tag in ['rho', 'u', 'v']:
+        mask = np.array(G['mask_' + tag], dtype=bool)
+        imap = -np.ones(mask.shape, dtype=int)
+        imap[mask] = np.arange(mask.sum())
+        R['lon_' + tag] = np.array(G['lon_' + tag][0,:])
+        R['lat_' + tag] = np.array(G['lat_' + tag][:,0])
+        R['imap_' + tag] = imap
+        R['Nw_' + tag] = mask.sum()
+    for gg in ['rho3', 'u3', 'v3', 'w3']:
+        if gg == 'u3':
+            hh = (h[:,:-1] + h[:,1:])/2
+            mask = R['imap_u'] >= 0
+        elif gg == 'v3':
+            hh = (h[:-1,:] + h[1:,:])/2
+            mask = R['imap_v'] >= 0
+        else:
+            hh = h.copy()
+            mask = R['imap_rho'] >= 0
+        if gg == 'w3':
+            z = zrfun.get_z(hh, 0*hh, S, only_w=True)
+        else:
+            z = zrfun.get_z(hh, 0*hh, S, only_rho=True)
+        R['Z_' + gg] = np.array(z/hh)[:, mask]
+    print('Make interpolation info %0.4f sec' % (time()-tt0))
+
+def get_weights(plon, plat, pcs, interp, Wh=None):
+    """
+    Makes the object W that is used by interp_field() to get any of our
+    fields at a set of particle positions.  W is specific to these positions
+    and is a cache: the neighbor indices and weights for a given grid are
+    found the first time a field on that grid is asked for, and then reused
+    for every other field on that grid.  Make a new one whenever the
+    positions change.
+    
+    interp = 'tree' uses nearest neighbor from the KDTrees, 'linear' gives
+    bilinear or trilinear interpolation, and 'nearest' gives the nearest
+    water point in the cell.  The last two find the grid cell of each
+    particle directly from the grid indices, because our grids are plaid.
+    
+    The grids are 'rho2', 'u2', 'v2' (horizontal only, used for zeta, h,
+    wind, and surface fields) and 'rho3', 'u3', 'v3', 'w3'.
+    
+    Pass Wh (a W made at the same plon, plat) to share its horizontal
+    results when only the vertical position has changed.
+    """
+    W = dict()
+    W['interp'] = interp
+    W['plon'] = plon
+    W['plat'] = plat
+    W['pcs'] = pcs
+    if Wh is not None:
+        W['H'] = Wh['H']
+    else:
+        W['H'] = dict()
+    return W
+
+def get_bracket(x, xvec):
+    """
+    Returns the index i0 below each x in the increasing vector xvec, and the
+    fraction fr of the way to xvec[i0+1], with x outside the range of xvec
+    clipped to the end points.
+    """
+    i0 = np.searchsorted(xvec, x, side='right') - 1
+    i0[i0 < 0] = 0
+    i0[i0 > len(xvec) - 2] = len(xvec) - 2
+    fr = (x - xvec[i0])/(xvec[i0+1] - xvec[i0])
+    fr[fr < 0] = 0
+    fr[fr > 1] = 1
+    return i0, fr
+
+def get_ind_wt(W, gg):
+    """
+    Returns the tuple (ind, wt) of arrays that are [neighbor, particle] for
+    grid gg, finding them if they are not yet in W.  Land neighbors get zero
+    weight.  With the KDTrees there is a single neighbor with weight one.
+    """
+    if gg[-1] == '2':
+        # horizontal results go in W['H'] so they can be shared
+        WW = W['H']
+    else:
+        WW = W
+    if gg in WW.keys():
+        return WW[gg]
+    tag = gg[:-1]
+    if tag == 'w':
+        tag = 'rho'
+    plon = W['plon']; plat = W['plat']; pcs = W['pcs']
+    NP = len(plon)
+    pp = np.arange(NP)
+    if W['interp'] == 'tree':
+        tree_dict = {'rho2':'xyT_rho', 'u2':'xyT_u', 'v2':'xyT_v',
+            'rho3':'xyzT_rho', 'u3':'xyzT_u', 'v3':'xyzT_v', 'w3':'xyzT_w'}
+        if gg[-1] == '2':
+            xy = np.array((plon,plat)).T
+        else:
+            xy = np.array((plon,plat,pcs)).T
+        ind = get_tree(tree_dict[gg]).query(xy, n_jobs=-1)[1].reshape(1,NP)
+        wt = np.ones((1,NP))
+        WW[gg] = (ind, wt)
+        return WW[gg]
+    if len(R) == 0:
+        make_interp_info()
+    # horizontal corners and weights
+    if tag not in W['H'].keys():
+        i0, fx = get_bracket(plon, R['lon_' + tag])
+        j0, fy = get_bracket(plat, R['lat_' + tag])
+        col = np.array([R['imap_' + tag][j0, i0], R['imap_' + tag][j0, i0+1],
+            R['imap_' + tag][j0+1, i0], R['imap_' + tag][j0+1, i0+1]])
+        hwt = np.array([(1-fy)*(1-fx), (1-fy)*fx, fy*(1-fx), fy*fx])
+        hwt[col < 0] = 0
+        W['H'][tag] = (col, hwt)
+    col, hwt = W['H'][tag]
+    if gg[-1] == '2':
+        ind = col.copy()
+        wt = hwt.copy()
+    else:
+        # vertical levels and weights, found separately in each corner column
+        Z = R['Z_' + gg]
+        NZ = Z.shape[0]
+        Nw = R['Nw_' + tag]
+        ind = np.zeros((8, NP), dtype=int)
+        wt = np.zeros((8, NP))
+        for ic in range(4):
+            cc = col[ic,:].copy()
+            cc[cc < 0] = 0
+            Zc = Z[:, cc]
+            k0 = (Zc <= pcs).sum(axis=0) - 1
+            k0[k0 < 0] = 0
+            k0[k0 > NZ - 2] = NZ - 2
+            z0 = Zc[k0, pp]
+            z1 = Zc[k0+1, pp]
+            fz = (pcs - z0)/(z1 - z0)
+            fz[fz < 0] = 0
+            fz[fz > 1] = 1
+            ind[2*ic,:] = k0*Nw + cc
+            ind[2*ic+1,:] = (k0+1)*Nw + cc
+            wt[2*ic,:] = hwt[ic,:]*(1 - fz)
+            wt[2*ic+1,:] = hwt[ic,:]*fz
+    if W['interp'] == 'nearest':
+        # keep only the water corner with the largest weight
+        imax = wt.argmax(axis=0)
+        has_water = wt.sum(axis=0) > 0
+        wt = np.zeros_like(wt)
+        wt[imax, pp] = has_water
+    WW[gg] = (ind, wt)
+    return WW[gg]
+
+def interp_field(W, gg, ff, renorm=False):
+    """
+    Get the flattened (water points only) field ff on grid gg at the
+    positions of W.  With renorm=False land neighbors act as zeros,
+    as we want for velocity and diffusivity.  With renorm=True the weights
+    of the water neighbors are rescaled to sum to one, as we want for
+    tracers, zeta, and h.
+    """
+    ind, wt = get_ind_wt(W, gg)
+    fi = (wt*ff[ind]).sum(axis=0)
+    if renorm:
+        wsum = wt.sum(axis=0)
+        fi[wsum > 0] = fi[wsum > 0]/wsum[wsum > 0]
+        fi[wsum == 0] = np.nan
+    return fi
+
 def get_fn_list(idt, Ldir):
     # LiveOcean version, for 1 day only.
     # Assumes we have history files 1-25, corresponding to hours 0-24.
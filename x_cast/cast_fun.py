@@ -76,8 +76,8 @@ def get_cast(gridname, tag, ex_name, date_string, station, lon_str, lat_str):
         print('Not found: ' + fn)
         return
     
-    G = zrfun.get_basic_info(fn, only_G=True)
-    S = zrfun.get_basic_info(fn, only_S=True)
+    G = zrfun.get_basic_info(fn, only_G=True, cache=True)
+    S = zrfun.get_basic_info(fn, only_S=True, cache=True)
 
     lon = G['lon_rho']
     lat = G['lat_rho']
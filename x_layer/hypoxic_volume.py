@@ -1,5 +1,19 @@
 """
-This calculates hypoxic volume.
+This calculates hypoxic volume, and other column reductions.
+
+The thickness of hypoxic water (oxygen <= -ox, default 60 uM) is saved as
+hyp_dz, masked where there is none (as before), along with the time series of
+total hypoxic volume (km3) as hyp_dz_vol.
+
+Optionally it also makes:
+- the thickness of water below other thresholds, e.g. -thr salt:30,temp:8
+    makes salt_dz30 and temp_dz8, with their volumes
+- column integrals and volume-weighted means, e.g. -vn NO3,phytoplankton -ci vint,vave
+    makes NO3_vint and NO3_vave (and for phytoplankton), with the grid
+    totals NO3_vint_tot and the volume-weighted means NO3_vave_mean
+
+The history files are processed in blocks by a pool of processes (see
+layer_fun.py), using the actual time-varying layer thickness.
 
 """
 
@@ -11,6 +25,8 @@ import Lfun
 import zrfun
 import zfun
 
+import layer_fun
+
 import numpy as np
 import netCDF4 as nc
 import argparse
@@ -33,6 +49,14 @@ parser.add_argument('-0', '--date_string0', nargs='?', type=str, default='2019.0
 parser.add_argument('-1', '--date_string1', nargs='?', type=str, default='2019.07.05')
 parser.add_argument('-lt', '--list_type', nargs='?', type=str, default='daily')
 parser.add_argument('-test', '--testing', default=False, type=boolean_string)
+# column reduction arguments
+parser.add_argument('-ox', '--oxygen_threshold', nargs='?', type=float, default=60)
+parser.add_argument('-thr', '--thr_list', nargs='?', type=str, default='')
+parser.add_argument('-vn', '--vn_list', nargs='?', type=str, default='')
+parser.add_argument('-ci', '--col_list', nargs='?', type=str, default='')
+# performance
+parser.add_argument('-Nproc', nargs='?', type=int, default=4)
+parser.add_argument('-nbuf', nargs='?', type=int, default=24)
 args = parser.parse_args()
 
 # save some arguments
@@ -62,82 +86,34 @@ try:
 except OSError:
     pass
     
-# lists of variables to process
-dlist = ['xi_rho', 'eta_rho', 'xi_psi', 'eta_psi', 'ocean_time']
-vn_list_2d = [ 'lon_rho', 'lat_rho', 'lon_psi', 'lat_psi', 'mask_rho', 'h']
-vn_list_2d_custom = ['DA']
-vn_list_3d_t_custom = ['hyp_dz']
-
 # make some things
 fn = fn_list[0]
-G = zrfun.get_basic_info(fn, only_G=True)
-DA = G['DX'] * G['DY']
-ny, nx = DA.shape
+G = zrfun.get_basic_info(fn, only_G=True, cache=True)
+S = zrfun.get_basic_info(fn, only_S=True, cache=True)
 h = G['h']
-S = zrfun.get_basic_info(fn, only_S=True)
-zr, zw = zrfun.get_z(h, 0*h, S)
-dzr = np.diff(zw, axis=0)
-
-ds1 = nc.Dataset(fn)
-ds2 = nc.Dataset(out_fn, 'w')
-
-# Create dimensions
-for dname, the_dim in ds1.dimensions.items():
-    if dname in dlist:
-        ds2.createDimension(dname, len(the_dim) if not the_dim.isunlimited() else None)
-        
-# Create variables and their attributes
-# - first time
-vn = 'ocean_time'
-varin = ds1[vn]
-vv = ds2.createVariable(vn, varin.dtype, varin.dimensions)
-vv.long_name = varin.long_name
-vv.units = varin.units
-# - then static 2d fields
-for vn in vn_list_2d:
-    varin = ds1[vn]
-    vv = ds2.createVariable(vn, varin.dtype, varin.dimensions)
-    vv.setncatts({k: varin.getncattr(k) for k in varin.ncattrs()})
-    vv[:] = ds1[vn][:]
-# - then static custom fields
-for vn in vn_list_2d_custom:
-    if vn == 'DA':
-        vv = ds2.createVariable(vn, float, ('eta_rho', 'xi_rho'))
-        vv.long_name = 'Cell horizontal area'
-        vv.units = 'm2'
-        vv[:] = DA
-#
-# - then time-dependent custom 3d fields (processed into 2d)
-for vn in vn_list_3d_t_custom:
-    if vn == 'hyp_dz':
-        vv = ds2.createVariable(vn, float, ('ocean_time', 'eta_rho', 'xi_rho'))
-        vv.long_name = 'Thickess of hypoxic water'
-        vv.units = 'm'
-        vv.time='ocean_time'
-# Copy time dependent data
-omat = np.nan * np.ones(h.shape)
-omat = np.ma.masked_where(G['mask_rho']==0, omat)
-
-tt = 0
-NF = len(fn_list)
-for fn in fn_list:
-    if np.mod(tt,24)==0:
-        print(' working on %d of %d' % (tt, NF))
-        sys.stdout.flush()
-    ds = nc.Dataset(fn)
-    
-    ds2['ocean_time'][tt] = ds['ocean_time'][0]
-        
-    for vn in vn_list_3d_t_custom:
-        if vn == 'hyp_dz':
-            oxy = ds['oxygen'][0,:,:,:]
-            dzrm = np.ma.masked_where(oxy > 60, dzr)
-            hyp_dz = dzrm.sum(axis=0)
-            ds2[vn][tt,:,:] = hyp_dz
-        
-    tt += 1
-    ds.close()
-
+Z = layer_fun.get_Z(fn)
+
+# specify the fields to process
+specs = dict()
+specs['hyp_dz'] = ('thick', 'oxygen', args.oxygen_threshold)
+for item in args.thr_list.split(','):
+    if len(item) > 0:
+        vn, thr = item.split(':')
+        specs[vn + '_dz' + ('%g' % float(thr))] = ('thick', vn, float(thr))
+vn_list = [item for item in args.vn_list.split(',') if len(item) > 0]
+col_list = [item for item in args.col_list.split(',') if len(item) > 0]
+specs.update(layer_fun.make_specs(vn_list, col_list=col_list))
+static = {'DA': None}
+
+# create the output file and its variables, to be written later
+layer_fun.start_layer_file(out_fn, fn, specs, static, G, S, nbuf=args.nbuf,
+    totals=True)
+
+# process blocks of nbuf hours in parallel
+layer_fun.write_blocks(out_fn, fn_list, specs, Z, Nproc=args.Nproc, nbuf=args.nbuf,
+    totals=True)
+
+ds2 = nc.Dataset(out_fn)
 if args.testing:
     sys.path.append(os.path.abspath('../plotting'))
     import pfun
@@ -145,6 +121,7 @@ if args.testing:
     plt.close('all')
     fs=16
     plt.rc('font', size=fs)
+    hyp_dz = ds2['hyp_dz'][-1,:,:]
     fig = plt.figure(figsize=(10,12))
     ax = fig.add_subplot(111)
     cs = ax.pcolormesh(G['lon_psi'],G['lat_psi'],
@@ -169,7 +146,7 @@ if args.testing:
     for vn in ds2.variables:
         print(vn)
 
-ds1.close()
+print(' Max hypoxic volume = %0.2f km3' % (ds2['hyp_dz_vol'][:].max()))
 ds2.close()
 
 # finale
@@ -0,0 +1,396 @@
+"""
+Layer extraction functions, used by layer_extractor.py.
+
+A layer extraction is defined by an ordered dict of "specs", one for each
+output field, like:
+
+specs['salt_s0'] = ('s', 'salt', 0) # salt on s-level 0 (the bottom)
+specs['temp_z30'] = ('z', 'temp', -30.) # temp at z = -30 m
+specs['salt_vave'] = ('vave', 'salt', None) # vertical average of salt
+
+The kinds are:
+'2d'    a 2-D field, like zeta or sustr
+'s'     a 3-D field on s-level arg (an index, like 0 or -1)
+'z'     a 3-D field interpolated to z = arg (m, negative down)
+'vint'  the vertical integral of a 3-D field (units * m)
+'vave'  the vertical average of a 3-D field
+'thick' the thickness of water where a 3-D field is <= arg, like the
+        thickness of hypoxic water for ('thick', 'oxygen', 60), masked
+        where it is zero (and on land)
+'mix'   the vertically integrated destruction of salinity variance
+Fields on the u or v grids are averaged onto the rho grid.
+
+All the fields for an hour are made from a single read of each variable,
+and the vertical grid uses the actual zeta.  For the column reductions
+(vint, vave, thick) we use the fact that, for all ROMS vertical transforms,
+the layer thickness is dz = dz0 * (1 + zeta/h), where dz0 is for zeta = 0,
+so we only need zeta to get the exact dz each hour.
+
+Optionally the column reductions are also summed over the grid, giving
+time series of total volume (thick), total content (vint), or the
+volume-weighted mean (vave).
+"""
+
+import os, sys
+import numpy as np
+import netCDF4 as nc
+import zrfun
+
+def get_Z(fn):
+    """
+    Returns a dict of the static fields used by process_file(), for the grid
+    of history file fn.
+    """
+    G, S, ZZ = zrfun.get_grid_info(fn)
+    Z = {'h': G['h'], 'mask_rho': G['mask_rho'], 'S': S,
+        'dz0': np.diff(ZZ['z_w'], axis=0), 'DA': ZZ['DA']}
+    return Z
+
+def get_totals(specs):
+    """
+    Returns a dict of the names of the grid totals of the column
+    reductions in specs, as (name: (spec name, kind)).
+    """
+    suffix_dict = {'thick': '_vol', 'vint': '_tot', 'vave': '_mean'}
+    tot_dict = dict()
+    for vo in specs.keys():
+        kind = specs[vo][0]
+        if kind in suffix_dict.keys():
+            tot_dict[vo + suffix_dict[kind]] = (vo, kind)
+    return tot_dict
+
+def get_layer_specs(layer_name):
+    """
+    Returns the specs and static fields of the named layer extractions,
+    which are the original menu of layer_extractor.py.
+    The static fields are a dict of (name: arg).
+    """
+    specs = dict()
+    static = dict()
+    if layer_name == 'zeta':
+        for vn in ['zeta', 'Pair']:
+            specs[vn] = ('2d', vn, None)
+    elif layer_name == 'bottom':
+        for vn in ['zeta', 'Pair', 'bustr', 'bvstr']:
+            specs[vn] = ('2d', vn, None)
+        for vn in ['salt', 'temp', 'u', 'v']:
+            specs[vn] = ('s', vn, 0)
+        static['zlay'] = 0
+    elif layer_name == 'surface':
+        for vn in ['zeta', 'sustr', 'svstr']:
+            specs[vn] = ('2d', vn, None)
+        for vn in ['salt', 'temp', 'u', 'v']:
+            specs[vn] = ('s', vn, -1)
+    elif layer_name == 'surface_more':
+        for vn in ['zeta', 'Uwind', 'Vwind']:
+            specs[vn] = ('2d', vn, None)
+        for vn in ['salt', 'temp', 'phytoplankton', 'zooplankton', 'NO3', 'u', 'v']:
+            specs[vn] = ('s', vn, -1)
+    elif layer_name == 'bottom_DO':
+        for vn in ['sustr', 'svstr']:
+            specs[vn] = ('2d', vn, None)
+        for vn in ['salt', 'temp', 'oxygen']:
+            specs[vn] = ('s', vn, 0)
+    elif layer_name == 'svar':
+        # a custom extraction of vertically integrated "mixing" in the
+        # sense of destruction of salinity variance
+        specs['mix'] = ('mix', 'salt', None)
+        static['DA'] = None
+    elif layer_name == 'vave':
+        # a custom extraction of vertically averaged properties
+        for vn in ['salt', 'temp', 'rho']:
+            specs['vave_' + vn] = ('vave', vn, None)
+    else:
+        print('Unsupported layer name')
+        sys.exit()
+    return specs, static
+
+def make_specs(vn_list, s_list=[], z_list=[], col_list=[], N=None):
+    """
+    Returns the specs for every combination of the 3-D variables in vn_list
+    with the s-levels in s_list, the z-levels in z_list, and the column
+    operations (like 'vave' and 'vint') in col_list.  N is the number of
+    s-levels, used to give negative s-levels their positive names.
+    """
+    specs = dict()
+    for vn in vn_list:
+        for nlay in s_list:
+            if (N != None) and (nlay < 0):
+                nn = N + nlay
+            else:
+                nn = nlay
+            specs[vn + '_s' + str(nn)] = ('s', vn, nlay)
+        for zlev in z_list:
+            specs[vn + '_z' + ('%g' % abs(zlev))] = ('z', vn, zlev)
+        for col in col_list:
+            specs[vn + '_' + col] = (col, vn, None)
+    return specs
+
+def start_layer_file(out_fn, fn, specs, static, G, S, nbuf=24, totals=False):
+    """
+    Creates the output file out_fn, with the dimensions and attributes
+    from the history file fn, the static fields, and empty time-dependent
+    fields chunked in blocks of nbuf times.  If totals is True we also make
+    the time series of grid totals.
+    """
+    dlist = ['xi_rho', 'eta_rho', 'xi_psi', 'eta_psi', 'ocean_time']
+    vn_list_2d = [ 'lon_rho', 'lat_rho', 'lon_psi', 'lat_psi', 'mask_rho', 'h']
+    ds1 = nc.Dataset(fn)
+    ds2 = nc.Dataset(out_fn, 'w')
+    # Create dimensions
+    for dname, the_dim in ds1.dimensions.items():
+        if dname in dlist:
+            ds2.createDimension(dname, len(the_dim) if not the_dim.isunlimited() else None)
+    # Create variables and their attributes
+    # - first time
+    vn = 'ocean_time'
+    varin = ds1[vn]
+    vv = ds2.createVariable(vn, varin.dtype, varin.dimensions, chunksizes=(nbuf,))
+    vv.long_name = varin.long_name
+    vv.units = varin.units
+    # - then static 2d fields
+    for vn in vn_list_2d:
+        varin = ds1[vn]
+        vv = ds2.createVariable(vn, varin.dtype, varin.dimensions)
+        vv.setncatts({k: varin.getncattr(k) for k in varin.ncattrs()})
+        vv[:] = ds1[vn][:]
+    # - then static custom fields
+    for vn in static.keys():
+        if vn == 'zlay':
+            zr = zrfun.get_z(G['h'], 0*G['h'], S, only_rho=True)
+            vv = ds2.createVariable(vn, float, ('eta_rho', 'xi_rho'))
+            vv.long_name = 'Layer Z position'
+            vv.units = 'm'
+            vv[:] = zr[static[vn], :, :]
+        elif vn == 'DA':
+            vv = ds2.createVariable(vn, float, ('eta_rho', 'xi_rho'))
+            vv.long_name = 'Cell horizontal area'
+            vv.units = 'm2'
+            vv[:] = G['DX'] * G['DY']
+    # - then time-dependent fields, all on the rho grid
+    dims = ('ocean_time', 'eta_rho', 'xi_rho')
+    chunks = (nbuf, G['M'], G['L'])
+    for vn in specs.keys():
+        kind, vn_in, arg = specs[vn]
+        if kind == 'mix':
+            vv = ds2.createVariable(vn, float, dims, chunksizes=chunks)
+            vv.long_name = 'Vertically Integrated Mixing'
+            vv.units = 'W m-2'
+            vv.time='ocean_time'
+            continue
+        varin = ds1[vn_in]
+        long_name = varin.long_name
+        units = getattr(varin, 'units', '') # salt has no units
+        if kind in ['2d', 's']:
+            vv = ds2.createVariable(vn, varin.dtype, dims, chunksizes=chunks)
+            if kind == 's':
+                vv.s_level = arg
+        else:
+            vv = ds2.createVariable(vn, float, dims, chunksizes=chunks)
+            if kind == 'z':
+                long_name = long_name + ' at z = ' + ('%g' % arg) + ' m'
+                vv.z_level = arg
+            elif kind == 'vint':
+                long_name = 'Vertically Integrated ' + long_name
+                units = (units + ' m').strip()
+            elif kind == 'vave':
+                long_name = 'Vertically Averaged ' + long_name
+            elif kind == 'thick':
+                long_name = ('Thickness of water with ' + long_name
+                    + ' <= ' + ('%g' % arg))
+                units = 'm'
+                vv.threshold = arg
+        vv.long_name = long_name
+        if len(units) > 0:
+            vv.units = units
+        vv.time = 'ocean_time'
+    # - then time series of grid totals
+    if totals:
+        tot_dict = get_totals(specs)
+        for tn in tot_dict.keys():
+            vo, kind = tot_dict[tn]
+            vv = ds2.createVariable(tn, float, ('ocean_time',), chunksizes=(nbuf,))
+            varin = ds1[specs[vo][1]]
+            units = getattr(varin, 'units', '')
+            if kind == 'thick':
+                vv.long_name = ('Total Volume of water with ' + varin.long_name
+                    + ' <= ' + ('%g' % specs[vo][2]))
+                vv.units = 'km3'
+            elif kind == 'vint':
+                vv.long_name = 'Total ' + varin.long_name
+                vv.units = (units + ' m3').strip()
+            elif kind == 'vave':
+                vv.long_name = 'Volume-Weighted Mean ' + varin.long_name
+                if len(units) > 0:
+                    vv.units = units
+            vv.time = 'ocean_time'
+    ds1.close()
+    ds2.close()
+
+def to_rho(fld, dims, mask):
+    """
+    Averages a field (with horizontal dimensions dims) from the u or v grid
+    onto the rho grid, masked on land and on the edges where it is not defined.
+    Fields on the rho grid are returned unchanged.
+    """
+    if dims[-1] == 'xi_u':
+        sh = fld.shape[:-1] + (mask.shape[-1],)
+        out = np.ma.masked_where(np.broadcast_to(mask==0, sh), np.nan * np.ones(sh))
+        out[..., 1:-1] = (fld[..., 1:] + fld[..., :-1])/2
+    elif dims[-2] == 'eta_v':
+        sh = fld.shape[:-2] + mask.shape
+        out = np.ma.masked_where(np.broadcast_to(mask==0, sh), np.nan * np.ones(sh))
+        out[..., 1:-1, :] = (fld[..., 1:, :] + fld[..., :-1, :])/2
+    else:
+        return fld
+    return np.ma.masked_where(np.isnan(out), out)
+
+def process_file(fn, specs, Z, totals=False):
+    """
+    Makes all the fields in specs for the history file fn, reading each
+    variable once.  Z is a dict from get_Z().
+    Returns a dict of 2-D masked arrays, and ocean_time, and the grid totals
+    if totals is True.
+    """
+    h = Z['h']
+    mask = Z['mask_rho']
+    S = Z['S']
+    ds = nc.Dataset(fn)
+    F = {'ocean_time': ds['ocean_time'][0]}
+    kind_list = [specs[vn][0] for vn in specs.keys()]
+    # the vertical grid, if needed
+    if len(set(kind_list) & set(['z', 'mix'])) > 0:
+        zeta = ds['zeta'][0, :, :]
+        z_rho, z_w = zrfun.get_z(h, zeta, S)
+        dz = np.diff(z_w, axis=0)
+    elif len(set(kind_list) & set(['vint', 'vave', 'thick'])) > 0:
+        zeta = ds['zeta'][0, :, :]
+        dz = Z['dz0'] * (1 + zeta/h)
+    if 'z' in kind_list:
+        # interpolation weights for all the z-levels, shared by all variables
+        import pfun # path provided by calling code
+        zfull = pfun.make_full((-h.reshape((1,) + h.shape), z_rho,
+            zeta.reshape((1,) + h.shape)))
+        zlev_list = sorted(set([specs[vo][2] for vo in specs.keys() if specs[vo][0] == 'z']))
+        W = pfun.get_layer_weights(zfull, np.array(zlev_list))
+        lay_dict = dict()
+    # read each variable once: all levels if needed, or else only the
+    # s-levels that are used
+    fld_dict = dict()
+    for vn in set([specs[vn][1] for vn in specs.keys()]):
+        my_kinds = [specs[vo][0] for vo in specs.keys() if specs[vo][1] == vn]
+        if set(my_kinds) <= set(['s']):
+            for nlay in set([specs[vo][2] for vo in specs.keys() if specs[vo][1] == vn]):
+                fld_dict[(vn, nlay)] = to_rho(ds[vn][0, nlay, :, :], ds[vn].dimensions, mask)
+        elif '2d' in my_kinds:
+            fld_dict[vn] = to_rho(ds[vn][0, :, :], ds[vn].dimensions, mask)
+        else:
+            fld_dict[vn] = to_rho(ds[vn][0, :, :, :], ds[vn].dimensions, mask)
+    for vo in specs.keys():
+        kind, vn, arg = specs[vo]
+        if kind == '2d':
+            F[vo] = fld_dict[vn]
+        elif kind == 's':
+            if (vn, arg) in fld_dict.keys():
+                F[vo] = fld_dict[(vn, arg)]
+            else:
+                F[vo] = fld_dict[vn][arg, :, :]
+        elif kind == 'z':
+            if vn not in lay_dict.keys():
+                # all the z-levels of this variable at once
+                lay = pfun.get_layers(pfun.make_full((fld_dict[vn],)), W)
+                lay[:, mask == False] = np.nan
+                lay_dict[vn] = np.ma.masked_where(np.isnan(lay), lay)
+            F[vo] = lay_dict[vn][zlev_list.index(arg), :, :]
+        elif kind == 'vint':
+            vint = np.sum(fld_dict[vn] * dz, axis=0)
+            F[vo] = np.ma.masked_where(mask==False, vint)
+        elif kind == 'vave':
+            vave = np.sum(fld_dict[vn] * dz, axis=0) / (h + zeta)
+            F[vo] = np.ma.masked_where(mask==False, vave)
+        elif kind == 'thick':
+            thick = np.sum(dz * (fld_dict[vn] <= arg), axis=0)
+            F[vo] = np.ma.masked_where((mask==False) | (thick == 0), thick)
+        elif kind == 'mix':
+            # calculate net destruction of variance by vertical mixing
+            salt = fld_dict[vn]
+            K = ds['AKs'][0, 1:-1, :, :]
+            dzw = np.diff(z_rho, axis=0)
+            dsdz = np.diff(salt, axis=0) / dzw
+            mix = 2 * K * dsdz**2
+            Mix = np.sum(mix * dzw, axis=0)
+            F[vo] = np.ma.masked_where(mask==0, Mix)
+    if totals:
+        DA = Z['DA']
+        tot_dict = get_totals(specs)
+        for tn in tot_dict.keys():
+            vo, kind = tot_dict[tn]
+            if kind == 'thick':
+                F[tn] = np.sum(np.ma.filled(F[vo], 0) * DA) / 1e9
+            elif kind == 'vint':
+                F[tn] = np.ma.sum(F[vo] * DA)
+            elif kind == 'vave':
+                DV = np.ma.masked_where(mask==False, (h + zeta) * DA)
+                F[tn] = np.ma.sum(F[vo] * DV) / np.ma.sum(DV)
+    ds.close()
+    return F
+
+def process_block(fn_list, specs, Z, totals=False):
+    """
+    Runs process_file() for a block of history files, and returns a dict of
+    the fields stacked in time (packed [time, eta, xi]).  This is the unit of
+    work done by each process in write_blocks().
+    """
+    F_list = [process_file(fn, specs, Z, totals=totals) for fn in fn_list]
+    FF = dict()
+    FF['ocean_time'] = np.array([F['ocean_time'] for F in F_list])
+    for vo in specs.keys():
+        FF[vo] = np.ma.stack([F[vo] for F in F_list], axis=0)
+    if totals:
+        for tn in get_totals(specs).keys():
+            FF[tn] = np.array([F[tn] for F in F_list])
+    return FF
+
+# The static fields used by the worker processes of write_blocks().  They are
+# inherited through fork, rather than pickled with every block, because
+# Z['dz0'] is a full 3-D field.
+pool_Z = dict()
+
+def pool_block(fn_list, specs, totals):
+    # process_block() for the worker processes of write_blocks()
+    return process_block(fn_list, specs, pool_Z, totals=totals)
+
+def write_blocks(out_fn, fn_list, specs, Z, Nproc=4, nbuf=24, totals=False):
+    """
+    Processes the history files in fn_list in blocks of nbuf hours, using a
+    pool of Nproc processes, and writes them to out_fn (made by
+    start_layer_file()).  Each group of Nproc blocks is written as it is
+    finished, to limit memory use.
+    """
+    import multiprocessing
+    global pool_Z
+    pool_Z = Z # set before the pool is made, so the workers inherit it
+    NF = len(fn_list)
+    fn_blocks = [fn_list[ii:ii + nbuf] for ii in range(0, NF, nbuf)]
+    NB = len(fn_blocks)
+    vn_list = list(specs.keys())
+    if totals:
+        vn_list += list(get_totals(specs).keys())
+    ctx = multiprocessing.get_context('fork')
+    tt = 0
+    with ctx.Pool(Nproc) as pool:
+        # open the output only after the fork, because HDF5 files must not
+        # be open when the workers are made
+        ds2 = nc.Dataset(out_fn, 'a')
+        for bb in range(0, NB, Nproc):
+            print(' working on %d of %d' % (tt, NF))
+            sys.stdout.flush()
+            FF_list = pool.starmap(pool_block,
+                [(fn_block, specs, totals) for fn_block in fn_blocks[bb:bb + Nproc]])
+            for FF in FF_list:
+                nt = len(FF['ocean_time'])
+                ds2['ocean_time'][tt:tt + nt] = FF['ocean_time']
+                for vn in vn_list:
+                    ds2[vn][tt:tt + nt] = FF[vn]
+                tt += nt
+        ds2.close()
@@ -2,9 +2,13 @@
 Mooring extraction functions.
 """
 
+import os, sys
+import pickle
 import numpy as np
 import netCDF4 as nc
+from time import time
 import zfun
+import zrfun
 
 def get_itp_dict(sta_dict, G):
     # get interpolants
@@ -116,4 +120,191 @@ def get_ij_good(lon, lat, mask, xvec, yvec, i0, j0):
     igood = ii[mm][dddm==dddm.min()][0]
     jgood = jj[mm][dddm==dddm.min()][0]
     #
-    return igood, jgood
\ No newline at end of file
+    return igood, jgood
+
+def get_bulk_its(sta_list, itp_dict):
+    # Stack the interpolants of all stations on each grid so that
+    # get_bulk() can get every station with a single read.  The read is
+    # the hyperslab (j0:j1, i0:i1) that bounds all the stations, and
+    # J, I are the station indices relative to its corner.
+    BI = dict()
+    for grd in ['rho', 'u', 'v']:
+        yi01 = np.array([[itp_dict[sn][1][grd], itp_dict[sn][3][grd]]
+            for sn in sta_list], dtype=int).reshape((-1,2))
+        xi01 = np.array([[itp_dict[sn][0][grd], itp_dict[sn][2][grd]]
+            for sn in sta_list], dtype=int).reshape((-1,2))
+        aix = np.array([itp_dict[sn][4][grd] for sn in sta_list]).reshape((-1,1,2))
+        aiy = np.array([itp_dict[sn][5][grd] for sn in sta_list]).reshape((-1,2))
+        BI[grd] = pack_bulk_its(yi01, xi01, aix, aiy)
+    return BI
+
+def get_bulk_its_ji(sta_list, ji_dict):
+    # Like get_bulk_its() but for the single nearest (j0, i0) of each
+    # station, used on all grids, as in mooring_extractor_fast.py.
+    nsta = len(sta_list)
+    yi01 = np.array([ji_dict[sn][0] for sn in sta_list], dtype=int).reshape((-1,1))
+    xi01 = np.array([ji_dict[sn][1] for sn in sta_list], dtype=int).reshape((-1,1))
+    BI = dict()
+    for grd in ['rho', 'u', 'v']:
+        BI[grd] = pack_bulk_its(yi01, xi01, np.ones((nsta,1,1)), np.ones((nsta,1)))
+    return BI
+
+def pack_bulk_its(yi01, xi01, aix, aiy):
+    j0 = yi01.min(); j1 = yi01.max()
+    i0 = xi01.min(); i1 = xi01.max()
+    bi = {'j0':j0, 'j1':j1, 'i0':i0, 'i1':i1,
+        'J':(yi01 - j0)[:,:,np.newaxis], 'I':(xi01 - i0)[:,np.newaxis,:],
+        'aix':aix, 'aiy':aiy}
+    return bi
+
+def get_bulk(ds, vv, BI):
+    # Returns the interpolated values of variable vv at all stations, with
+    # station as the last axis: (nsta,) for 2-D fields and (N, nsta) or
+    # (N+1, nsta) for 3-D fields.  The time axis (one record in a history
+    # file) is dropped.
+    dims = ds.variables[vv].dimensions
+    if 'eta_rho' in dims:
+        grd = 'rho'
+    elif 'eta_u' in dims:
+        grd = 'u'
+    elif 'eta_v' in dims:
+        grd = 'v'
+    else:
+        print('grid error!')
+    bi = BI[grd]
+    jj = slice(bi['j0'], bi['j1'] + 1)
+    ii = slice(bi['i0'], bi['i1'] + 1)
+    if 'ocean_time' in dims:
+        vvtemp = ds.variables[vv][0, ..., jj, ii]
+    else:
+        vvtemp = ds.variables[vv][..., jj, ii]
+    # (..., nsta, 2, 2) corners of every station
+    vvtemp = vvtemp[..., bi['J'], bi['I']]
+    return ( bi['aiy']*((bi['aix']*vvtemp).sum(-1)) ).sum(-1)
+
+def extract_bulk(fn_list, BI, nsta, N, v1_list, v2_list, v3_list_rho, v3_list_w,
+    verbose=False):
+    # Extract the time-dependent fields at all stations from a list of
+    # history files.  Each variable is read once per file and the results
+    # are accumulated in memory.  Returns a dict of masked arrays packed as
+    # (time, station) or (time, z, station).
+    NT = len(fn_list)
+    V = dict()
+    for vv in v1_list:
+        V[vv] = np.ma.masked_all((NT,))
+    for vv in v2_list:
+        V[vv] = np.ma.masked_all((NT, nsta))
+    for vv in v3_list_rho:
+        V[vv] = np.ma.masked_all((NT, N, nsta))
+    for vv in v3_list_w:
+        V[vv] = np.ma.masked_all((NT, N+1, nsta))
+    count = 0
+    for fn in fn_list:
+        tt1 = time()
+        ds = nc.Dataset(fn)
+        if np.mod(count,24)==0:
+            print(' working on %d of %d' % (count, NT))
+            sys.stdout.flush()
+        for vv in v1_list:
+            V[vv][count] = ds.variables[vv][0]
+        for vv in v2_list + v3_list_rho + v3_list_w:
+            V[vv][count] = get_bulk(ds, vv, BI)
+        ds.close()
+        count += 1
+        if verbose:
+            print(' -- this history file took %0.2f seconds' % (time()-tt1))
+    return V
+
+def write_station(out_fn, ista, S, v0_list, v1_list, v2_list, v3_list_rho, v3_list_w,
+    V0, V, V_long_name, V_units):
+    # Write one station file in a single pass, using the results of
+    # get_bulk() (V0, static) and extract_bulk() (V).
+    N = S['N']
+    NT = len(V[v1_list[0]])
+    start_netcdf(out_fn, N, NT, v0_list, v1_list, v2_list,
+        v3_list_rho, v3_list_w, V_long_name, V_units)
+    foo = nc.Dataset(out_fn, 'a')
+    for vv in v0_list:
+        foo[vv][:] = V0[vv][ista]
+    for vv in v1_list:
+        foo[vv][:] = V[vv]
+    for vv in v2_list:
+        foo[vv][:] = V[vv][:, ista]
+    for vv in v3_list_rho + v3_list_w:
+        foo[vv][:] = V[vv][:, :, ista]
+    # create z_rho and z_w (has to be done after we have zeta)
+    zeta = V['zeta'][:, ista]
+    hh = V0['h'][ista] * np.ones_like(zeta)
+    z_rho, z_w = zrfun.get_z(hh, zeta, S)
+    
+    v_var = foo.createVariable('z_rho', float, ('ocean_time','s_rho'))
+    v_var.long_name = 'z on rho points (positive up)'
+    v_var.units = 'm'
+    v_var[:] = z_rho.T
+    
+    v_var = foo.createVariable('z_w', float, ('ocean_time','s_w'))
+    v_var.long_name = 'z on w points (positive up)'
+    v_var.units = 'm'
+    v_var[:] = z_w.T
+    foo.close()
+
+def get_shards(fn_list, shard_days):
+    # Split a list of history files into shards of shard_days whole days,
+    # using the name of the folder (like f2019.07.04) holding each file.
+    day_list = []
+    shard_list = []
+    for fn in fn_list:
+        day = fn.split('/')[-2]
+        if day not in day_list:
+            if np.mod(len(day_list), shard_days) == 0:
+                shard_list.append([])
+            day_list.append(day)
+        shard_list[-1].append(fn)
+    return shard_list
+
+def get_shard_info(fn_list, sta_list, v1_list, v2_list, v3_list_rho, v3_list_w):
+    info = {'fn_list':fn_list, 'sta_list':sta_list,
+        'v_list':v1_list + v2_list + v3_list_rho + v3_list_w}
+    return info
+
+def check_shard(shard_dir, info):
+    # True if shard_dir holds a completed extraction of the same job
+    try:
+        info_old = pickle.load(open(shard_dir + 'info.p', 'rb'))
+        return info_old == info
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return False
+
+def extract_shard(shard_dir, fn_list, BI, sta_list, N, v1_list, v2_list,
+    v3_list_rho, v3_list_w):
+    # Run extract_bulk() on one shard of history files (typically in a
+    # worker process) and save the results as one .npy file per variable,
+    # with masked values saved as nan.  The info file is written last, and
+    # marks the shard as complete so that it is skipped on a rerun.
+    info = get_shard_info(fn_list, sta_list, v1_list, v2_list, v3_list_rho, v3_list_w)
+    if check_shard(shard_dir, info):
+        print(' skipping completed shard ' + shard_dir)
+        return
+    os.makedirs(shard_dir, exist_ok=True)
+    try:
+        os.remove(shard_dir + 'info.p')
+    except OSError:
+        pass
+    V = extract_bulk(fn_list, BI, len(sta_list), N, v1_list, v2_list,
+        v3_list_rho, v3_list_w)
+    for vv in V.keys():
+        np.save(shard_dir + vv + '.npy', V[vv].filled(np.nan))
+    pickle.dump(info, open(shard_dir + 'info.p', 'wb'))
+
+def load_station(shard_dir_list, ista, v1_list, v2_list, v3_list_rho, v3_list_w):
+    # Merge the shards for a single station, returning a dict packed like
+    # the output of extract_bulk() but with a station axis of length 1.
+    V = dict()
+    for vv in v1_list:
+        V[vv] = np.ma.masked_invalid(np.concatenate(
+            [np.load(sd + vv + '.npy') for sd in shard_dir_list]))
+    for vv in v2_list + v3_list_rho + v3_list_w:
+        V[vv] = np.ma.masked_invalid(np.concatenate(
+            [np.load(sd + vv + '.npy', mmap_mode='r')[..., ista:ista+1]
+            for sd in shard_dir_list]))
+    return V
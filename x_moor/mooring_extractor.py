@@ -70,6 +70,13 @@ parser.add_argument('-lat', '--lat_str', nargs='?', type=str, default='')
 #
 # (2) Specify the job name to use in mfun.get_sta_dict(job_name).
 parser.add_argument('-jn', '--job_name', nargs='?', type=str, default='blank')
+#
+# Sharded extraction: split the history files into shards of this many days
+# and extract them in Nproc worker processes.  Completed shards are kept
+# until the station files are written, so a rerun of the same command
+# skips them.  The default (0) extracts everything in this process.
+parser.add_argument('-sd', '--shard_days', nargs='?', type=int, default=0)
+parser.add_argument('-Nproc', nargs='?', type=int, default=4)
 
 args = parser.parse_args()
 verbose = args.verbose
@@ -195,98 +202,61 @@ for vv in v_all_list:
         V_units[vv] = ds.variables[vv].units
     except:
         V_units[vv] = ''
-# start netcdf files
-for sta_name in sta_dict.keys():
-    out_fn = out_fn_dict[sta_name]
-    mfun.start_netcdf(out_fn, N, NT, v0_list, v1_list, v2_list,
-        v3_list_rho, v3_list_w, V_long_name, V_units)
+# stack the interpolants of all stations
+sta_list = list(sta_dict.keys())
+nsta = len(sta_list)
+BI = mfun.get_bulk_its(sta_list, itp_dict)
 # save static variables
-for sta_name in sta_dict.keys():
-    out_fn = out_fn_dict[sta_name]
-    Xi0, Yi0, Xi1, Yi1, Aix, Aiy = itp_dict[sta_name]
-    for vv in v0_list:
-        xi01, yi01, aix, aiy = mfun.get_its(ds, vv, Xi0, Yi0, Xi1, Yi1, Aix, Aiy)
-        vvtemp = ds.variables[vv][yi01, xi01].squeeze()
-        foo = nc.Dataset(out_fn, 'a')
-        foo[vv][:] =   ( aiy*((aix*vvtemp).sum(-1)) ).sum(-1)
-        foo.close()
+V0 = dict()
+for vv in v0_list:
+    V0[vv] = mfun.get_bulk(ds, vv, BI)
 ds.close()
 # END OF INITIALIZATION
 if verbose:
     print(' -- initialization took %0.2f seconds' % (time()-tt0))
 
 # EXTRACT TIME-DEPENDENT FIELDS
-
-# open all output files into a dict
-foo_dict = {}
-for sta_name in sta_dict.keys():
-    out_fn = out_fn_dict[sta_name]
-    foo = nc.Dataset(out_fn, 'a')
-    foo_dict[sta_name] = foo
-
-count = 0
-for fn in fn_list:
-    tt1 = time()
-    ds = nc.Dataset(fn)
-    
-    if np.mod(count,24)==0:
-        print(' working on %d of %d' % (count, NT))
-        sys.stdout.flush()
-    
-    for sta_name in sta_dict.keys():
-        tt2 = time()
-        foo = foo_dict[sta_name]
-        Xi0, Yi0, Xi1, Yi1, Aix, Aiy = itp_dict[sta_name]
-        for vv in v1_list:
-            vtemp = ds.variables[vv][:].squeeze()
-            foo[vv][count] = vtemp
-        for vv in v2_list:
-            xi01, yi01, aix, aiy = mfun.get_its(ds, vv, Xi0, Yi0, Xi1, Yi1, Aix, Aiy)
-            vvtemp = ds.variables[vv][:, yi01, xi01].squeeze()
-            vtemp = ( aiy*((aix*vvtemp).sum(-1)) ).sum(-1)
-            foo[vv][count] = vtemp
-        for vv in v3_list_rho:
-            xi01, yi01, aix, aiy = mfun.get_its(ds, vv, Xi0, Yi0, Xi1, Yi1, Aix, Aiy)
-            vvtemp = ds.variables[vv][:, :, yi01, xi01].squeeze()
-            vtemp = ( aiy*((aix*vvtemp).sum(-1)) ).sum(-1)
-            foo[vv][count,:] = vtemp
-        for vv in v3_list_w:
-            xi01, yi01, aix, aiy = mfun.get_its(ds, vv, Xi0, Yi0, Xi1, Yi1, Aix, Aiy)
-            vvtemp = ds.variables[vv][:, :, yi01, xi01].squeeze()
-            vtemp = ( aiy*((aix*vvtemp).sum(-1)) ).sum(-1)
-            foo[vv][count,:] = vtemp
-        if verbose:
-            print(' ... station took %0.2f seconds' % (time()-tt2))
-    
-    count += 1
-    ds.close()
-
-    if verbose:
-        print(' -- this history file took %0.2f seconds' % (time()-tt1))
-    
+# Each variable is read once per history file for all stations, and
+# the results are held in memory until the end.
+if args.shard_days == 0:
+    V = mfun.extract_bulk(fn_list, BI, nsta, N, v1_list, v2_list,
+        v3_list_rho, v3_list_w, verbose=verbose)
+else:
+    import multiprocessing
+    import shutil
+    if args.job_name != 'blank':
+        shard_root = outdir + 'shards_' + args.job_name + '_' + args.list_type + '/'
+    else:
+        shard_root = outdir + 'shards_' + args.sta_name + '_' + args.list_type + '/'
+    Lfun.make_dir(shard_root)
+    shard_list = mfun.get_shards(fn_list, args.shard_days)
+    shard_dir_list = [(shard_root + 'shard_%04d/' % (ii)) for ii in range(len(shard_list))]
+    arg_list = [(shard_dir_list[ii], shard_list[ii], BI, sta_list, N, v1_list,
+        v2_list, v3_list_rho, v3_list_w) for ii in range(len(shard_list))]
+    print(' extracting %d shards using %d processes' % (len(shard_list), args.Nproc))
+    sys.stdout.flush()
+    with multiprocessing.get_context('fork').Pool(args.Nproc) as pool:
+        pool.starmap(mfun.extract_shard, arg_list)
 # END OF EXTRACTING TIME-DEPENDENT FIELDS
 
-# create z_rho and z_w (has to be done after we have zeta)
-for sta_name in sta_dict.keys():
-    foo = foo_dict[sta_name]
-
-    zeta = foo['zeta'][:].squeeze()
-    hh = foo['h'][:] * np.ones_like(zeta)
-    z_rho, z_w = zrfun.get_z(hh, zeta, S)
-    
-    v_var = foo.createVariable('z_rho', float, ('ocean_time','s_rho'))
-    v_var.long_name = 'z on rho points (positive up)'
-    v_var.units = 'm'
-    v_var[:] = z_rho.T
-    
-    v_var = foo.createVariable('z_w', float, ('ocean_time','s_w'))
-    v_var.long_name = 'z on w points (positive up)'
-    v_var.units = 'm'
-    v_var[:] = z_w.T
-    
-# close all output files
-for sta_name in sta_dict.keys():
-    foo_dict[sta_name].close()
+# write the station files, one at a time
+for ista in range(nsta):
+    sta_name = sta_list[ista]
+    out_fn = out_fn_dict[sta_name]
+    if args.shard_days == 0:
+        mfun.write_station(out_fn, ista, S, v0_list, v1_list, v2_list,
+            v3_list_rho, v3_list_w, V0, V, V_long_name, V_units)
+    else:
+        # merge the shards for this station
+        V = mfun.load_station(shard_dir_list, ista, v1_list, v2_list,
+            v3_list_rho, v3_list_w)
+        V0_sta = dict()
+        for vv in v0_list:
+            V0_sta[vv] = V0[vv][ista:ista+1]
+        mfun.write_station(out_fn, 0, S, v0_list, v1_list, v2_list,
+            v3_list_rho, v3_list_w, V0_sta, V, V_long_name, V_units)
+if args.shard_days > 0:
+    shutil.rmtree(shard_root)
 
 # finale
 import collections
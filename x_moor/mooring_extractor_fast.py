@@ -205,26 +205,14 @@ for vv in v_all_list:
         V_units[vv] = ds.variables[vv].units
     except:
         V_units[vv] = ''
-# start netcdf files
-for sta_name in sta_dict.keys():
-    out_fn = out_fn_dict[sta_name]
-    mfun.start_netcdf(out_fn, N, NT, v0_list, v1_list, v2_list,
-        v3_list_rho, v3_list_w, V_long_name, V_units)
-        
-# open all output files into a dict
-foo_dict = {}
-for sta_name in sta_dict.keys():
-    out_fn = out_fn_dict[sta_name]
-    foo = nc.Dataset(out_fn, 'a')
-    foo_dict[sta_name] = foo
-        
+# stack the station indices
+sta_list = list(sta_dict.keys())
+nsta = len(sta_list)
+BI = mfun.get_bulk_its_ji(sta_list, ji_dict)
 # save static variables
-for sta_name in sta_dict.keys():
-    out_fn = out_fn_dict[sta_name]
-    for vv in v0_list:
-        j0, i0 = ji_dict[sta_name]
-        foo = foo_dict[sta_name]
-        foo[vv][:] = ds[vv][j0, i0]
+V0 = dict()
+for vv in v0_list:
+    V0[vv] = mfun.get_bulk(ds, vv, BI)
 ds.close()
 
 # END OF INITIALIZATION
@@ -232,72 +220,16 @@ if verbose:
     print(' -- initialization took %0.2f seconds' % (time()-tt0))
 
 # EXTRACT TIME-DEPENDENT FIELDS
-
-
-count = 0
-for fn in fn_list:
-    
-    tt1 = time()
-    
-    ds = nc.Dataset(fn, 'r')
-    
-    if np.mod(count,24)==0:
-        print(' working on %d of %d' % (count, NT))
-        sys.stdout.flush()
-
-    for sta_name in sta_dict.keys():
-        j0, i0 = ji_dict[sta_name]
-        tt2 = time()
-        foo = foo_dict[sta_name]
-        for vv in v1_list:
-            val = ds[vv][0].data
-            #val = nco.read_cdf(fn).variables[vv][0]
-            foo[vv][count] = val
-        for vv in v2_list:
-            val = ds[vv][0, j0, i0].data
-            #val = nco.read_cdf(fn).variables[vv][0, j0, i0]
-            foo[vv][count] = val
-        for vv in v3_list_rho + v3_list_w:
-            val = ds[vv][0,:,j0,i0].data
-            #val = nco.read_cdf(fn).variables[vv][0, :, j0, i0]
-            foo[vv][count,:] = val
-        if verbose:
-            print(' ... station took %0.2f seconds' % (time()-tt2))
-    count += 1
-    ds.close()
-    
-    if verbose:
-        print(' -- this history file took %0.2f seconds' % (time()-tt1))
-    
-
+V = mfun.extract_bulk(fn_list, BI, nsta, N, v1_list, v2_list,
+    v3_list_rho, v3_list_w, verbose=verbose)
 # END OF EXTRACTING TIME-DEPENDENT FIELDS
 
-# create z_rho and z_w (has to be done after we have zeta)
-for sta_name in sta_dict.keys():
+# write the station files, one at a time
+for ista in range(nsta):
+    sta_name = sta_list[ista]
     out_fn = out_fn_dict[sta_name]
-    
-    foo = foo_dict[sta_name]
-    
-    #foo = nc.Dataset(out_fn, 'a')
-
-    zeta = foo['zeta'][:].squeeze()
-    hh = foo['h'][:] * np.ones_like(zeta)
-    z_rho, z_w = zrfun.get_z(hh, zeta, S)
-    
-    v_var = foo.createVariable('z_rho', float, ('ocean_time','s_rho'))
-    v_var.long_name = 'z on rho points (positive up)'
-    v_var.units = 'm'
-    v_var[:] = z_rho.T
-    
-    v_var = foo.createVariable('z_w', float, ('ocean_time','s_w'))
-    v_var.long_name = 'z on w points (positive up)'
-    v_var.units = 'm'
-    v_var[:] = z_w.T
-    
-    #foo.close()
-# close all output files
-for sta_name in sta_dict.keys():
-    foo_dict[sta_name].close()
+    mfun.write_station(out_fn, ista, S, v0_list, v1_list, v2_list,
+        v3_list_rho, v3_list_w, V0, V, V_long_name, V_units)
 
 # finale
 import collections
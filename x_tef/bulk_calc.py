@@ -3,6 +3,12 @@
 Code to calculate a TEF time series using Marvin Lorenz' new multi-layer code.
 
 Based on his code, and modified by PM.
+
+Use "-append True" to only calculate the days that are not already in the
+bulk file, as after process_sections.py -append True.  The tidal averaging
+only reaches back "pad" hours, so the new days need just the processed hours
+after the last old day, and give the same result as calculating everything
+again.
 """
 
 import os
@@ -18,44 +24,89 @@ import numpy as np
 import pickle
 import matplotlib.pyplot as plt
 
+import tef_fun
 import tef_fun_lorenz as tfl
 from importlib import reload
+reload(tef_fun)
 reload(tfl)
 
+def boolean_string(s):
+    if s not in ['False', 'True']:
+        raise ValueError('Not a valid boolean string')
+    return s == 'True' # note use of ==
+
+# get command line arguments
+import argparse
+parser = argparse.ArgumentParser()
+# the tef extraction to process, like cas6_v3_lo8b_2017.01.01_2017.12.31,
+# chosen from a list if not given
+parser.add_argument('-item', nargs='?', type=str, default='')
+# sections to process, like sog5,jdf1 or all
+parser.add_argument('-sn', '--sect_names', nargs='?', type=str, default='all')
+# number of processes, which each work on a block of days
+parser.add_argument('-Nproc', nargs='?', type=int, default=4)
+# only calculate new days
+parser.add_argument('-append', default=False, type=boolean_string)
+args = parser.parse_args()
+
 # choose input and organize output
 Ldir = Lfun.Lstart()
 indir0 = Ldir['LOo'] + 'tef/'
 # choose the tef extraction to process
-item = Lfun.choose_item(indir0)
+if len(args.item) > 0:
+    item = args.item
+else:
+    item = Lfun.choose_item(indir0)
 indir0 = indir0 + item + '/'
 indir = indir0 + 'processed/'
-sect_list_raw = os.listdir(indir)
-sect_list_raw.sort()
-sect_list = [item for item in sect_list_raw if ('.p' in item)]
+sect_list = tef_fun.list_tef(indir)
 print(20*'=' + ' Processed Sections ' + 20*'=')
 print(*sect_list, sep=", ")
 print(61*'=')
 # select which sections to process
-my_choice = input('-- Input section to process (e.g. sog5, or Return to process all): ')
-if len(my_choice)==0:
+if args.sect_names == 'all':
     # full list
     pass
-else: # single item
-    if (my_choice + '.p') in sect_list:
-        sect_list = [my_choice + '.p']
-    else:
-        print('That section is not available')
-        sys.exit()
+else:
+    my_sect_list = args.sect_names.split(',')
+    for sn in my_sect_list:
+        if sn not in sect_list:
+            print('Section %s is not available' % (sn))
+            sys.exit()
+    sect_list = my_sect_list
 outdir = indir0 + 'bulk/'
 Lfun.make_dir(outdir)
 
-testing = False
-for snp in sect_list:
-    print('Working on ' + snp)
-    out_fn = outdir + snp
+# maximum number of layers in the multi-layer output
+nlay = 30
 
+testing = False
+if not testing:
+    import multiprocessing
+    pool = multiprocessing.get_context('fork').Pool(args.Nproc)
+for sn in sect_list:
+    print('Working on ' + sn)
+    out_fn = outdir + sn + '.nc'
+
+    # padding (hours) of the low-pass filter used below
+    pad = 36
+    
+    # find how many days are already done, and the first processed hour
+    # that is needed for the new days
+    nd0 = 0
+    ot0 = None
+    if args.append and os.path.isfile(out_fn):
+        bulk_old = tef_fun.load_tef(outdir, sn)
+        ot_ex = tef_fun.load_tef(indir, sn, vn_list=['ot'])['ot']
+        nd_old = len(bulk_old['ot'])
+        if np.all(bulk_old['ot'] == ot_ex[pad:pad+24*nd_old:24]):
+            nd0 = nd_old
+            ot0 = ot_ex[24*nd0]
+        else:
+            print(' - bulk file does not line up with the processed file: redo all')
+    
     # load the data file
-    tef_ex=pickle.load(open(indir + snp, 'rb'))
+    tef_ex = tef_fun.load_tef(indir, sn, ot0=ot0)
     # Notes on the data:
     # data.keys() => dict_keys(['tef_q', 'tef_qs', 'sbins', 'ot', 'qnet', 'fnet', 'ssh'])
     # data['tef_q'].shape => (8761, 1000), so packed [hour, salinity bin]
@@ -69,6 +120,9 @@ for snp in sect_list:
     qabs = np.abs(qnet)
     fnet = tef_ex['fnet']
     ssh = tef_ex['ssh']
+    if len(ot) < 2*pad + 2:
+        print(' - no new days')
+        continue
 
     # low-pass
     if True:
@@ -79,7 +133,6 @@ for snp in sect_list:
         qabs_lp = zfun.filt_godin(qabs)
         fnet_lp = zfun.filt_godin(fnet)
         ssh_lp = zfun.filt_godin(ssh)
-        pad = 36
     else:
         # nday Hanning window
         nday = 120
@@ -115,37 +168,21 @@ for snp in sect_list:
     Qv[:,:-1] = np.fliplr(np.cumsum(np.fliplr(tef_q_lp), axis=1))
     Qs[:,:-1] = np.fliplr(np.cumsum(np.fliplr(tef_qs_lp), axis=1))
 
-    #get bulk values
-    Qins=[]
-    Qouts=[]
-    sins=[]
-    souts=[]
-
-    # prepare arrays to hold multi-layer output
-    nlay = 30
-    QQ = np.nan * np.ones((NT, nlay))
-    SS = np.nan * np.ones((NT, nlay))
-
     if testing:
         plt.close('all')
         dd_list = [154, 260]
         print_info = True
-    else:
-        dd_list = range(NT)
-        print_info = False
-
-    for dd in dd_list:
+    
+        for dd in dd_list:
             
-        qv = Qv[dd,:]
-        qs = Qs[dd,:]
+            qv = Qv[dd,:]
+            qs = Qs[dd,:]
     
-        if print_info == True:
             print('\n**** dd = %d ***' % (dd))
         
-        Q_in_m, Q_out_m, s_in_m, s_out_m, div_sal, ind, minmax = tfl.calc_bulk_values(sedges,
-            qv, qs, print_info=print_info)
+            Q_in_m, Q_out_m, s_in_m, s_out_m, div_sal, ind, minmax = tfl.calc_bulk_values(sedges,
+                qv, qs, print_info=print_info)
         
-        if print_info == True:
             print(' ind = %s' % (str(ind)))
             print(' minmax = %s' % (str(minmax)))
             print(' div_sal = %s' % (str(div_sal)))
@@ -173,19 +210,15 @@ for snp in sect_list:
             ax.plot(tef_q_lp[dd,:], sbins)
             ax.grid(True)
             ax.set_title('-dQ/ds')
-        
-        # save multi-layer output
-        qq = np.concatenate((Q_in_m, Q_out_m))
-        ss = np.concatenate((s_in_m, s_out_m))
-        ii = np.argsort(ss)
-        if len(ii)>0:
-            ss = ss[ii]
-            qq = qq[ii]
-            NL = len(qq)
-            QQ[dd, :NL] = qq
-            SS[dd, :NL] = ss
-
-        dd+=1
+    else:
+        # get bulk values, with blocks of days done in parallel, and
+        # the multi-layer output packed as [day, layer]
+        nblock = int(np.ceil(NT/args.Nproc))
+        arg_list = [(sedges, Qv[i0:i0+nblock,:], Qs[i0:i0+nblock,:], nlay)
+            for i0 in range(0, NT, nblock)]
+        res_list = pool.starmap(tfl.calc_bulk_series, arg_list)
+        QQ = np.concatenate([res[0] for res in res_list], axis=0)
+        SS = np.concatenate([res[1] for res in res_list], axis=0)
     
     if testing == False:
         # save results
@@ -197,9 +230,17 @@ for snp in sect_list:
         bulk['qabs_lp'] = qabs_lp
         bulk['fnet_lp'] = fnet_lp
         bulk['ssh_lp'] = ssh_lp
-        pickle.dump(bulk, open(out_fn, 'wb'))
+        if nd0 > 0:
+            # add the new days to the old ones
+            for vn in bulk.keys():
+                bulk[vn] = np.concatenate((bulk_old[vn], bulk[vn]), axis=0)
+        tef_fun.save_tef(out_fn, bulk)
+        try: # get rid of an old pickled version, if it exists
+            os.remove(out_fn.replace('.nc','.p'))
+        except OSError:
+            pass
     else:
         plt.show()
-
-
-
+        
+if not testing:
+    pool.close()
@@ -51,7 +51,7 @@ for sn in sect_list:
     incolor = color_list[ii][0]
     outcolor = color_list[ii][1]
     
-    bulk = pickle.load(open(indir + sn + '.p', 'rb'))
+    bulk = tef_fun.load_tef(indir, sn)
     QQ = bulk['QQ']
     SS = bulk['SS']
     ot = bulk['ot']
@@ -37,9 +37,7 @@ year = int(year_str)
 
 indir0 = indir0 + item + '/'
 indir = indir0 + 'bulk/'
-sect_list_raw = os.listdir(indir)
-sect_list_raw.sort()
-sect_list = [item for item in sect_list_raw if ('.p' in item)]
+sect_list = tef_fun.list_tef(indir)
 print(20*'=' + ' Processed Sections ' + 20*'=')
 print(*sect_list, sep=", ")
 print(61*'=')
@@ -49,8 +47,8 @@ if len(my_choice)==0:
     # full list
     save_fig = True
 else: # single item
-    if (my_choice + '.p') in sect_list:
-        sect_list = [my_choice + '.p']
+    if my_choice in sect_list:
+        sect_list = [my_choice]
         save_fig = False
     else:
         print('That section is not available')
@@ -60,13 +58,11 @@ Lfun.make_dir(outdir)
             
 #plt.close('all')
 
-sect_list = [item for item in sect_list if item.replace('.p','') in sect_df.index]
+sect_list = [item for item in sect_list if item in sect_df.index]
 
-for snp in sect_list:
+for sn in sect_list:
     
-    sn = snp.replace('.p','')
-
-    bulk = pickle.load(open(indir + snp, 'rb'))
+    bulk = tef_fun.load_tef(indir, sn)
     QQ = bulk['QQ']
     SS = bulk['SS']
     ot = bulk['ot']
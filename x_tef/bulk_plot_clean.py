@@ -58,7 +58,6 @@ plt.close('all')
 
 for sect_name in sect_list:
     
-    fn = indir + 'bulk/' + sect_name + '.p'
     
     if do_Eulerian:
         # also get the raw extraction to calculate the Eulerian version
@@ -122,7 +121,7 @@ for sect_name in sect_list:
     # from warnings import filterwarnings
     # filterwarnings('ignore') # skip some warning messages
 
-    bulk = pickle.load(open(fn, 'rb'))
+    bulk = tef_fun.load_tef(indir + 'bulk/', sect_name)
 
     QQ = bulk['QQ']
     SS = bulk['SS']
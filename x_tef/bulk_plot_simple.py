@@ -40,10 +40,9 @@ plt.close('all')
 for sn in ['hc1', 'ai1', 'mb3', 'jdf2', 'sji1', 'ss1', 'wb1']:
     qnet_sign = -1
 
-    snp = sn + '.p'
     outname = outdir + sn + '_' + year_str + '.png'
 
-    bulk = pickle.load(open(indir + snp, 'rb'))
+    bulk = tef_fun.load_tef(indir, sn)
     QQ = bulk['QQ']
     SS = bulk['SS']
     ot = bulk['ot']
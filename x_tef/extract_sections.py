@@ -5,6 +5,11 @@ of transport and transport-weighted properties.
 All input parameters specified at the command line, so this can be run in the background
 because it can take a few hours.  Use "-sn all" to get all sections.
 
+Use "-append True" to extend an existing extraction, e.g. as part of the daily
+forecast post-processing.  The existing extraction with the same gtagex and
+start day (and an earlier end day) is renamed for the new end day, and only
+the history files after the last ocean_time in each section file are extracted.
+
 """
 
 # setup
@@ -24,6 +29,11 @@ import tef_fun
 from importlib import reload
 reload(tef_fun)
 
+def boolean_string(s):
+    if s not in ['False', 'True']:
+        raise ValueError('Not a valid boolean string')
+    return s == 'True' # note use of ==
+
 # get command line arguments
 import argparse
 parser = argparse.ArgumentParser()
@@ -38,6 +48,8 @@ parser.add_argument('-sn', '--sect_name', nargs='?', type=str, default='ai1')
 # e.g. -rundir /pmr2/darr/LiveOcean_roms/ for cascadia1_base_lobio5
 parser.add_argument('-rundir', '--run_directory', nargs='?', type=str, default='')
 # section specific arguments
+# add new times to the existing extraction
+parser.add_argument('-append', default=False, type=boolean_string)
 args = parser.parse_args()
 
 # Get Ldir
@@ -63,6 +75,16 @@ Lfun.make_dir(outdir000)
 outdir00 = outdir000 + 'tef/'
 Lfun.make_dir(outdir00)
 outdir0 = (outdir00 + Ldir['gtagex'] + '_' + ds0 + '_' + ds1 + '/')
+if args.append:
+    # find the latest existing extraction with the same start day, and give
+    # it the name for the new end day
+    ex0 = Ldir['gtagex'] + '_' + ds0 + '_'
+    ex_list = [item for item in os.listdir(outdir00) if (item.startswith(ex0)
+        and (item.replace(ex0,'') <= ds1))]
+    ex_list.sort()
+    if (len(ex_list) > 0) and (outdir00 + ex_list[-1] + '/' != outdir0):
+        print('Appending to ' + ex_list[-1])
+        os.rename(outdir00 + ex_list[-1], outdir0)
 Lfun.make_dir(outdir0)
 outdir = outdir0 + 'extractions/'
 Lfun.make_dir(outdir)
@@ -93,6 +115,7 @@ S = zrfun.get_basic_info(fn, only_S=True)
 NZ = S['N']
 
 print('\nGetting section definitions and indices')
+nt0_dict = dict() # number of times already extracted for each section
 for sect_name in sect_list:
     print(sect_name)
     # name output file
@@ -104,28 +127,66 @@ for sect_name in sect_list:
     NX = len(Mask) # this the length of the section, not specific to x or y
     # save some things for later use
     sect_info[sect_name] = (ii0, ii1, jj0, jj1, sdir, landward, NT, NX, NZ, out_fn)
-    # initialize a netcdf file for this section, and get list of variables to gather
-    vn_list = tef_fun.start_netcdf(fn, out_fn, NT, NX, NZ, Lon, Lat, Ldir)
-    # note that this function deletes the existing out_fn, and also creates the list
-    # of variables to extract.
-
-# extract and save time-dependent fields
-count = 0
+    sinfo_old = None
+    if args.append:
+        sinfo_old = tef_fun.check_sect(out_fn)
+    if sinfo_old == None:
+        # initialize a netcdf file for this section, and get list of variables to gather
+        vn_list = tef_fun.start_netcdf(fn, out_fn, NT, NX, NZ, Lon, Lat, Ldir)
+        # note that this function deletes the existing out_fn, and also creates the list
+        # of variables to extract.
+        nt0_dict[sect_name] = 0
+    else:
+        NT0, ot_last, vn_list = sinfo_old
+        # make sure the times in the file line up with fn_list
+        if NT0 > NT:
+            print('Section %s already has %d times, more than %d' % (sect_name, NT0, NT))
+            sys.exit()
+        elif NT0 > 0:
+            ds = nc.Dataset(fn_list[NT0-1])
+            ot_check = float(ds['ocean_time'][0])
+            ds.close()
+            if ot_check != ot_last:
+                print('Section %s does not line up with the history files' % (sect_name))
+                sys.exit()
+        nt0_dict[sect_name] = NT0
+        print(' - appending after %d times' % (NT0))
+
+# open all the output files for the whole extraction, and write
+# their static fields
+nbuf = 24 # number of hours to hold in memory before writing
+B_dict = dict()
+ds = nc.Dataset(fn)
+for sect_name in sect_list:
+    B_dict[sect_name] = tef_fun.start_sect(ds, G, S, sect_info[sect_name],
+        vn_list, nbuf=nbuf)
+    B_dict[sect_name]['foo'].date_string1 = ds1
+ds.close()
+# the box bounding all sections, which we read from each history file
+box = tef_fun.get_box(sect_info)
+
+# extract and save time-dependent fields, starting with the first
+# time that any section needs
+count = min(nt0_dict.values())
 print('\nStarting extraction of fields')
 print(vn_list)
-for fn in fn_list:
+for fn in fn_list[count:]:
     if np.mod(count,24)==0:
         print('  working on %d of %d' % (count, NT))
         sys.stdout.flush()
+    # read the fields for all sections at once
     ds = nc.Dataset(fn)
+    F = tef_fun.read_box(ds, box, vn_list)
+    ds.close()
     # loop over all sections
     for sect_name in sect_list:
-        sinfo = sect_info[sect_name]
         # this is where we add the data from this history file
-        # to all of the sections, each defined by sinfo
-        tef_fun.add_fields(ds, count, vn_list, G, S, sinfo)
-    ds.close()
+        # to all of the sections, each defined by sect_info
+        if count >= nt0_dict[sect_name]:
+            tef_fun.add_fields(F, count, S, B_dict[sect_name])
     count += 1
+for sect_name in sect_list:
+    tef_fun.close_sect(B_dict[sect_name])
 
 # finale
 import collections
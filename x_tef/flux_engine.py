@@ -11,6 +11,7 @@ import numpy as np
 import pickle
 import pandas as pd
 import argparse
+import os; import sys
 
 def boolean_string(s):
     if s not in ['False', 'True']:
@@ -20,11 +21,18 @@ def boolean_string(s):
 # optional command line arguments, can be input in any order
 parser = argparse.ArgumentParser()
 
-# this one is essential
+# this one is essential, and may be a comma-separated list of sources
+# (like S_Ocean,S_AllRiver) which are then integrated together
 parser.add_argument('-src', '--source', nargs='?', type=str, default='')
 
 # these are optional
 parser.add_argument('-sink', '--sinking', default=False, type=boolean_string)
+# time stepping: euler (the original explicit scheme), implicit (backward
+# Euler, stable for long time steps like -dt 86400), expm (exact solution
+# at the save times) or steady (solve directly for the final state, for
+# sources without "IC_")
+parser.add_argument('-method', nargs='?', type=str, default='euler')
+parser.add_argument('-dt', nargs='?', type=int, default=3600) # time step (seconds)
 
 # typically don't need to change these because I am analyzing one LO instance
 parser.add_argument('-g', '--gridname', nargs='?', type=str, default='cas6')
@@ -36,11 +44,15 @@ if len(args.source) == 0:
     print('** Need to specify a source at the command line **')
     sys.exit()
 
-source = args.source
+source_list = args.source.split(',')
 sinking = args.sinking
+method = args.method
+
+if (method == 'steady') and any(['IC_' in source for source in source_list]):
+    print('** There is no steady state for IC_ sources **')
+    sys.exit()
 
 # get Ldir and associated LO modules
-import os; import sys
 sys.path.append(os.path.abspath('../alpha'))
 import Lfun
 Ldir = Lfun.Lstart(gridname=args.gridname, tag=args.tag)
@@ -59,7 +71,7 @@ if testing:
 else:
     year_list = [2017, 2018, 2019]
 
-print('Running integration with source = ' + source)
+print('Running integration with source = ' + args.source)
 # Valid choices for source:
 #
 # Dye from the ocean meant to reproduce the actual mean salinity
@@ -77,7 +89,7 @@ print('Running integration with source = ' + source)
 #
 # - MORE: see flux_fun.ic_seg2_dict
 
-if source == 'S_OceanSalt':
+if source_list == ['S_OceanSalt']:
     # this one is meant only for validation, and the validation is only
     # meaningful when we are averaging over a time when the mean state of
     # the system is approximately cyclic, not steadily increasing or
@@ -115,130 +127,104 @@ for year in year_list:
     # loop over all seasons
     for season in season_list:
             
-        # form the core of the output name
-        if sinking == True:
-            source_str = source + 'Sink'
-        else:
-            source_str = source
-        outname_main = source_str + '_' + str(year) + '_' + season
-        print('=== ' + outname_main + ' ===')
-        
         # load DateFrames of transport and volume
         q_df = pd.read_pickle(indir + 'q_df_' + season + '.p')
         v_df = pd.read_pickle(voldir + 'volumes.p')
         V = flux_fun.get_V(v_df)
-    
-        # "f" is a DataFrame organized like q_df but whose entries
-        # are the forced values of the tracer
-        f = pd.DataFrame(0, index=q_df.index, columns=q_df.columns)
-        # initialized here with zeros everywhere?
-
-        # set forcing values of ocean or river boundary conditions
-        for seg_name in f.index:
-            if source == 'S_OceanSalt':
-                if 'J1' in seg_name:
-                    f.loc[seg_name,'ocean_s'] = os_jdf
-                elif 'G6' in seg_name:
-                    f.loc[seg_name,'ocean_s'] = os_sog
-            elif source == 'S_Ocean':
-                if 'J1' in seg_name:
-                    f.loc[seg_name,'ocean_s'] = 1
-                elif 'G6' in seg_name:
-                    f.loc[seg_name,'ocean_s'] = 1 #os_sog/os_jdf
-            elif source == 'S_FraserRiver':
-                if 'G3' in seg_name:
-                    f.loc[seg_name,'river_f'] = 1
-            elif source == 'S_DeschutesRiver':
-                if 'S4' in seg_name:
-                    f.loc[seg_name,'river_f'] = 1
-            elif source == 'S_SkagitRiver':
-                if 'W4_f' in seg_name:
-                    f.loc[seg_name,'river_f'] = 1
-            elif source == 'S_AllRiver':
-                if '_f' in seg_name:
-                    f.loc[seg_name,'river_f'] = 1
-
-        # we will do the integration just with numpy arrays
+        
+        # we will do the integration just with numpy arrays and sparse
+        # operators, made once for all sources
         NR = len(q_df.index) # equal to the number of bins (2 x number of segments)
         NC = len(q_df.columns) # same as NR but plus 4 for ocean and river open boundaries
-        vv = V.values
-        ivv = 1/vv
-
-        c = np.zeros(NR) # the final concentration in all bins
-        ca = np.zeros(NR) # the final concentration in all bins for an "aging" tracer
         q = q_df.values # transports (m3/s) ROW=to, COLUMNS=from
-        ff = np.zeros((NR,NC)) # how is ff different from f (ff=array, f=DataFrame)?
-        ffa = np.zeros((NR,NC))
+        dt = args.dt # time step (seconds)
+        dz = .5e-4 * dt/3600 #1e-4 # a parameter to control sinking rate
+        O = flux_fun.get_flux_ops(q, V.values, sinking=sinking, dz=dz, dt=dt)
+        
+        nsrc = len(source_list)
+        c0 = np.zeros((NR, nsrc)) # the initial concentration in all bins
+        fb = np.zeros((NR, 4, nsrc)) # the concentration of the open boundary inflows
+        for isrc in range(nsrc):
+            source = source_list[isrc]
+            
+            # "f" is a DataFrame organized like q_df but whose entries
+            # are the forced values of the tracer
+            f = pd.DataFrame(0, index=q_df.index, columns=q_df.columns)
+            # initialized here with zeros everywhere?
 
-        if 'Ocean' in source:
-            ff[:,0] = f.loc[:,'ocean_s'].values # column 0 is the ocean inflow
-        elif 'River' in source:
-            ff[:,3] = f.loc[:,'river_f'].values # column 3 is the river inflow
-    
-        if 'IC_' in source:
-            seg2_list = flux_fun.ic_seg2_dict[source]
+            # set forcing values of ocean or river boundary conditions
             for seg_name in f.index:
-                if seg_name in seg2_list:
-                    jj = int(np.argwhere(f.index==seg_name))
-                    ff[jj,jj+4] = 1
-                    c[jj] = 1
+                if source == 'S_OceanSalt':
+                    if 'J1' in seg_name:
+                        f.loc[seg_name,'ocean_s'] = os_jdf
+                    elif 'G6' in seg_name:
+                        f.loc[seg_name,'ocean_s'] = os_sog
+                elif source == 'S_Ocean':
+                    if 'J1' in seg_name:
+                        f.loc[seg_name,'ocean_s'] = 1
+                    elif 'G6' in seg_name:
+                        f.loc[seg_name,'ocean_s'] = 1 #os_sog/os_jdf
+                elif source == 'S_FraserRiver':
+                    if 'G3' in seg_name:
+                        f.loc[seg_name,'river_f'] = 1
+                elif source == 'S_DeschutesRiver':
+                    if 'S4' in seg_name:
+                        f.loc[seg_name,'river_f'] = 1
+                elif source == 'S_SkagitRiver':
+                    if 'W4_f' in seg_name:
+                        f.loc[seg_name,'river_f'] = 1
+                elif source == 'S_AllRiver':
+                    if '_f' in seg_name:
+                        f.loc[seg_name,'river_f'] = 1
+                        
+            if 'Ocean' in source:
+                fb[:,0,isrc] = f.loc[:,'ocean_s'].values # column 0 is the ocean inflow
+            elif 'River' in source:
+                fb[:,3,isrc] = f.loc[:,'river_f'].values # column 3 is the river inflow
+    
+            if 'IC_' in source:
+                seg2_list = flux_fun.ic_seg2_dict[source]
+                for seg_name in f.index:
+                    if seg_name in seg2_list:
+                        jj = int(np.argwhere(f.index==seg_name))
+                        c0[jj,isrc] = 1
+                        
+        rb = flux_fun.get_flux_forcing(O, fb)
 
-        dt = 3600 #3e3 # time step (seconds)
         nyears = 6
         NT = int(nyears*365*86400/dt) # number of time steps
         savedays = 2#10 # number of days between saves
-        Nsave = int(savedays*86400/dt)
+        Nsave = max(1, int(savedays*86400/dt))
         # Nsave = number of time steps between saves in order to save every "savedays"
 
-        # arrays to STORE time-varying information
-        c_arr = np.nan + np.ones((int(NT/Nsave)+1, NR))
-        t_arr = np.nan + np.ones(int(NT/Nsave)+1)
-    
-        dz = .5e-4 #1e-4 # a parameter to control sinking rate
+        if method == 'steady':
+            c, ca = flux_fun.flux_steady(O, rb)
+        else:
+            c_arr, t_arr, c, ca = flux_fun.flux_integrate(O, rb, c0, dt, NT, Nsave,
+                method=method)
 
-        for ii in range(NT):
-    
-            # save the bin concentration to an array (and save time) every "savedays" days
-            if np.mod(ii,Nsave)==0 :
-                c_arr[int(ii/Nsave), :] = c.copy()
-                t_arr[int(ii/Nsave)] = dt * ii
+        # create and fill the output DataFrames
+        for isrc in range(nsrc):
+            source = source_list[isrc]
             
-            # General scheme: q is the fluxes and ff is the concentration at this
-            # time step.
-            qff = (q*ff).sum(axis=1)
-            # So this sum of transport (q) times concentration (ff) across all the columns
-            # gives the transport rate into a given bin
-        
-            c = c + dt*ivv*qff
-            # Here we advance the concentration using dc/dt = net inflow / volume
-        
+            # form the core of the output name
             if sinking == True:
-                NC2 = int(len(c)/2)
-                for jj in range(NC2):
-                    c_f = c[2*jj + 1]
-                    c[2*jj + 1] -= c_f*dz
-                    c[2*jj] += c_f*dz
-            ff[:,4:] = np.tile(c,(NR,1))
-                    
-            # similar calculations to the above but with a tracer that increases
-            # over time at a rate that appears to be 100% per year
-            qffa = (q*ffa).sum(axis=1)
-            ca = ca + dt*ivv*qffa + dt*c/(365*86400)
-            ffa[:,4:] = np.tile(ca,(NR,1))
-        
-
-        # create and fill the output DataFrames
+                source_str = source + 'Sink'
+            else:
+                source_str = source
+            outname_main = source_str + '_' + str(year) + '_' + season
+            print('=== ' + outname_main + ' ===')
         
-        if 'IC_' not in source:
-            # this one is just the final state (useful for age)
-            cc = pd.DataFrame(index=q_df.index,columns=['c', 'ca'])
-            cc['c'] = c
-            cc['ca'] = ca
-            cc.to_pickle(outdir + outname_main + '_AGE.p')
-
-        # and another one for the time-dependent fields in an array aa
-        aa = pd.DataFrame(c_arr, index=t_arr/86400, columns=q_df.index)
-        # note that the index is time (days) and the columns are the bin names
-        aa.to_pickle(outdir + outname_main + '.p')
+            if 'IC_' not in source:
+                # this one is just the final state (useful for age)
+                cc = pd.DataFrame(index=q_df.index,columns=['c', 'ca'])
+                cc['c'] = c[:,isrc]
+                cc['ca'] = ca[:,isrc]
+                cc.to_pickle(outdir + outname_main + '_AGE.p')
+
+            if method != 'steady':
+                # and another one for the time-dependent fields in an array aa
+                aa = pd.DataFrame(c_arr[:,:,isrc], index=t_arr/86400, columns=q_df.index)
+                # note that the index is time (days) and the columns are the bin names
+                aa.to_pickle(outdir + outname_main + '.p')
     
-    
\ No newline at end of file
@@ -2,9 +2,13 @@
 Varibles and functions used by the "flux" code.
 """
 import numpy as np
+import sys
 from datetime import datetime, timedelta
 import zfun # path provided by calling code
 import pandas as pd
+import scipy.sparse as sps
+from scipy.sparse.linalg import splu, expm_multiply
+from scipy import ndimage
 import Lfun
 import pickle
 
@@ -14,7 +18,9 @@ filterwarnings('ignore') # skip some warning messages
 
 def get_fluxes(indir, sect_name, in_sign=1):
     # form time series of net 2-layer transports into (+) and out of (-) the volume
-    bulk = pickle.load(open(indir + 'bulk/' + sect_name + '.p', 'rb'))
+    import tef_fun
+    bulk = tef_fun.load_tef(indir + 'bulk/', sect_name,
+        vn_list=['QQ', 'SS', 'ot', 'fnet_lp', 'qabs_lp'])
     QQ = bulk['QQ']
     SS = bulk['SS']
     ot = bulk['ot']
@@ -139,6 +145,122 @@ def get_V(v_df):
         V[seg_name+'_f'] = 0.2 * v_df.loc[seg_name,'volume m3']
     return V
 
+# The flux engine: the segment box model as sparse linear operators.
+#
+# Concentration c in the NR bins obeys dc/dt = A c + rb where A comes from
+# the bin-to-bin transports and sinking, and rb from the open boundaries.
+# The "aging" tracer ca obeys dca/dt = A0 ca + c/Tage, with A0 = A without
+# sinking, so that ca/c is the mean age in years.  Tracers for several
+# sources can be run at once as the columns of c, ca, and rb.
+
+Tage = 365*86400 # aging rate of the aging tracer (seconds)
+
+def get_flux_ops(q, vv, sinking=False, dz=.5e-4, dt=3600):
+    """
+    Returns a dict of the sparse operators of the box model.
+    
+    q = transports (m3/s) ROW=to, COLUMNS=from, packed (NR, NR+4) where
+        the first 4 columns are the ocean and river open boundaries
+    vv = volume of each bin (m3)
+    dz = fraction of the concentration of each upper (_f) bin moved to the
+        lower (_s) bin below it every time step dt (seconds) if sinking
+    """
+    NR = len(vv)
+    ivv = 1/vv
+    D = sps.diags(ivv)
+    A0 = (D @ sps.csr_matrix(q[:,4:])).tocsr()
+    # sinking, as the operator applied after each step of the explicit
+    # scheme, and as a rate for the other schemes
+    P = sps.identity(NR, format='lil')
+    if sinking == True:
+        for jj in range(int(NR/2)):
+            P[2*jj + 1, 2*jj + 1] -= dz
+            P[2*jj, 2*jj + 1] += dz
+    P = P.tocsr()
+    A = (A0 + (P - sps.identity(NR))/dt).tocsr()
+    O = {'NR':NR, 'ivv':ivv, 'qb':q[:,:4], 'A0':A0, 'A':A, 'P':P}
+    return O
+    
+def get_flux_forcing(O, fb):
+    # rb (NR, nsrc) from the concentrations fb (NR, 4, nsrc) of the inflows
+    # at the open boundaries
+    return O['ivv'].reshape((-1,1)) * (O['qb'][:,:,np.newaxis] * fb).sum(axis=1)
+    
+def flux_integrate(O, rb, c0, dt, NT, Nsave, method='euler'):
+    """
+    Integrates the box model for NT time steps of dt seconds, for the forcing
+    rb and initial condition c0 (both NR, nsrc), saving c every Nsave steps.
+    
+    method:
+    'euler' = explicit Euler, as in the original flux_engine, which needs a
+        small time step (dt = 3600) to be stable
+    'implicit' = backward Euler, using sparse LU factors found once, which
+        is stable for any time step (e.g. dt = 86400)
+    'expm' = the exact solution at the save times using the action of the
+        matrix exponential, so dt only sets the save times
+    
+    Returns c_arr (nsave, NR, nsrc), t_arr (nsave) in seconds, and the
+    final c and ca (NR, nsrc).
+    """
+    NR, nsrc = c0.shape
+    nsave = int(NT/Nsave) + 1
+    c_arr = np.nan + np.ones((nsave, NR, nsrc))
+    t_arr = np.nan + np.ones(nsave)
+    c = c0.copy()
+    ca = np.zeros((NR, nsrc))
+    if method == 'euler':
+        A0 = O['A0']; P = O['P']
+        for ii in range(NT):
+            if np.mod(ii,Nsave)==0 :
+                c_arr[int(ii/Nsave), :, :] = c
+                t_arr[int(ii/Nsave)] = dt * ii
+            c = P @ (c + dt*(A0 @ c + rb))
+            ca = ca + dt*(A0 @ ca) + dt*c/Tage
+    elif method == 'implicit':
+        I = sps.identity(NR, format='csc')
+        lu = splu((I - dt*O['A']).tocsc())
+        lua = splu((I - dt*O['A0']).tocsc())
+        for ii in range(NT):
+            if np.mod(ii,Nsave)==0 :
+                c_arr[int(ii/Nsave), :, :] = c
+                t_arr[int(ii/Nsave)] = dt * ii
+            c = lu.solve(c + dt*rb)
+            ca = lua.solve(ca + dt*c/Tage)
+    elif method == 'expm':
+        # augmented system for y = [c; ca; 1 for each source], so that
+        # the forcing is part of the operator
+        Z = sps.csr_matrix((NR, NR))
+        M = sps.bmat([[O['A'], Z, sps.csr_matrix(rb)],
+            [sps.identity(NR)/Tage, O['A0'], None],
+            [None, None, sps.csr_matrix((nsrc, nsrc))]], format='csr')
+        y0 = np.concatenate((c0, np.zeros((NR, nsrc)), np.eye(nsrc)), axis=0)
+        nt = int(np.ceil(NT/Nsave)) # number of saves
+        t_arr[:nt] = dt * Nsave * np.arange(nt)
+        y = expm_multiply(M, y0, start=0, stop=t_arr[nt-1], num=nt, endpoint=True)
+        if nt == 1:
+            y = y.reshape((1,) + y0.shape)
+        c_arr[:nt, :, :] = y[:, :NR, :]
+        yend = expm_multiply(M * (dt*NT), y0)
+        c = yend[:NR, :]
+        ca = yend[NR:2*NR, :]
+    else:
+        print('Unknown method: ' + method)
+        sys.exit()
+    return c_arr, t_arr, c, ca
+    
+def flux_steady(O, rb):
+    """
+    Solves directly for the steady state c and ca (NR, nsrc) of the box
+    model with forcing rb, which is where the time integration ends up after
+    long enough.  Only meaningful for sources with an inflow at the open
+    boundaries.
+    """
+    lu = splu(O['A'].tocsc())
+    c = lu.solve(-rb)
+    lua = splu(O['A0'].tocsc())
+    ca = lua.solve(-c/Tage)
+    return c, ca
+
 # segment definitions, assembled by looking at the figures
 # created by plot_thalweg_mean.py
 segs = {
@@ -294,4 +416,36 @@ def update_mm(ji, mm, this_ji_list, full_ji_list, next_ji_list):
         this_ji_list = next_ji_list.copy()
         next_ji_list = []
         counter += 1
-    return mm, this_ji_list, full_ji_list, next_ji_list
\ No newline at end of file
+    return mm, this_ji_list, full_ji_list, next_ji_list
+
+def get_seg_cells(mm, seed_list):
+    """
+    Returns a boolean array, True for all the cells of mm (a boolean array,
+    True over water, with the cells just outside the bounding sections
+    set to False) that are connected to any of the (j,i) tuples in
+    seed_list through their N, E, S, or W neighbors.
+
+    This is a fast version of the "search robot" update_mm(), using the
+    connected-component labeling of scipy.ndimage.
+    """
+    cc, ncc = ndimage.label(mm) # default structure is 4-connected
+    seeds = np.array(seed_list, dtype=int).reshape(-1,2)
+    ids = cc[seeds[:,0], seeds[:,1]]
+    ids = np.unique(ids[ids > 0])
+    return np.isin(cc, ids)
+
+def get_seg_labels(ji_dict, seg_list, shape):
+    """
+    Returns a 2-D integer array on the rho grid holding, for each cell, the
+    index of its segment in seg_list, and -1 for cells in no segment.
+    This is used to reduce fields over all segments at once with
+    np.bincount(), e.g. in flux_get_s.py.
+    """
+    lab = -np.ones(shape, dtype=int)
+    for iseg, seg_name in enumerate(seg_list):
+        ji = np.array(list(ji_dict[seg_name]), dtype=int).reshape(-1,2)
+        if (lab[ji[:,0], ji[:,1]] >= 0).any():
+            print(' -- Warning: segment %s overlaps an earlier segment' % (seg_name))
+        lab[ji[:,0], ji[:,1]] = iseg
+    return lab
+
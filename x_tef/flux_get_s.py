@@ -1,9 +1,12 @@
 """
 A tool to extract hourly time series of salinity and volume in the segments.
 
-Performance: takes 1.5 sec per save (3.6 hours per year) on my mac.  This relies
-on creating i_dict and j_dict of indices used for fancy indexing in the segment loop.
-The alternate version takes about 15 times longer.
+Performance: each hour makes a single call to zrfun.get_z() for all the
+water columns in the segments, and then reduces volume and salt over all
+segments at once using np.bincount() on an integer array of segment labels
+(seg_labels.p saved by flux_get_vol.py, or else made here by
+flux_fun.get_seg_labels()).  Results go into preallocated arrays and the
+DataFrames are made once at the end.
 
 """
 
@@ -59,7 +62,6 @@ G = zrfun.get_basic_info(fn, only_G=True)
 S = zrfun.get_basic_info(fn, only_S=True)
 h = G['h']
 DA = G['DX'] * G['DY']
-DA3 = DA.reshape((1,G['M'],G['L']))
 
 # set input/output location
 indir0 = Ldir['LOo'] + 'tef/'
@@ -83,21 +85,28 @@ if testing:
     verbose = True
     seg_list = seg_list[-2:]
 
-j_dict = {}; i_dict = {}
-for seg_name in seg_list:
-    jj = []; ii = []
-    ji_list_full = ji_dict[seg_name]
-    for ji in ji_list_full:
-        jj.append(ji[0])
-        ii.append(ji[1])
-    jjj = np.array(jj)
-    iii = np.array(ii)
-    j_dict[seg_name] = jjj
-    i_dict[seg_name] = iii
-
-s_df = pd.DataFrame(columns=seg_list)
-v_df = pd.DataFrame(columns=seg_list)
-
+# integer array of segment labels on the rho grid, and the water columns
+# that belong to any segment
+NS = len(seg_list)
+lab_dict = {'seg_list':[]}
+if os.path.isfile(voldir + 'seg_labels.p'):
+    # saved by flux_get_vol.py
+    lab_dict = pickle.load(open(voldir + 'seg_labels.p', 'rb'))
+if lab_dict['seg_list'] == seg_list:
+    lab = lab_dict['lab']
+else:
+    lab = flux_fun.get_seg_labels(ji_dict, seg_list, h.shape)
+seg_mask = lab >= 0
+lab_m = lab[seg_mask]
+h_m = h[seg_mask]
+DA_m = DA[seg_mask]
+
+# arrays to hold the results
+s_arr = np.nan * np.ones((NT, NS))
+v_arr = np.nan * np.ones((NT, NS))
+dt_list = []
+
+tt = 0
 for fn in fn_list:
     
     tt0 = time()
@@ -110,46 +119,31 @@ for fn in fn_list:
     ot = ds['ocean_time'][:]
     ds.close()
     
-    if testing:
-        z_w_alt = zrfun.get_z(h, zeta, S, only_w=True)
-        dz_alt = np.diff(z_w_alt, axis=0)
-        DV_alt = dz_alt * DA3
-    
     dt = Lfun.modtime_to_datetime(ot.data[0])
+    dt_list.append(dt)
     
-    # find the volume and volume-mean salinity
-    for seg_name in seg_list:
-        
-        jjj = j_dict[seg_name]
-        iii = i_dict[seg_name]
-        
-        z_w = zrfun.get_z(h[jjj,iii], zeta[jjj,iii], S, only_w=True)
-        dz = np.diff(z_w, axis=0)
-        DV = dz * DA3[0,jjj,iii]
-        volume = DV.sum()
-        net_salt = (salt[:,jjj,iii] * DV).sum()
-        mean_salt = net_salt/volume
-        
-        if testing:
-            net_salt_alt = 0
-            volume_alt = 0
-            full_ji_list = ji_dict[seg_name]
-            for ji in full_ji_list:
-                net_salt_alt += (salt[:,ji[0],ji[1]] * DV_alt[:,ji[0],ji[1]]).sum()
-                volume_alt += DV_alt[:,ji[0],ji[1]].sum()
-            mean_salt_alt = net_salt_alt / volume_alt
-        
-        # store results
-        s_df.loc[dt, seg_name] = mean_salt
-        v_df.loc[dt, seg_name] = volume
-        
-        if verbose:
+    # find the volume and volume-mean salinity of all segments at once
+    z_w = zrfun.get_z(h_m, zeta.data[seg_mask], S, only_w=True)
+    DV = np.diff(z_w, axis=0) * DA_m
+    volume = np.bincount(lab_m, weights=DV.sum(axis=0), minlength=NS)
+    net_salt = np.bincount(lab_m, weights=(salt.data[:,seg_mask] * DV).sum(axis=0),
+        minlength=NS)
+    mean_salt = net_salt/volume
+    
+    # store results
+    s_arr[tt,:] = mean_salt
+    v_arr[tt,:] = volume
+    
+    if verbose:
+        for iseg, seg_name in enumerate(seg_list):
             print('%3s: Mean Salinity = %0.4f, Volume  = %0.4f km3' %
-                (seg_name, mean_salt, volume/1e9))
-            print('%3s: Mean Sal alt  = %0.4f, Vol alt = %0.4f km3' %
-                (seg_name, mean_salt_alt, volume_alt/1e9))
+                (seg_name, mean_salt[iseg], volume[iseg]/1e9))
                 
     print('  ** took %0.1f sec' % (time()-tt0))
+    tt += 1
+
+s_df = pd.DataFrame(s_arr, index=dt_list, columns=seg_list)
+v_df = pd.DataFrame(v_arr, index=dt_list, columns=seg_list)
 
 s_out_fn = outdir + 'hourly_segment_salinity.p'
 v_out_fn = outdir + 'hourly_segment_volume.p'
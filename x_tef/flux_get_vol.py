@@ -114,11 +114,6 @@ for seg_name in seg_name_list:
     # initialize a mask
     mm = m.copy().data # boolean array, True over water
 
-    # initialize some lists
-    full_ji_list = [] # full list of indices of good rho points inside the volume
-    this_ji_list = [] # current list of indices of good rho points inside the volume
-    next_ji_list = [] # next list of indices of good rho points inside the volume
-
     for sn in seg_df.index:
         s = seg_df.loc[sn,:]
         # mask the rho grid points on the outside of the TEF sections
@@ -151,68 +146,34 @@ for seg_name in seg_name_list:
                 ax.plot(x[s['jj0'], s['ii0']:s['ii1']+1], y[s['jj0'], s['ii0']:s['ii1']+1], 'om')
                 ax.plot(x[s['jj1'], s['ii0']:s['ii1']+1], y[s['jj1'], s['ii0']:s['ii1']+1], 'ok')
 #
-    # deploy the "search robot" flux_fun.update_mm()
-    # the algorithm is that we start the search at a good rho point at either end of each TEF
-    # section, and allow it to fill in as much of the remaining points as it can
+    # find all the water points connected to a good rho point at either end
+    # of each TEF section, using flux_fun.get_seg_cells()
+    seed_list = []
     for sn in seg_df.index:
-        #print(sn)
         s = seg_df.loc[sn,:]
         if s['sdir'] == 'NS' and s['side'] == 'W':
-            ji = (s['jj0'],s['ii1'])
-            mm, this_ji_list, full_ji_list, next_ji_list = flux_fun.update_mm(ji, mm,
-                    this_ji_list, full_ji_list, next_ji_list)
-            ji = (s['jj1'],s['ii1'])
-            mm, this_ji_list, full_ji_list, next_ji_list = flux_fun.update_mm(ji, mm,
-                    this_ji_list, full_ji_list, next_ji_list)
+            seed_list += [(s['jj0'],s['ii1']), (s['jj1'],s['ii1'])]
         elif s['sdir'] == 'NS' and s['side'] == 'E':
-            ji = (s['jj0'],s['ii0'])
-            mm, this_ji_list, full_ji_list, next_ji_list = flux_fun.update_mm(ji, mm,
-                    this_ji_list, full_ji_list, next_ji_list)
-            ji = (s['jj1'],s['ii0'])
-            mm, this_ji_list, full_ji_list, next_ji_list = flux_fun.update_mm(ji, mm,
-                    this_ji_list, full_ji_list, next_ji_list)
+            seed_list += [(s['jj0'],s['ii0']), (s['jj1'],s['ii0'])]
         elif s['sdir'] == 'EW' and s['side'] == 'S':
-            ji = (s['jj1'],s['ii0'])
-            mm, this_ji_list, full_ji_list, next_ji_list = flux_fun.update_mm(ji, mm,
-                    this_ji_list, full_ji_list, next_ji_list)
-            ji = (s['jj1'],s['ii1'])
-            mm, this_ji_list, full_ji_list, next_ji_list = flux_fun.update_mm(ji, mm,
-                    this_ji_list, full_ji_list, next_ji_list)
+            seed_list += [(s['jj1'],s['ii0']), (s['jj1'],s['ii1'])]
         elif s['sdir'] == 'EW' and s['side'] == 'N':
-            ji = (s['jj0'],s['ii0'])
-            mm, this_ji_list, full_ji_list, next_ji_list = flux_fun.update_mm(ji, mm,
-                    this_ji_list, full_ji_list, next_ji_list)
-            ji = (s['jj0'],s['ii1'])
-            mm, this_ji_list, full_ji_list, next_ji_list = flux_fun.update_mm(ji, mm,
-                    this_ji_list, full_ji_list, next_ji_list)
-    # check results for extras
-    if len(set(full_ji_list)) != len(full_ji_list):
-        print(' -- Warning: had to remove duplicates from list')
-        full_ji_list = set(full_ji_list)
+            seed_list += [(s['jj0'],s['ii0']), (s['jj0'],s['ii1'])]
+    seg_cells = flux_fun.get_seg_cells(mm, seed_list)
+    full_ji_list = list(zip(*np.nonzero(seg_cells)))
         
     ji_dict[seg_name] = full_ji_list
 
     if testing:
-        hh = np.zeros(h.shape)
-        for ji in full_ji_list: 
-            hh[ji]=1
-        H = hh==0
-        hm = np.ma.masked_where(H,h)
+        hm = np.ma.masked_where(~seg_cells,h)
         ax.pcolormesh(xp, yp, hm[1:-1,1:-1], cmap='terrain_r', vmin=-100, vmax = 400)
         
 #
     # find the volume and surface area
-    volume = 0
-    area = 0
-    lon = 0
-    lat = 0
-    for ji in full_ji_list:
-        area += DA[ji]
-        volume += h[ji] * DA[ji]
-        lon += x[ji]
-        lat += y[ji]
-    lon = lon / len(full_ji_list)
-    lat = lat / len(full_ji_list)
+    area = DA[seg_cells].sum()
+    volume = (h.data[seg_cells] * DA[seg_cells]).sum()
+    lon = x[seg_cells].mean()
+    lat = y[seg_cells].mean()
     print(' -- Area = %0.1f km2' % (area/1e6))
     print(' -- Volume = %0.1f km3' % (volume/1e9))
 
@@ -225,6 +186,11 @@ if not testing:
     vol_df.to_pickle(outdir + 'volumes.p')
     pickle.dump(bathy_dict, open(outdir + 'bathy_dict.p', 'wb'))
     pickle.dump(ji_dict, open(outdir + 'ji_dict.p', 'wb'))
+    # and a 2-D array of integer segment labels (index into seg_list, -1 for
+    # cells in no segment) for reductions over all segments at once
+    seg_list = list(vol_df.index)
+    lab = flux_fun.get_seg_labels(ji_dict, seg_list, h.shape)
+    pickle.dump({'lab':lab, 'seg_list':seg_list}, open(outdir + 'seg_labels.p', 'wb'))
 #
 if testing:
     plt.show()
@@ -77,8 +77,7 @@ for season in flux_fun.season_list:
         
         x0, x1, y0, y1, landward = sect_df.loc[sect_name,:]    
         
-        fn = indir + sect_name + '.p'
-        bulk = pickle.load(open(fn, 'rb'))
+        bulk = tef_fun.load_tef(indir, sect_name, vn_list=['ot', 'QQ', 'SS'])
     
         # find the index range that corresponds to the desired time range
         if get_time == True:
@@ -98,7 +98,7 @@ for year in [2017, 2018, 2019]:
     
     df = pd.DataFrame(index=sect_list)
     for sn in sect_list:
-        bulk = pickle.load(open(indir + sn + '.p', 'rb'))
+        bulk = tef_fun.load_tef(indir, sn, vn_list=['fnet_lp', 'qnet_lp'])
         sx0, sx1, sy0, sy1, landward = sect_df.loc[sn,:]
         sx = (sx0+sx1)/2; sy = (sy0+sy1)/2
         if (sx0==sx1) and (sy0!=sy1):
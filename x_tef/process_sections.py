@@ -3,6 +3,11 @@ Process TEF extractions.
 
 Currently only set up to do salt.
 
+Use "-append True" to only process the hours of the extraction that are not
+already in the processed file, as after extract_sections.py -append True.
+The binning is done hour by hour, so this gives the same result as processing
+everything again.
+
 """
 
 # setup
@@ -20,11 +25,33 @@ if alp not in sys.path:
 import Lfun
 import zfun
 
+import tef_fun
+
+def boolean_string(s):
+    if s not in ['False', 'True']:
+        raise ValueError('Not a valid boolean string')
+    return s == 'True' # note use of ==
+
+# get command line arguments
+import argparse
+parser = argparse.ArgumentParser()
+# the tef extraction to process, like cas6_v3_lo8b_2017.01.01_2017.12.31,
+# chosen from a list if not given
+parser.add_argument('-item', nargs='?', type=str, default='')
+# section to process, like sog5, or all, chosen at the prompt if not given
+parser.add_argument('-sn', '--sect_name', nargs='?', type=str, default='')
+# only process new hours
+parser.add_argument('-append', default=False, type=boolean_string)
+args = parser.parse_args()
+
 Ldir = Lfun.Lstart()
 
 indir0 = Ldir['LOo'] + 'tef/'
 # choose the tef extraction to process
-item = Lfun.choose_item(indir0)
+if len(args.item) > 0:
+    item = args.item
+else:
+    item = Lfun.choose_item(indir0)
 indir0 = indir0 + item + '/'
 indir = indir0 + 'extractions/'
 
@@ -35,8 +62,11 @@ print(20*'=' + ' Extracted Sections ' + 20*'=')
 print(*sect_list, sep=", ")
 print(61*'=')
 # select which sections to process
-my_choice = input('-- Input section to process (e.g. sog5, or Return to process all): ')
-if len(my_choice)==0:
+if len(args.sect_name) > 0:
+    my_choice = args.sect_name
+else:
+    my_choice = input('-- Input section to process (e.g. sog5, or Return to process all): ')
+if (len(my_choice)==0) or (my_choice == 'all'):
     # full list
     pass
 else: # single item
@@ -54,92 +84,64 @@ for tef_file in sect_list:
     fn = indir + tef_file
 
     # name output file
-    out_fn = outdir + tef_file.replace('.nc','.p')
-    # get rid of the old version, if it exists
-    try:
-        os.remove(out_fn)
-    except OSError:
-        pass
+    out_fn = outdir + tef_file
+    sn = tef_file.replace('.nc','')
 
-    # load fields
+    # TEF salinity bins
+    sedges = np.linspace(0, 36, 1001) # original was 1001 used 5001 for Willapa
+    sbins = sedges[:-1] + np.diff(sedges)/2
+    
     ds = nc.Dataset(fn)
-    q = ds['q'][:]
-    s = ds['salt'][:]
     ot = ds['ocean_time'][:]
-    zeta = ds['zeta'][:]
+    
+    # find how many hours are already processed
+    nt0 = 0
+    if args.append and os.path.isfile(out_fn):
+        tef_old = tef_fun.load_tef(outdir, sn)
+        nt_old = len(tef_old['ot'])
+        if ((nt_old <= len(ot)) and np.all(tef_old['ot'] == ot[:nt_old])
+            and np.all(tef_old['sbins'] == sbins)):
+            nt0 = nt_old
+        else:
+            print(' - processed file does not line up with the extraction: redo all')
+    if nt0 == len(ot):
+        print(' - no new hours')
+        ds.close()
+        continue
+    
+    # get rid of the old versions, if they exist
+    for fn_old in [out_fn, out_fn.replace('.nc','.p')]:
+        try:
+            os.remove(fn_old)
+        except OSError:
+            pass
+
+    # load fields
+    q = ds['q'][nt0:]
+    s = ds['salt'][nt0:]
+    zeta = ds['zeta'][nt0:]
     gtagex = ds.gtagex
     ds0 = ds.date_string0
     ds1 = ds.date_string1
     ds.close()
 
     # TEF sort into salinity bins
-    qs = q*s
-    NT, NZ, NX = q.shape
-    # initialize intermediate results arrays for TEF quantities
-    sedges = np.linspace(0, 36, 1001) # original was 1001 used 5001 for Willapa
-    sbins = sedges[:-1] + np.diff(sedges)/2
-    NS = len(sbins) # number of salinity bins
-
-    # TEF variables
-    tef_q = np.zeros((NT, NS))
-    tef_qs = np.zeros((NT, NS))
-
-    # other variables
-    qnet = np.zeros(NT)
-    fnet = np.zeros(NT)
-    ssh = np.zeros(NT)
-    g = 9.8
-    rho = 1025
-
-    for tt in range(NT):
-        if np.mod(tt,100) == 0:
-            print('  time %d out of %d' % (tt,NT))
-            sys.stdout.flush()
-            
-        si = s[tt,:,:].squeeze()
-        if isinstance(si, np.ma.MaskedArray):
-            sf = si[si.mask==False].data.flatten()
-        else:
-            sf = si.flatten()
-            
-        qi = q[tt,:,:].squeeze()
-        if isinstance(qi, np.ma.MaskedArray):
-            qf = qi[qi.mask==False].data.flatten()
-        else:
-            qf = qi.flatten()
-            
-        qsi = qs[tt,:,:].squeeze()
-        if isinstance(qsi, np.ma.MaskedArray):
-            qsf = qsi[si.mask==False].data.flatten()
-        else:
-            qsf = qsi.flatten()
-            
-        # sort into salinity bins
-        inds = np.digitize(sf, sedges, right=True)
-        indsf = inds.copy().flatten()
-        counter = 0
-        for ii in indsf:
-            tef_q[tt, ii-1] += qf[counter]
-            tef_qs[tt, ii-1] += qsf[counter]
-            counter += 1
-        
-        # also keep track of volume transport
-        qnet[tt] = qf.sum()
-        
-        # and tidal energy flux
-        zi = zeta[tt,:].squeeze()
-        ff = zi.reshape((1,NX)) * qi
-        fnet[tt] = g * rho * ff.sum()
+    tef_q, tef_qs, qnet, fnet = tef_fun.salt_bin(q, s, zeta, sedges)
 
     # save results
     tef_dict = dict()
     tef_dict['tef_q'] = tef_q
     tef_dict['tef_qs'] = tef_qs
     tef_dict['sbins'] = sbins
-    tef_dict['ot'] = ot
+    tef_dict['ot'] = ot[nt0:]
     tef_dict['qnet'] = qnet
     tef_dict['fnet'] = fnet
     tef_dict['ssh'] = np.mean(zeta, axis=1)
-    pickle.dump(tef_dict, open(out_fn, 'wb'))
+    if nt0 > 0:
+        # add the new hours to the old ones
+        for vn in tef_dict.keys():
+            if vn != 'sbins':
+                tef_dict[vn] = np.ma.concatenate((tef_old[vn], tef_dict[vn]), axis=0)
+    tef_fun.save_tef(out_fn, tef_dict)
 
 
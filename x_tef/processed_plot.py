@@ -43,7 +43,7 @@ if testing:
 plt.close('all')
 
 for sn in sect_list:
-    bulk = pickle.load(open(indir + sn + '.p', 'rb'))
+    bulk = tef_fun.load_tef(indir, sn, vn_list=['ot', 'sbins', 'tef_q', 'qnet'])
     # bulk is a dict with keys ['tef_q', 'tef_qs', 'sbins', 'ot', 'qnet', 'fnet', 'ssh']
     ot = bulk['ot'] # model time in seconds from 1/1/1970 (hourly)
     sbins = bulk['sbins']
@@ -7,6 +7,7 @@ import numpy as np
 import pickle
 import matplotlib.pyplot as plt
 import os
+import sys
 
 # path to alpha provided by driver
 import zfun
@@ -242,14 +243,16 @@ def start_netcdf(fn, out_fn, NT, NX, NZ, Lon, Lat, Ldir):
     foo = nc.Dataset(out_fn, 'w')
     foo.createDimension('xi_sect', NX)
     foo.createDimension('s_rho', NZ)
-    foo.createDimension('ocean_time', NT)
+    foo.createDimension('ocean_time', None) # unlimited, so we can append
     foo.createDimension('sdir_str', 2)
+    nchunk = 24 # time chunks, matching the buffers of start_sect()
     for vv in ['ocean_time']:
-        v_var = foo.createVariable(vv, float, ('ocean_time',))
+        v_var = foo.createVariable(vv, float, ('ocean_time',), chunksizes=(nchunk,))
         v_var.long_name = long_name_dict[vv]
         v_var.units = units_dict[vv]
     for vv in vn_list + ['q']:
-        v_var = foo.createVariable(vv, float, ('ocean_time', 's_rho', 'xi_sect'))
+        v_var = foo.createVariable(vv, float, ('ocean_time', 's_rho', 'xi_sect'),
+            chunksizes=(nchunk, NZ, NX))
         v_var.long_name = long_name_dict[vv]
         v_var.units = units_dict[vv]
     for vv in ['z0', 'DA0']:
@@ -261,7 +264,8 @@ def start_netcdf(fn, out_fn, NT, NX, NZ, Lon, Lat, Ldir):
         v_var.long_name = long_name_dict[vv]
         v_var.units = units_dict[vv]
     for vv in ['zeta']:
-        v_var = foo.createVariable(vv, float, ('ocean_time', 'xi_sect'))
+        v_var = foo.createVariable(vv, float, ('ocean_time', 'xi_sect'),
+            chunksizes=(nchunk, NX))
         v_var.long_name = 'Free Surface Height'
         v_var.units = 'm'
 
@@ -278,84 +282,313 @@ def start_netcdf(fn, out_fn, NT, NX, NZ, Lon, Lat, Ldir):
     
     return vn_list
     
-def add_fields(ds, count, vn_list, G, S, sinfo):
+def check_sect(out_fn):
+    """
+    Checks if the existing output file of a section can be appended to.
     
+    Returns None if there is no file, or if its time dimension is not
+    unlimited (files made before start_netcdf() allowed this), and
+    otherwise a tuple of the number of times already in the file, the
+    last ocean_time, and the list of tracers extracted.
+    """
+    if not os.path.isfile(out_fn):
+        return None
+    foo = nc.Dataset(out_fn)
+    if not foo.dimensions['ocean_time'].isunlimited():
+        foo.close()
+        return None
+    NT0 = len(foo.dimensions['ocean_time'])
+    if NT0 > 0:
+        ot_last = float(foo['ocean_time'][NT0-1])
+    else:
+        ot_last = None
+    vn_list = [vn for vn in foo.variables if (foo[vn].ndim == 3) and (vn != 'q')]
+    foo.close()
+    return NT0, ot_last, vn_list
+    
+def start_sect(ds, G, S, sinfo, vn_list, nbuf=24):
+    """
+    Opens the output file of a section for the whole extraction, and
+    writes its static fields (h, z0, DA0).
+
+    Returns a dict B holding the open Dataset, the static geometry of the
+    section, and buffers for nbuf hours of the time-dependent fields.  These
+    are filled by add_fields() and written to the file in a single call by
+    flush_fields().  Use close_sect() at the end.
+    """
     ii0, ii1, jj0, jj1, sdir, landward, NT, NX, NZ, out_fn = sinfo
     
+    # get depth and dd (which is either dx or dy)
+    h = ds['h'][jj0:jj1+1,ii0:ii1+1].squeeze()
+    if sdir=='NS':
+        dd = G['DY'][jj0:jj1+1,ii0:ii1+1].squeeze()
+        DD = dd.mean(axis=1)
+        hh = h.mean(axis=1)
+    elif sdir=='EW':
+        dd = G['DX'][jj0:jj1+1,ii0:ii1+1].squeeze()
+        DD = dd.mean(axis=0)
+        hh = h.mean(axis=0)
+        
     foo = nc.Dataset(out_fn, 'a')
+    foo['h'][:] = hh
+    z0 = zrfun.get_z(hh, 0*hh, S, only_rho=True)
+    foo['z0'][:] = z0
+    zw0 = zrfun.get_z(hh, 0*hh, S, only_w=True)
+    DZ0 = np.diff(zw0, axis=0)
+    DA0 = DD.reshape((1, NX)) * DZ0
+    foo['DA0'][:] = DA0
+    
+    B = {'foo':foo, 'sinfo':sinfo, 'h':h, 'DD':DD, 'vn_list':vn_list,
+        'v3_list':vn_list + ['q'], 'nbuf':nbuf, 'count0':0, 'nb':0}
+    B['ocean_time'] = np.zeros(nbuf)
+    B['zeta'] = np.ma.zeros((nbuf, NX))
+    for vv in B['v3_list']:
+        B[vv] = np.ma.zeros((nbuf, NZ, NX))
+    return B
     
-    # get depth and dz, and dd (which is either dx or dy)
+def get_box(sect_info):
+    """
+    Returns a dict with the indices (j0, j1, i0, i1) of the box bounding all
+    the sections in sect_info, which covers their rho, u and v points, and
+    the list of velocities they need.
+    """
+    j0_list = []; j1_list = []; i0_list = []; i1_list = []
+    vel_list = []
+    for sect_name in sect_info.keys():
+        ii0, ii1, jj0, jj1, sdir, landward, NT, NX, NZ, out_fn = sect_info[sect_name]
+        j0_list.append(jj0); j1_list.append(jj1)
+        i0_list.append(ii0); i1_list.append(ii1)
+        if (sdir=='NS') and ('u' not in vel_list):
+            vel_list.append('u')
+        elif (sdir=='EW') and ('v' not in vel_list):
+            vel_list.append('v')
+    box = {'j0':min(j0_list), 'j1':max(j1_list), 'i0':min(i0_list),
+        'i1':max(i1_list), 'vel_list':vel_list}
+    return box
+    
+def read_box(ds, box, vn_list):
+    """
+    Reads the fields needed by add_fields() from history file ds, as a single
+    hyperslab per variable covering all the sections in the box.  This is
+    much faster than many small reads for each section.
+    """
+    jj = slice(box['j0'], box['j1']+1)
+    ii = slice(box['i0'], box['i1']+1)
+    F = {'j0':box['j0'], 'i0':box['i0']}
+    F['ocean_time'] = ds['ocean_time'][0]
+    F['zeta'] = ds['zeta'][0, jj, ii]
+    for vn in box['vel_list'] + vn_list:
+        F[vn] = ds[vn][0, :, jj, ii]
+    return F
+    
+def add_fields(F, count, S, B):
+    """
+    Adds the fields from a history file, at time index count, to the
+    buffers of a section, and writes them out when the buffers are full.
+    F is the output of read_box() for the history file.
+    """
+    ii0, ii1, jj0, jj1, sdir, landward, NT, NX, NZ, out_fn = B['sinfo']
+    # indices relative to the box
+    ii0 -= F['i0']; ii1 -= F['i0']
+    jj0 -= F['j0']; jj1 -= F['j0']
+    
+    if count != B['count0'] + B['nb']:
+        # not the next time index, so start a new block
+        flush_fields(B)
+        B['count0'] = count
+    
+    # get dz
+    zeta = F['zeta'][jj0:jj1+1,ii0:ii1+1].squeeze()
+    z = zrfun.get_z(B['h'], zeta, S, only_w=True)
+    dz = np.diff(z, axis=0)
     if sdir=='NS':
-        h = ds['h'][jj0:jj1+1,ii0:ii1+1].squeeze()
-        zeta = ds['zeta'][0,jj0:jj1+1,ii0:ii1+1].squeeze()
-        z = zrfun.get_z(h, zeta, S, only_w=True)
-        # print(h)
-        # print(zeta)
-        # print(z)
-        dz = np.diff(z, axis=0)
         DZ = dz.mean(axis=2) # fails for a channel one point wide 2019.05.20 (oak)
-        dd = G['DY'][jj0:jj1+1,ii0:ii1+1].squeeze()
-        DD = dd.mean(axis=1)
         zeta = zeta.mean(axis=1)
-        if count==0:
-            hh = h.mean(axis=1)
-            foo['h'][:] = hh
-            
-            z0 = zrfun.get_z(hh, 0*hh, S, only_rho=True)
-            foo['z0'][:] = z0
-            
-            zw0 = zrfun.get_z(hh, 0*hh, S, only_w=True)
-            DZ0 = np.diff(zw0, axis=0)
-            DA0 = DD.reshape((1, NX)) * DZ0
-            foo['DA0'][:] = DA0
-            
     elif sdir=='EW':
-        h = ds['h'][jj0:jj1+1,ii0:ii1+1].squeeze()
-        zeta = ds['zeta'][0,jj0:jj1+1,ii0:ii1+1].squeeze()
-        z = zrfun.get_z(h, zeta, S, only_w=True)
-        dz = np.diff(z, axis=0)
         DZ = dz.mean(axis=1)
-        dd = G['DX'][jj0:jj1+1,ii0:ii1+1].squeeze()
-        DD = dd.mean(axis=0)
         zeta = zeta.mean(axis=0)
-        if count==0:
-            hh = h.mean(axis=0)
-            foo['h'][:] = hh
-            
-            z0 = zrfun.get_z(hh, 0*hh, S, only_rho=True)
-            foo['z0'][:] = z0
-            
-            zw0 = zrfun.get_z(hh, 0*hh, S, only_w=True)
-            DZ0 = np.diff(zw0, axis=0)
-            DA0 = DD.reshape((1, NX)) * DZ0
-            foo['DA0'][:] = DA0
             
     # and then create the array of cell areas on the section
-    DA = DD.reshape((1, NX)) * DZ
+    DA = B['DD'].reshape((1, NX)) * DZ
     # then velocity and hence transport
     if sdir=='NS':
-        vel = ds['u'][0, :, jj0:jj1+1, ii0].squeeze()
+        vel = F['u'][:, jj0:jj1+1, ii0].squeeze()
     elif sdir=='EW':
-        vel = ds['v'][0, :, jj0, ii0:ii1+1].squeeze()
+        vel = F['v'][:, jj0, ii0:ii1+1].squeeze()
     q = vel * DA * landward
     
-    foo['q'][count, :, :] = q
-    foo['zeta'][count, :] = zeta
-    foo['ocean_time'][count] = ds['ocean_time'][0]
-    
+    nb = B['nb']
+    B['q'][nb,:,:] = q
+    B['zeta'][nb,:] = zeta
+    B['ocean_time'][nb] = F['ocean_time']
     
     # save the tracer fields averaged onto this section
-    for vn in vn_list:
+    for vn in B['vn_list']:
         if sdir=='NS':
-            vvv = (ds[vn][0,:,jj0:jj1+1,ii0].squeeze()
-                + ds[vn][0,:,jj0:jj1+1,ii1].squeeze())/2
+            vvv = (F[vn][:,jj0:jj1+1,ii0].squeeze()
+                + F[vn][:,jj0:jj1+1,ii1].squeeze())/2
         elif sdir=='EW':
-            vvv = (ds[vn][0,:,jj0,ii0:ii1+1].squeeze()
-                + ds[vn][0,:,jj1,ii0:ii1+1].squeeze())/2
-        foo[vn][count,:,:] = vvv
+            vvv = (F[vn][:,jj0,ii0:ii1+1].squeeze()
+                + F[vn][:,jj1,ii0:ii1+1].squeeze())/2
+        B[vn][nb,:,:] = vvv
+        
+    B['nb'] += 1
+    if B['nb'] == B['nbuf']:
+        flush_fields(B)
         
+def flush_fields(B):
+    # write the buffered hours of a section to its output file
+    nb = B['nb']
+    if nb > 0:
+        c0 = B['count0']
+        foo = B['foo']
+        foo['ocean_time'][c0:c0+nb] = B['ocean_time'][:nb]
+        foo['zeta'][c0:c0+nb, :] = B['zeta'][:nb, :]
+        for vv in B['v3_list']:
+            foo[vv][c0:c0+nb, :, :] = B[vv][:nb, :, :]
+    B['count0'] += nb
+    B['nb'] = 0
+    
+def close_sect(B):
+    flush_fields(B)
+    B['foo'].close()
+    
+def salt_bin(q, s, zeta, sedges, nchunk=1000, verbose=True):
+    """
+    Sort the transport through a section into salinity bins.
+
+    Input: q and s (NT, NZ, NX) and zeta (NT, NX), as in an extraction file
+    (masked arrays are ok), and the bin edges sedges.
+
+    Returns tef_q, tef_qs (NT, NS), and qnet, fnet (NT,).
+
+    All the cells of a block of nchunk hours are binned at once, using a
+    single bincount over (hour, bin) pairs.  Cells are added to each bin in
+    the same order as in the original cell-by-cell loop, so the sums match it.
+    """
+    g = 9.8
+    rho = 1025
+    NT, NZ, NX = q.shape
+    NS = len(sedges) - 1
+    tef_q = np.zeros((NT, NS))
+    tef_qs = np.zeros((NT, NS))
+    qnet = np.zeros(NT)
+    fnet = np.zeros(NT)
+    for it0 in range(0, NT, nchunk):
+        if verbose:
+            print('  time %d out of %d' % (it0,NT))
+            sys.stdout.flush()
+        it1 = min(it0 + nchunk, NT)
+        nt = it1 - it0
+        qi = q[it0:it1,:,:]
+        si = s[it0:it1,:,:]
+        zi = zeta[it0:it1,:]
+        qsi = qi*si
+        # good cells (the mask of q and s are the same in practice)
+        sgood = ~np.ma.getmaskarray(si).reshape((nt, -1))
+        qgood = ~np.ma.getmaskarray(qi).reshape((nt, -1))
+        sf = np.ma.getdata(si).reshape((nt, -1))
+        qf = np.ma.getdata(qi).reshape((nt, -1))
+        qsf = np.ma.getdata(qsi).reshape((nt, -1))
+        # bin index of each cell, where s == sedges[0] goes to the last bin,
+        # as the index -1 did in the original loop, and s > sedges[-1]
+        # goes to the last bin
+        inds = np.digitize(sf[sgood], sedges, right=True) - 1
+        inds[inds == -1] = NS - 1
+        inds[inds == NS] = NS - 1
+        # offset the bins of each hour
+        tt = np.tile(np.arange(nt).reshape((nt, 1)), (1, NZ*NX))
+        inds = inds + NS*tt[sgood]
+        tef_q[it0:it1,:] = np.bincount(inds, weights=qf[sgood],
+            minlength=nt*NS).reshape((nt, NS))
+        tef_qs[it0:it1,:] = np.bincount(inds, weights=qsf[sgood],
+            minlength=nt*NS).reshape((nt, NS))
+        # also keep track of volume transport
+        qnet[it0:it1] = np.where(qgood, qf, 0).sum(axis=1)
+        # and tidal energy flux
+        ff = zi.reshape((nt, 1, NX)) * qi
+        fnet[it0:it1] = g * rho * ff.sum(axis=(1,2))
+    return tef_q, tef_qs, qnet, fnet
+    
+# Dimensions of the fields in the processed and bulk TEF files.  All other
+# fields are time series, with dimension ('time',).
+tef_dims = {'sbins':('sbin',), 'tef_q':('time','sbin'), 'tef_qs':('time','sbin'),
+    'QQ':('time','layer'), 'SS':('time','layer')}
+
+def save_tef(out_fn, D, nchunk=240):
+    """
+    Saves a dict of TEF results, like the output of process_sections.py
+    or bulk_calc.py, as a compressed NetCDF file.  The fields are chunked in
+    time (nchunk records at a time) so that load_tef() can read a time window
+    or a few fields without reading the whole file.  Masked values are written
+    as the fill value, so they come back masked from load_tef().
+    """
+    try: # get rid of the existing version
+        os.remove(out_fn)
+    except OSError:
+        pass # assume error was because the file did not exist
+    NT = len(D['ot'])
+    foo = nc.Dataset(out_fn, 'w')
+    foo.createDimension('time', NT)
+    for vn in D.keys():
+        dims = tef_dims.get(vn, ('time',))
+        sh = np.shape(D[vn])
+        for ii in range(len(dims)):
+            if dims[ii] not in foo.dimensions:
+                foo.createDimension(dims[ii], sh[ii])
+        chunks = [max(1, min(nchunk, NT)) if dn == 'time' else sh[ii]
+            for ii, dn in enumerate(dims)]
+        v_var = foo.createVariable(vn, float, dims, zlib=True, complevel=1,
+            chunksizes=chunks, fill_value=nc.default_fillvals['f8'])
+        v_var[:] = D[vn]
     foo.close()
     
+def list_tef(indir):
+    # the sorted list of section names with TEF results in indir
+    sn_list = [item.split('.')[0] for item in os.listdir(indir)
+        if (item.endswith('.nc') or item.endswith('.p'))]
+    sn_list = list(set(sn_list))
+    sn_list.sort()
+    return sn_list
+    
+def load_tef(indir, sn, vn_list=None, ot0=None, ot1=None):
+    """
+    Loads the TEF results for section sn from indir (like .../processed/ or
+    .../bulk/) as a dict.  These are read from the NetCDF file written by
+    save_tef(), or from an older pickled file if there is no NetCDF file.
+    
+    vn_list = fields to get (default all)
+    ot0, ot1 = only get times from ot0 to ot1 (inclusive), in seconds since
+        1/1/1970 like 'ot' (default all)
+    """
+    fn = indir + sn + '.nc'
+    if os.path.isfile(fn):
+        ds = nc.Dataset(fn)
+        ot = ds['ot'][:]
+        if vn_list is None:
+            vn_list = list(ds.variables.keys())
+    else:
+        ds = pickle.load(open(indir + sn + '.p', 'rb'))
+        ot = ds['ot']
+        if vn_list is None:
+            vn_list = list(ds.keys())
+    # time index range
+    it0 = 0
+    it1 = len(ot)
+    if ot0 is not None:
+        it0 = np.searchsorted(ot, ot0, side='left')
+    if ot1 is not None:
+        it1 = np.searchsorted(ot, ot1, side='right')
+    D = dict()
+    for vn in vn_list:
+        if tef_dims.get(vn, ('time',))[0] == 'time':
+            D[vn] = ds[vn][it0:it1]
+        else:
+            D[vn] = ds[vn][:]
+    if isinstance(ds, nc.Dataset):
+        ds.close()
+    return D
+    
 def OBSOLETE_tef_integrals(fn):
     # choices
     tidal_average = False # which kind of time filtering
@@ -7,41 +7,54 @@ Created on Tue Oct 16 16:01:15 2018
 
 import numpy as np
 
-def find_extrema(x, comp=5, print_info=False): # new, reduced, better described
+def local_extrema(x, comp=5):
+    """
+    The first step of find_extrema(), vectorized.
+    
+    input
+    x = Q(S), either a vector or an array with salinity on the last
+        axis, like [day, salinity bin]
+    comp = size of the window as an integer number
+    
+    output
+    is_max, is_min = Boolean arrays shaped like x, True where x[i] is the max
+        (or min) of x[i-comp:i+comp+1] (cut off at the ends), and that
+        window is not constant
+    """
+    x = np.asarray(x, dtype=float)
+    n = x.shape[-1]
+    pad = [(0,0)]*(x.ndim-1) + [(comp,comp)]
+    # running max and min over the window, padding so that the ends
+    # do not count
+    xp = np.pad(x, pad, mode='constant', constant_values=-np.inf)
+    xmax = xp[..., 0:n]
+    for k in range(1, 2*comp+1):
+        xmax = np.maximum(xmax, xp[..., k:k+n])
+    xp = np.pad(x, pad, mode='constant', constant_values=np.inf)
+    xmin = xp[..., 0:n]
+    for k in range(1, 2*comp+1):
+        xmin = np.minimum(xmin, xp[..., k:k+n])
+    is_max = (x == xmax) & (xmax != xmin)
+    # this does not catch an initial increase...
+    is_min = (x == xmin) & (xmax != xmin) & ~is_max
+    return is_max, is_min
+
+def find_extrema(x, comp=5, print_info=False, ext=None): # new, reduced, better described
     """
     input
     x = Q(S)
     comp = size of the window as an integer number
+    ext = optional (is_max, is_min) for x from local_extrema(), which
+        is faster to get for many times at once
     """
 
-    indices = []
-    minmax = []
-    
-    i = 0
-    while i < len(x): # np.shape(x)[0]:
-        
-        # set a to be i-1 (except for the first point, where a = 0)
-        # assuming comp = 1
-        if i-comp < 0:
-            a = 0
-        else:
-            a=i-comp
-            
-        # set b to be i + 2 (unless it puts it out of bounds, then b = None)
-        if i+comp >= len(x):
-            b=None
-        else:
-            b=i+comp+1
-            
-        # so [a:b] is the three points centered on i (for comp = 1)
-        if (x[i] == np.max(x[a:b])) and (np.max(x[a:b]) != np.min(x[a:b])):# and (x[i] != x[i-1]):
-            indices.append(i)
-            minmax.append('max')
-        # this does not catch an initial increase...
-        elif (x[i] == np.min(x[a:b])) and (np.max(x[a:b]) != np.min(x[a:b])):# and (x[i] != x[i-1]):
-            indices.append(i)
-            minmax.append('min')
-        i+=1
+    # local max and min in a window of +/- comp points
+    if ext is None:
+        is_max, is_min = local_extrema(x, comp=comp)
+    else:
+        is_max, is_min = ext
+    indices = [int(i) for i in np.nonzero(is_max | is_min)[0]]
+    minmax = [('max' if is_max[i] else 'min') for i in indices]
         
     if print_info:
         print('* first step')
@@ -165,16 +178,17 @@ def find_extrema(x, comp=5, print_info=False): # new, reduced, better described
             
     return indices, minmax
 
-def calc_bulk_values(s, Qv, Qs, print_info=False):
+def calc_bulk_values(s, Qv, Qs, print_info=False, ext=None):
     """
     input
     s=salinity array
     Qv=Q(S)
     Qs=Q^s(S)
     min_trans=minimum transport to consider
+    ext=optional output of local_extrema() for Qv
     """    
     # use the find_extrema algorithm
-    ind, minmax = find_extrema(Qv, print_info=print_info)
+    ind, minmax = find_extrema(Qv, print_info=print_info, ext=ext)
     
     # compute dividing salinities
     smin=s[0]
@@ -208,4 +222,33 @@ def calc_bulk_values(s, Qv, Qs, print_info=False):
         i+=1
     div_sal = np.delete(div_sal, index)
         
-    return Q_in_m, Q_out_m, s_in_m, s_out_m, div_sal, ind, minmax
\ No newline at end of file
+    return Q_in_m, Q_out_m, s_in_m, s_out_m, div_sal, ind, minmax
+
+def calc_bulk_series(s, Qv, Qs, nlay=30):
+    """
+    Runs calc_bulk_values() for every time in Qv and Qs (packed
+    [time, salinity]).  The first step of the extrema search is done for all
+    times at once.
+    
+    output
+    QQ, SS = transport and salinity of the layers at each time, sorted by
+        salinity and padded with nan to nlay layers (packed [time, layer])
+    """
+    NT = Qv.shape[0]
+    QQ = np.nan * np.ones((NT, nlay))
+    SS = np.nan * np.ones((NT, nlay))
+    is_max, is_min = local_extrema(Qv)
+    for dd in range(NT):
+        Q_in_m, Q_out_m, s_in_m, s_out_m, div_sal, ind, minmax = calc_bulk_values(s,
+            Qv[dd,:], Qs[dd,:], ext=(is_max[dd,:], is_min[dd,:]))
+        # save multi-layer output
+        qq = np.concatenate((Q_in_m, Q_out_m))
+        ss = np.concatenate((s_in_m, s_out_m))
+        ii = np.argsort(ss)
+        if len(ii)>0:
+            ss = ss[ii]
+            qq = qq[ii]
+            NL = len(qq)
+            QQ[dd, :NL] = qq
+            SS[dd, :NL] = ss
+    return QQ, SS
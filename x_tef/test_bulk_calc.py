@@ -16,6 +16,7 @@ import numpy as np
 import pickle
 import matplotlib.pyplot as plt
 
+import tef_fun
 import tef_fun_lorenz as tfl
 from importlib import reload
 reload(tfl)
@@ -36,13 +37,12 @@ ax3 = fig.add_subplot(313)
 
 counter = 0
 for ex in ex_list:
-    fn = indir0 + ex + '/processed/ai1.p'
     dd_offset = dd_offset_dict[ex]
 
     print('\nWorking on ' + ex)
 
     # load the data file
-    tef_ex=pickle.load(open(fn, 'rb'))
+    tef_ex = tef_fun.load_tef(indir0 + ex + '/processed/', 'ai1')
     # Notes on the data:
     # data.keys() => dict_keys(['tef_q', 'tef_qs', 'sbins', 'ot', 'qnet', 'fnet', 'ssh'])
     # data['tef_q'].shape => (8761, 1000), so packed [hour, salinity bin]
@@ -109,6 +109,18 @@ for sect_name in sect_list:
     # note that this function deletes the existing out_fn, and also creates the list
     # of variables to extract.
 
+# open all the output files for the whole extraction, and write
+# their static fields
+nbuf = 24 # number of hours to hold in memory before writing
+B_dict = dict()
+ds = nc.Dataset(fn)
+for sect_name in sect_list:
+    B_dict[sect_name] = tef_fun.start_sect(ds, G, S, sect_info[sect_name],
+        vn_list, nbuf=nbuf)
+ds.close()
+# the box bounding all sections, which we read from each history file
+box = tef_fun.get_box(sect_info)
+
 # extract and save time-dependent fields
 count = 0
 print('\nStarting extraction of fields')
@@ -117,15 +129,18 @@ for fn in fn_list:
     if np.mod(count,24)==0:
         print('  working on %d of %d' % (count, NT))
         sys.stdout.flush()
+    # read the fields for all sections at once
     ds = nc.Dataset(fn)
+    F = tef_fun.read_box(ds, box, vn_list)
+    ds.close()
     # loop over all sections
     for sect_name in sect_list:
-        sinfo = sect_info[sect_name]
         # this is where we add the data from this history file
-        # to all of the sections, each defined by sinfo
-        tef_fun.add_fields(ds, count, vn_list, G, S, sinfo)
-    ds.close()
+        # to all of the sections, each defined by sect_info
+        tef_fun.add_fields(F, count, S, B_dict[sect_name])
     count += 1
+for sect_name in sect_list:
+    tef_fun.close_sect(B_dict[sect_name])
 
 # finale
 import collections
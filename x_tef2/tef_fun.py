@@ -283,81 +283,151 @@ def start_netcdf(fn, out_fn, NT, NX, NZ, Lon, Lat, Ldir):
     
     return vn_list
     
-def add_fields(ds, count, vn_list, G, S, sinfo):
-    
+def start_sect(ds, G, S, sinfo, vn_list, nbuf=24):
+    """
+    Opens the output file of a section for the whole extraction, and
+    writes its static fields (h, z0, DA0).
+
+    Returns a dict B holding the open Dataset, the static geometry of the
+    section, and buffers for nbuf hours of the time-dependent fields.  These
+    are filled by add_fields() and written to the file in a single call by
+    flush_fields().  Use close_sect() at the end.
+    """
     ii0, ii1, jj0, jj1, sdir, landward, NT, NX, NZ, out_fn = sinfo
     
+    # get depth and dd (which is either dx or dy)
+    h = ds['h'][jj0:jj1+1,ii0:ii1+1].squeeze()
+    if sdir=='NS':
+        dd = G['DY'][jj0:jj1+1,ii0:ii1+1].squeeze()
+        DD = dd.mean(axis=1)
+        hh = h.mean(axis=1)
+    elif sdir=='EW':
+        dd = G['DX'][jj0:jj1+1,ii0:ii1+1].squeeze()
+        DD = dd.mean(axis=0)
+        hh = h.mean(axis=0)
+        
     foo = nc.Dataset(out_fn, 'a')
+    foo['h'][:] = hh
+    z0 = zrfun.get_z(hh, 0*hh, S, only_rho=True)
+    foo['z0'][:] = z0
+    zw0 = zrfun.get_z(hh, 0*hh, S, only_w=True)
+    DZ0 = np.diff(zw0, axis=0)
+    DA0 = DD.reshape((1, NX)) * DZ0
+    foo['DA0'][:] = DA0
+    
+    B = {'foo':foo, 'sinfo':sinfo, 'h':h, 'DD':DD, 'vn_list':vn_list,
+        'v3_list':vn_list + ['q', 'vel', 'DA'], 'nbuf':nbuf, 'count0':0, 'nb':0}
+    B['ocean_time'] = np.zeros(nbuf)
+    B['zeta'] = np.ma.zeros((nbuf, NX))
+    for vv in B['v3_list']:
+        B[vv] = np.ma.zeros((nbuf, NZ, NX))
+    return B
+    
+def get_box(sect_info):
+    """
+    Returns a dict with the indices (j0, j1, i0, i1) of the box bounding all
+    the sections in sect_info, which covers their rho, u and v points, and
+    the list of velocities they need.
+    """
+    j0_list = []; j1_list = []; i0_list = []; i1_list = []
+    vel_list = []
+    for sect_name in sect_info.keys():
+        ii0, ii1, jj0, jj1, sdir, landward, NT, NX, NZ, out_fn = sect_info[sect_name]
+        j0_list.append(jj0); j1_list.append(jj1)
+        i0_list.append(ii0); i1_list.append(ii1)
+        if (sdir=='NS') and ('u' not in vel_list):
+            vel_list.append('u')
+        elif (sdir=='EW') and ('v' not in vel_list):
+            vel_list.append('v')
+    box = {'j0':min(j0_list), 'j1':max(j1_list), 'i0':min(i0_list),
+        'i1':max(i1_list), 'vel_list':vel_list}
+    return box
+    
+def read_box(ds, box, vn_list):
+    """
+    Reads the fields needed by add_fields() from history file ds, as a single
+    hyperslab per variable covering all the sections in the box.  This is
+    much faster than many small reads for each section.
+    """
+    jj = slice(box['j0'], box['j1']+1)
+    ii = slice(box['i0'], box['i1']+1)
+    F = {'j0':box['j0'], 'i0':box['i0']}
+    F['ocean_time'] = ds['ocean_time'][0]
+    F['zeta'] = ds['zeta'][0, jj, ii]
+    for vn in box['vel_list'] + vn_list:
+        F[vn] = ds[vn][0, :, jj, ii]
+    return F
+    
+def add_fields(F, count, S, B):
+    """
+    Adds the fields from a history file, at time index count, to the
+    buffers of a section, and writes them out when the buffers are full.
+    F is the output of read_box() for the history file.
+    """
+    ii0, ii1, jj0, jj1, sdir, landward, NT, NX, NZ, out_fn = B['sinfo']
+    # indices relative to the box
+    ii0 -= F['i0']; ii1 -= F['i0']
+    jj0 -= F['j0']; jj1 -= F['j0']
     
-    # get depth and dz, and dd (which is either dx or dy)
+    if count != B['count0'] + B['nb']:
+        # not the next time index, so start a new block
+        flush_fields(B)
+        B['count0'] = count
+    
+    # get dz
+    zeta = F['zeta'][jj0:jj1+1,ii0:ii1+1].squeeze()
+    z = zrfun.get_z(B['h'], zeta, S, only_w=True)
+    dz = np.diff(z, axis=0)
     if sdir=='NS':
-        h = ds['h'][jj0:jj1+1,ii0:ii1+1].squeeze()
-        zeta = ds['zeta'][0,jj0:jj1+1,ii0:ii1+1].squeeze()
-        z = zrfun.get_z(h, zeta, S, only_w=True)
-        # print(h)
-        # print(zeta)
-        # print(z)
-        dz = np.diff(z, axis=0)
         DZ = dz.mean(axis=2) # fails for a channel one point wide 2019.05.20 (oak)
-        dd = G['DY'][jj0:jj1+1,ii0:ii1+1].squeeze()
-        DD = dd.mean(axis=1)
         zeta = zeta.mean(axis=1)
-        if count==0:
-            hh = h.mean(axis=1)
-            foo['h'][:] = hh
-            
-            z0 = zrfun.get_z(hh, 0*hh, S, only_rho=True)
-            foo['z0'][:] = z0
-            
-            zw0 = zrfun.get_z(hh, 0*hh, S, only_w=True)
-            DZ0 = np.diff(zw0, axis=0)
-            DA0 = DD.reshape((1, NX)) * DZ0
-            foo['DA0'][:] = DA0
-            
     elif sdir=='EW':
-        h = ds['h'][jj0:jj1+1,ii0:ii1+1].squeeze()
-        zeta = ds['zeta'][0,jj0:jj1+1,ii0:ii1+1].squeeze()
-        z = zrfun.get_z(h, zeta, S, only_w=True)
-        dz = np.diff(z, axis=0)
         DZ = dz.mean(axis=1)
-        dd = G['DX'][jj0:jj1+1,ii0:ii1+1].squeeze()
-        DD = dd.mean(axis=0)
         zeta = zeta.mean(axis=0)
-        if count==0:
-            hh = h.mean(axis=0)
-            foo['h'][:] = hh
-            
-            z0 = zrfun.get_z(hh, 0*hh, S, only_rho=True)
-            foo['z0'][:] = z0
-            
-            zw0 = zrfun.get_z(hh, 0*hh, S, only_w=True)
-            DZ0 = np.diff(zw0, axis=0)
-            DA0 = DD.reshape((1, NX)) * DZ0
-            foo['DA0'][:] = DA0
             
     # and then create the array of cell areas on the section
-    DA = DD.reshape((1, NX)) * DZ
+    DA = B['DD'].reshape((1, NX)) * DZ
     # then velocity and hence transport
     if sdir=='NS':
-        vel = ds['u'][0, :, jj0:jj1+1, ii0].squeeze()
+        vel = F['u'][:, jj0:jj1+1, ii0].squeeze()
     elif sdir=='EW':
-        vel = ds['v'][0, :, jj0, ii0:ii1+1].squeeze()
+        vel = F['v'][:, jj0, ii0:ii1+1].squeeze()
     q = vel * DA # * landward
     
-    foo['q'][count, :, :] = q
-    foo['vel'][count, :, :] = vel
-    foo['DA'][count, :, :] = DA
-    foo['zeta'][count, :] = zeta
-    foo['ocean_time'][count] = ds['ocean_time'][0]
+    nb = B['nb']
+    B['q'][nb,:,:] = q
+    B['vel'][nb,:,:] = vel
+    B['DA'][nb,:,:] = DA
+    B['zeta'][nb,:] = zeta
+    B['ocean_time'][nb] = F['ocean_time']
     
     # save the tracer fields averaged onto this section
-    for vn in vn_list:
+    for vn in B['vn_list']:
         if sdir=='NS':
-            vvv = (ds[vn][0,:,jj0:jj1+1,ii0].squeeze()
-                + ds[vn][0,:,jj0:jj1+1,ii1].squeeze())/2
+            vvv = (F[vn][:,jj0:jj1+1,ii0].squeeze()
+                + F[vn][:,jj0:jj1+1,ii1].squeeze())/2
         elif sdir=='EW':
-            vvv = (ds[vn][0,:,jj0,ii0:ii1+1].squeeze()
-                + ds[vn][0,:,jj1,ii0:ii1+1].squeeze())/2
-        foo[vn][count,:,:] = vvv
+            vvv = (F[vn][:,jj0,ii0:ii1+1].squeeze()
+                + F[vn][:,jj1,ii0:ii1+1].squeeze())/2
+        B[vn][nb,:,:] = vvv
         
-    foo.close()
+    B['nb'] += 1
+    if B['nb'] == B['nbuf']:
+        flush_fields(B)
+        
+def flush_fields(B):
+    # write the buffered hours of a section to its output file
+    nb = B['nb']
+    if nb > 0:
+        c0 = B['count0']
+        foo = B['foo']
+        foo['ocean_time'][c0:c0+nb] = B['ocean_time'][:nb]
+        foo['zeta'][c0:c0+nb, :] = B['zeta'][:nb, :]
+        for vv in B['v3_list']:
+            foo[vv][c0:c0+nb, :, :] = B[vv][:nb, :, :]
+    B['count0'] += nb
+    B['nb'] = 0
+    
+def close_sect(B):
+    flush_fields(B)
+    B['foo'].close()